@@ -1,12 +1,25 @@
 from functools import wraps
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify, Response
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 from extensions import db, csrf
 from models import User, SiteSettings
 import logging
 from datetime import datetime
-import secrets
-from auth import send_email
+from mailer import enqueue_email, get_batch_progress, notify_worker
+from settings_cache import invalidate_site_settings
+from page_cache import clear_page_cache
+from svg_utils import sanitize_svg
+from ledger import balance_as_of
+from tokens import PURPOSE_RESET_PASSWORD, generate_token
+from username_index import forget_username, record_username
+from user_search import search_users, unindex_users
+from user_listing import DEFAULT_USERS_PER_PAGE, MAX_USERS_PER_PAGE, count_users, get_user_page
+from platform_stats import get_daily_conversions, get_platform_stats
+from user_bulk import BULK_ACTIONS, MAX_BULK_USERS, apply_bulk_action
+from user_cache import invalidate_user
+from user_deletion import delete_users, start_purge
+from metrics import get_summary, render_prometheus
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -15,7 +28,7 @@ def admin_required(f):
     @login_required
     def decorated_function(*args, **kwargs):
         if not current_user.is_admin:
-            current_app.logger.warning(f'Unauthorized admin access attempt by user: {current_user.username}')
+            current_app.logger.warning('Unauthorized admin access attempt by user: %s', current_user.username)
             flash('You do not have permission to access this area.', 'error')
             return redirect(url_for('profile.dashboard'))
         return f(*args, **kwargs)
@@ -24,41 +37,98 @@ def admin_required(f):
 @admin_bp.route('/dashboard')
 @admin_required
 def dashboard():
-    users_count = User.query.count()
-    unverified_users = User.query.filter_by(email_verified=False).count()
+    # Maintained incrementally on every write, so this never scans the user or balance tables
+    stats = get_platform_stats()
+    conversions = get_daily_conversions(current_app.config.get('STATS_CHART_DAYS', 30))
     
     return render_template('admin/dashboard.html',
-                         users_count=users_count,
-                         unverified_users=unverified_users)
+                         users_count=stats['users_total'],
+                         unverified_users=stats['users_unverified'],
+                         stats=stats,
+                         conversions=conversions)
+
+@admin_bp.route('/metrics')
+@admin_required
+def metrics():
+    # Counters are per worker process; scrape every worker to see them all
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@admin_bp.route('/metrics/summary')
+@admin_required
+def metrics_summary():
+    return jsonify(get_summary())
 
 @admin_bp.route('/users')
 @admin_required
 def user_list():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
+    per_page = request.args.get('per_page', current_app.config.get('ADMIN_USERS_PER_PAGE', DEFAULT_USERS_PER_PAGE), type=int)
+    per_page = max(1, min(per_page, MAX_USERS_PER_PAGE))
     
-    query = User.query
     if search:
-        query = query.filter(
-            (User.username.ilike(f'%{search}%')) |
-            (User.email.ilike(f'%{search}%')) |
-            (User.first_name.ilike(f'%{search}%')) |
-            (User.last_name.ilike(f'%{search}%'))
-        )
-    
-    users = query.paginate(page=page, per_page=10, error_out=False)
-    return render_template('admin/user_list.html', users=users, search=search)
+        # Ranked, index-backed search instead of four leading-wildcard ILIKEs
+        users = search_users(search, page=page, per_page=per_page, options=(joinedload(User.balance),))
+        return render_template('admin/user_list.html', users=users, search=search, per_page=per_page,
+                             bulk_actions=BULK_ACTIONS)
+
+    order = request.args.get('order', 'oldest')
+    users = get_user_page(after=request.args.get('after', type=int),
+                          before=request.args.get('before', type=int),
+                          per_page=per_page,
+                          newest_first=(order == 'newest'),
+                          options=(joinedload(User.balance),))
+    total, estimated = count_users()
+    return render_template('admin/user_list.html', users=users, search=search, per_page=per_page,
+                         order=order, total=total, estimated=estimated, bulk_actions=BULK_ACTIONS)
+
+@admin_bp.route('/users/bulk', methods=['POST'])
+@admin_required
+def bulk_users():
+    action = request.form.get('action')
+    user_ids = request.form.getlist('user_ids', type=int)
+    limit = current_app.config.get('ADMIN_BULK_MAX_USERS', MAX_BULK_USERS)
+
+    if action not in BULK_ACTIONS:
+        flash('Please choose a bulk action.', 'error')
+        return redirect(url_for('admin.user_list'))
+    if not user_ids:
+        flash('Please select at least one user.', 'error')
+        return redirect(url_for('admin.user_list'))
+    if len(user_ids) > limit:
+        flash(f'At most {limit} users can be changed at once.', 'error')
+        return redirect(url_for('admin.user_list'))
+
+    try:
+        result = apply_bulk_action(action, user_ids, current_user)
+    except Exception as e:
+        current_app.logger.error('Error applying bulk %s to %s users: %s', action, len(user_ids), e)
+        flash('Error applying bulk action.', 'error')
+        return redirect(url_for('admin.user_list'))
+
+    current_app.logger.info('Bulk %s applied to %s of %s users by admin %s',
+                            action, result.affected, result.requested, current_user.username)
+    flash(f'{BULK_ACTIONS[action]}: applied to {result.affected} of {result.requested} selected users.', 'success')
+    if result.batch_id:
+        return redirect(url_for('admin.user_list', bulk_batch=result.batch_id))
+    return redirect(url_for('admin.user_list'))
+
+@admin_bp.route('/users/bulk/<batch_id>/progress')
+@admin_required
+def bulk_progress(batch_id):
+    return jsonify(get_batch_progress(batch_id))
 
 @admin_bp.route('/user/<int:user_id>/edit', methods=['GET', 'POST'])
 @admin_required
 def edit_user(user_id):
-    user = User.query.get_or_404(user_id)
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
     
     if request.method == 'POST':
         if user == current_user and not user.is_admin:
             flash('You cannot remove your own admin privileges.', 'error')
             return redirect(url_for('admin.user_list'))
             
+        previous_username = user.username
         user.username = request.form.get('username')
         user.email = request.form.get('email')
         user.first_name = request.form.get('first_name')
@@ -68,33 +138,65 @@ def edit_user(user_id):
         
         try:
             db.session.commit()
-            current_app.logger.info(f'User {user.username} updated by admin {current_user.username}')
+            if user.username != previous_username:
+                forget_username(previous_username)
+                record_username(user.username)
+            current_app.logger.info('User %s updated by admin %s', user.username, current_user.username)
             flash('User updated successfully.', 'success')
             return redirect(url_for('admin.user_list'))
         except Exception as e:
             db.session.rollback()
-            current_app.logger.error(f'Error updating user {user.username}: {str(e)}')
+            current_app.logger.error('Error updating user %s: %s', user.username, e)
             flash('Error updating user.', 'error')
     
     return render_template('admin/edit_user.html', user=user)
 
+@admin_bp.route('/user/<int:user_id>/balance-as-of')
+@admin_required
+def user_balance_as_of(user_id):
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
+
+    at = request.args.get('at')
+    try:
+        as_of = datetime.fromisoformat(at) if at else datetime.utcnow()
+    except ValueError:
+        return jsonify({'error': 'at must be an ISO 8601 timestamp'}), 400
+
+    balance = balance_as_of(user.id, as_of)
+    if balance is None:
+        return jsonify({'error': 'User has no balance record'}), 404
+
+    current_app.logger.info('Balance as of %s for user %s requested by admin %s', as_of.isoformat(), user.username, current_user.username)
+    return jsonify(dict(balance, user_id=user.id, username=user.username))
+
 @admin_bp.route('/user/<int:user_id>/delete', methods=['POST'])
 @admin_required
 def delete_user(user_id):
-    user = User.query.get_or_404(user_id)
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
     
     if user == current_user:
         flash('You cannot delete your own account.', 'error')
         return redirect(url_for('admin.user_list'))
     
+    # The row may be gone after the commit, so keep what is needed afterwards
+    user_id, username = user.id, user.username
     try:
-        db.session.delete(user)
+        # Set-based delete; the database cascades to the balance and ledger
+        deleted = delete_users([user_id])
         db.session.commit()
-        current_app.logger.info(f'User {user.username} deleted by admin {current_user.username}')
+        invalidate_user(user_id)
+        unindex_users([user_id])
+        if deleted.scheduled:
+            if current_app.config.get('USER_PURGE_IN_PROCESS', True):
+                start_purge(current_app._get_current_object())
+            current_app.logger.info('User %s marked deleted by admin %s, ledger purge scheduled', username, current_user.username)
+        else:
+            forget_username(username)
+            current_app.logger.info('User %s deleted by admin %s', username, current_user.username)
         flash('User deleted successfully.', 'success')
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f'Error deleting user {user.username}: {str(e)}')
+        current_app.logger.error('Error deleting user %s: %s', username, e)
         flash('Error deleting user.', 'error')
     
     return redirect(url_for('admin.user_list'))
@@ -102,31 +204,27 @@ def delete_user(user_id):
 @admin_bp.route('/user/<int:user_id>/reset-password', methods=['POST'])
 @admin_required
 def force_password_reset(user_id):
-    user = User.query.get_or_404(user_id)
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
     
     if user == current_user:
         flash('You cannot force reset your own password.', 'error')
         return redirect(url_for('admin.user_list'))
     
     try:
-        user.reset_token = secrets.token_urlsafe(32)
-        db.session.commit()
-        
-        # Send password reset email
+        # Queue the password reset email; the signed token needs no database write
         subject = 'Password Reset Required'
         html_content = render_template('emails/admin_reset_password.html', 
                                      user=user,
-                                     token=user.reset_token)
-        
-        if not send_email(user.email, subject, html_content):
-            flash('Failed to send password reset email.', 'error')
-            return redirect(url_for('admin.user_list'))
+                                     token=generate_token(user, PURPOSE_RESET_PASSWORD))
+        enqueue_email(user.email, subject, html_content)
+        db.session.commit()
+        notify_worker()
             
-        current_app.logger.info(f'Password reset forced for user {user.username} by admin {current_user.username}')
+        current_app.logger.info('Password reset forced for user %s by admin %s', user.username, current_user.username)
         flash('Password reset email sent to user.', 'success')
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f'Error forcing password reset for user {user.username}: {str(e)}')
+        current_app.logger.error('Error forcing password reset for user %s: %s', user.username, e)
         flash('Error processing password reset.', 'error')
     
     return redirect(url_for('admin.user_list'))
@@ -134,7 +232,7 @@ def force_password_reset(user_id):
 @admin_bp.route('/settings', methods=['GET', 'POST'])
 @admin_required
 def site_settings():
-    settings = SiteSettings.get_settings()
+    settings = SiteSettings.get_settings() or SiteSettings.ensure_settings()
     
     if request.method == 'POST':
         try:
@@ -144,10 +242,21 @@ def site_settings():
             new_theme = request.form.get('default_theme', 'autumn')
             new_message = request.form.get('welcome_message')
             new_footer = request.form.get('footer_text')
+
+            # Sanitize and minify the icon once here instead of on every render
+            if new_icon and new_icon.strip():
+                try:
+                    new_icon = sanitize_svg(new_icon)
+                except ValueError as e:
+                    current_app.logger.warning('Rejected site icon upload: %s', e)
+                    flash(f'Invalid site icon: {str(e)}', 'error')
+                    return render_template('admin/site_settings.html', settings=settings)
+            else:
+                new_icon = None
             
             # Debug log before update
-            current_app.logger.debug(f'Current welcome message: {settings.welcome_message}')
-            current_app.logger.debug(f'New welcome message: {new_message}')
+            current_app.logger.debug('Current welcome message: %s', settings.welcome_message)
+            current_app.logger.debug('New welcome message: %s', new_message)
             
             # Update settings
             settings.site_title = new_title
@@ -157,17 +266,19 @@ def site_settings():
             settings.footer_text = new_footer
             settings.updated_at = datetime.utcnow()
             
-            current_app.logger.info(f'Updating site settings - title: {new_title}, theme: {new_theme}')
+            current_app.logger.info('Updating site settings - title: %s, theme: %s', new_title, new_theme)
             db.session.commit()
+            invalidate_site_settings()
+            clear_page_cache()
             
             # Refresh the settings object from the database
             db.session.refresh(settings)
-            current_app.logger.info(f'Site settings updated by admin {current_user.username}')
-            current_app.logger.debug(f'Refreshed welcome message: {settings.welcome_message}')
+            current_app.logger.info('Site settings updated by admin %s', current_user.username)
+            current_app.logger.debug('Refreshed welcome message: %s', settings.welcome_message)
             flash('Site settings updated successfully.', 'success')
         except Exception as e:
             db.session.rollback()
-            current_app.logger.error(f'Error updating site settings: {str(e)}')
+            current_app.logger.error('Error updating site settings: %s', e)
             flash('Error updating site settings.', 'error')
             
     return render_template('admin/site_settings.html', settings=settings)
\ No newline at end of file
@@ -0,0 +1,78 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_login import login_required, current_user
+from currency_utils import convert_currency_batch
+from ledger import get_transaction_page, serialize_transaction, DEFAULT_PAGE_SIZE
+
+api_bp = Blueprint('api', __name__)
+
+# Upper bound on conversion legs accepted in one request
+MAX_CONVERSION_LEGS = 20
+
+
+def _parse_leg(leg):
+    if not isinstance(leg, dict):
+        return None, 'Each conversion must be an object'
+
+    amount = leg.get('amount')
+    from_currency = leg.get('from_currency')
+    to_currency = leg.get('to_currency')
+
+    if not isinstance(amount, int) or isinstance(amount, bool) or amount <= 0:
+        return None, 'Amount must be a positive whole number'
+    if not isinstance(from_currency, str) or not isinstance(to_currency, str):
+        return None, 'Both from_currency and to_currency are required'
+    if from_currency == to_currency:
+        return None, 'Please select different currencies'
+
+    return {'amount': amount, 'from_currency': from_currency, 'to_currency': to_currency}, None
+
+
+@api_bp.route('/convert-currency', methods=['POST'])
+@login_required
+def convert_currency_api():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid JSON payload'}), 400
+
+    # Accept either a single conversion or a list of legs applied in one transaction
+    raw_legs = data.get('legs', [data])
+    if not isinstance(raw_legs, list) or not raw_legs:
+        return jsonify({'error': 'legs must be a non-empty list'}), 400
+    if len(raw_legs) > MAX_CONVERSION_LEGS:
+        return jsonify({'error': f'At most {MAX_CONVERSION_LEGS} conversions per request'}), 400
+
+    legs = []
+    for raw_leg in raw_legs:
+        leg, error = _parse_leg(raw_leg)
+        if error:
+            return jsonify({'error': error}), 400
+        legs.append(leg)
+
+    success, message, balance = convert_currency_batch(current_user, legs)
+    if not success:
+        current_app.logger.info('Currency conversion rejected for user %s: %s', current_user.username, message)
+        return jsonify({'error': message}), 400
+
+    current_app.logger.info('User %s completed %s currency conversion(s)', current_user.username, len(legs))
+    return jsonify({'message': message, 'balance': balance})
+
+
+@api_bp.route('/transactions')
+@login_required
+def transactions_api():
+    try:
+        items, next_cursor = get_transaction_page(
+            current_user.id,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            transaction_type=request.args.get('type') or None,
+            currency_type=request.args.get('currency') or None,
+            include_archived=request.args.get('archived') == '1'
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'transactions': [serialize_transaction(t) for t in items],
+        'next_cursor': next_cursor
+    })
@@ -1,9 +1,7 @@
 import os
-import logging
-from logging.handlers import RotatingFileHandler
 from flask import Flask, redirect, url_for, render_template
 from flask import request, jsonify
-from base64 import b64encode
+from rate_limit import DEFAULT_RATE_LIMITS
 
 # Application configuration
 APP_NAME = "Market Harvest"
@@ -18,6 +16,55 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['WTF_CSRF_ENABLED'] = True
 app.config['WTF_CSRF_SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'dev')
+app.config['SITE_SETTINGS_CACHE_TTL'] = int(os.environ.get('SITE_SETTINGS_CACHE_TTL', 30))
+# Rendered anonymous pages (/, /about, /privacy, /terms) are cached per worker
+app.config['PAGE_CACHE_ENABLED'] = os.environ.get('PAGE_CACHE_ENABLED', 'true').lower() == 'true'
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 300))
+app.config['PAGE_CACHE_MAX_AGE'] = int(os.environ.get('PAGE_CACHE_MAX_AGE', 60))
+# 'write' consolidates holdings on every balance write, 'batch' leaves it to the nightly job
+app.config['CURRENCY_CONSOLIDATION_MODE'] = os.environ.get('CURRENCY_CONSOLIDATION_MODE', 'write')
+app.config['LEDGER_ARCHIVE_DIR'] = os.environ.get('LEDGER_ARCHIVE_DIR', os.path.join('archive', 'ledger'))
+# Balance checkpoints only cover ledger entries older than this, so in-flight writes are never skipped
+app.config['CHECKPOINT_SAFETY_LAG'] = int(os.environ.get('CHECKPOINT_SAFETY_LAG', 300))
+# Password hashing runs on a bounded process pool; 0 workers hashes inline
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 4 * (os.cpu_count() or 1)))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+# Auth throttling; set RATE_LIMIT_STORAGE_URL=redis://... to share counters between workers
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+app.config['RATE_LIMIT_STORAGE_URL'] = os.environ.get('RATE_LIMIT_STORAGE_URL')
+app.config['RATE_LIMIT_TRUST_PROXY'] = os.environ.get('RATE_LIMIT_TRUST_PROXY', 'false').lower() == 'true'
+app.config['RATE_LIMITS'] = dict(DEFAULT_RATE_LIMITS)
+# Signed email verification / password reset tokens; LEGACY_DB_TOKENS keeps accepting
+# tokens stored on user rows until 'flask tokens purge-legacy' has been run
+app.config['VERIFY_TOKEN_MAX_AGE'] = int(os.environ.get('VERIFY_TOKEN_MAX_AGE', 3 * 24 * 3600))
+app.config['RESET_TOKEN_MAX_AGE'] = int(os.environ.get('RESET_TOKEN_MAX_AGE', 3600))
+app.config['LEGACY_DB_TOKENS'] = os.environ.get('LEGACY_DB_TOKENS', 'true').lower() == 'true'
+# Per-worker cache of the logged-in user and balance; 0 loads them on every request
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 5))
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 10000))
+# Admin user list: keyset pages; 'approximate' uses PostgreSQL statistics for large tables
+app.config['ADMIN_USERS_PER_PAGE'] = int(os.environ.get('ADMIN_USERS_PER_PAGE', 25))
+app.config['ADMIN_USER_COUNT_MODE'] = os.environ.get('ADMIN_USER_COUNT_MODE', 'approximate')
+app.config['ADMIN_EXACT_COUNT_THRESHOLD'] = int(os.environ.get('ADMIN_EXACT_COUNT_THRESHOLD', 100000))
+app.config['ADMIN_BULK_MAX_USERS'] = int(os.environ.get('ADMIN_BULK_MAX_USERS', 500))
+# Users with larger ledgers are hidden at once and purged in chunks by `flask users purge-deleted`
+app.config['USER_DELETE_INLINE_LEDGER_ROWS'] = int(os.environ.get('USER_DELETE_INLINE_LEDGER_ROWS', 10000))
+app.config['USER_PURGE_CHUNK_SIZE'] = int(os.environ.get('USER_PURGE_CHUNK_SIZE', 5000))
+app.config['USER_PURGE_IN_PROCESS'] = os.environ.get('USER_PURGE_IN_PROCESS', 'true').lower() == 'true'
+# Per-worker taken-username index used by /auth/check-username
+app.config['USERNAME_INDEX_REFRESH_INTERVAL'] = float(os.environ.get('USERNAME_INDEX_REFRESH_INTERVAL', 5))
+app.config['USERNAME_INDEX_REBUILD_INTERVAL'] = float(os.environ.get('USERNAME_INDEX_REBUILD_INTERVAL', 300))
+# Platform counters are spread over this many rows per counter to avoid hot-row contention
+app.config['STATS_SHARDS'] = int(os.environ.get('STATS_SHARDS', 8))
+app.config['STATS_CHART_DAYS'] = int(os.environ.get('STATS_CHART_DAYS', 30))
+# Per-endpoint latency and SQL histograms for this worker, served at /admin/metrics
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Registered before any other request hook so the timings cover them
+from metrics import init_metrics, instrument_context_processors
+init_metrics(app)
 
 # Initialize database first
 from extensions import db, migrate
@@ -28,54 +75,61 @@ init_extensions(app)
 # Import blueprints after extensions are initialized
 from models import User
 from auth import auth_bp
-from flask_wtf.csrf import CSRFProtect
 from profile import profile_bp
 from admin import admin_bp
+from api import api_bp
 
-# Initialize CSRF protection
-csrf = CSRFProtect(app)
+# CSRF protection is initialized with the other extensions
+from extensions import csrf
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/auth')
 app.register_blueprint(profile_bp, url_prefix='/profile')
 app.register_blueprint(admin_bp)
+app.register_blueprint(api_bp, url_prefix='/api')
 
-# Set up logging
-if not os.path.exists('logs'):
-    os.mkdir('logs')
-
-# Configure logging format
-formatter = logging.Formatter(
-    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-)
-
-# File handler for all levels
-file_handler = RotatingFileHandler('logs/auth_system.log', maxBytes=10240, backupCount=10)
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.DEBUG)
+# Register maintenance CLI commands
+from commands import register_commands
+register_commands(app)
 
-# Stream handler for console output
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-console_handler.setLevel(logging.DEBUG)
+# Logging goes through a queue to a listener thread; see log_setup.py
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+# Per-module overrides, e.g. "admin=DEBUG,mailer=WARNING"
+app.config['LOG_MODULE_LEVELS'] = os.environ.get('LOG_MODULE_LEVELS', '')
+app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'text')  # text or json
+app.config['LOG_FILE'] = os.environ.get('LOG_FILE', 'logs/auth_system.log')
+app.config['LOG_MAX_BYTES'] = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+app.config['LOG_BACKUP_COUNT'] = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+app.config['LOG_CONSOLE'] = os.environ.get('LOG_CONSOLE', 'true').lower() == 'true'
+app.config['LOG_QUEUE_SIZE'] = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Fraction of DEBUG records kept, for noisy debug paths
+app.config['LOG_DEBUG_SAMPLE_RATE'] = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1.0))
 
-# Set up app logger
-app.logger.addHandler(file_handler)
-app.logger.addHandler(console_handler)
-app.logger.setLevel(logging.DEBUG)
+from log_setup import configure_logging
+configure_logging(app)
 
 # Log startup information
 app.logger.info('Auth system startup')
-app.logger.debug('Debug logging enabled')
-
-# Log configuration status
-app.logger.debug(f'SQLALCHEMY_DATABASE_URI configured: {bool(app.config.get("SQLALCHEMY_DATABASE_URI"))}')
-app.logger.debug(f'SECRET_KEY configured: {bool(app.config.get("SECRET_KEY"))}')
-app.logger.debug(f'WTF_CSRF_ENABLED: {app.config.get("WTF_CSRF_ENABLED")}')
+app.logger.debug('Configuration: database URI set: %s, secret key set: %s, CSRF enabled: %s',
+                 bool(app.config.get('SQLALCHEMY_DATABASE_URI')), bool(app.config.get('SECRET_KEY')),
+                 app.config.get('WTF_CSRF_ENABLED'))
 
 # Configure Mailgun
 app.config['MAILGUN_API_KEY'] = os.environ.get('MAILGUN_API_KEY')
 app.config['MAILGUN_DOMAIN'] = os.environ.get('MAILGUN_DOMAIN')
+app.config['MAILGUN_BASE_URL'] = os.environ.get('MAILGUN_BASE_URL', 'https://api.mailgun.net/v3')
+
+# Email outbox delivery; EMAIL_TRANSPORT=log writes emails to the log instead of sending them
+app.config['EMAIL_TRANSPORT'] = os.environ.get('EMAIL_TRANSPORT')
+app.config['EMAIL_TIMEOUT'] = (3.05, float(os.environ.get('EMAIL_TIMEOUT', 10)))
+app.config['EMAIL_OUTBOX_WORKER'] = os.environ.get('EMAIL_OUTBOX_WORKER', 'true').lower() == 'true'
+app.config['EMAIL_OUTBOX_BATCH_SIZE'] = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 50))
+app.config['EMAIL_OUTBOX_POLL_INTERVAL'] = float(os.environ.get('EMAIL_OUTBOX_POLL_INTERVAL', 5))
+app.config['EMAIL_MAX_ATTEMPTS'] = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 8))
+
+# One outbox worker thread per server process, started by its first request
+from mailer import init_worker
+init_worker(app)
 
 # Verify Mailgun configuration and set up email sender
 if app.config['MAILGUN_API_KEY'] and app.config['MAILGUN_DOMAIN']:
@@ -87,92 +141,75 @@ else:
         missing_configs.append('MAILGUN_API_KEY')
     if not app.config['MAILGUN_DOMAIN']:
         missing_configs.append('MAILGUN_DOMAIN')
-    app.logger.warning(f'Mailgun configuration incomplete. Missing: {", ".join(missing_configs)}. Email features will be disabled.')
+    app.logger.warning('Mailgun configuration incomplete. Missing: %s. Email features will be disabled.', ", ".join(missing_configs))
 
 # Add template context processors and filters
-from threading import Lock
-
-# Create a thread-safe lock for site settings
-_settings_lock = Lock()
+from settings_cache import get_site_settings
 
 @app.context_processor
 def inject_site_settings():
-    app.logger.debug('Starting site settings injection')
-    
-    # Default settings
-    DEFAULT_SETTINGS = {
-        'site_title': 'Market Harvest',
-        'welcome_message': 'Welcome to our vibrant community!',
-        'footer_text': '© 2024 Market Harvest. All rights reserved.',
-        'default_theme': 'autumn',
-        'site_icon': None
-    }
+    return {'site_settings': get_site_settings()}
 
-    try:
-        from models import SiteSettings
-        app.logger.debug('Fetching site settings from database')
-        settings = SiteSettings.get_settings()
-        
-        if settings:
-            app.logger.debug(f'Found settings with ID: {settings.id}')
-            # Create a dictionary with all required attributes
-            settings_dict = {
-                'site_title': settings.site_title or DEFAULT_SETTINGS['site_title'],
-                'welcome_message': settings.welcome_message or DEFAULT_SETTINGS['welcome_message'],
-                'footer_text': settings.footer_text or DEFAULT_SETTINGS['footer_text'],
-                'default_theme': settings.default_theme or DEFAULT_SETTINGS['default_theme'],
-                'site_icon': settings.site_icon
-            }
-            app.logger.debug(f'Created settings dictionary with theme: {settings_dict["default_theme"]}')
-        else:
-            app.logger.warning('No settings found in database, using defaults')
-            settings_dict = DEFAULT_SETTINGS.copy()
-        
-        # Convert to an object for attribute access
-        settings_obj = type('Settings', (), settings_dict)()
-        app.logger.debug('Successfully created settings object')
-        return {'site_settings': settings_obj}
-        
-    except Exception as e:
-        app.logger.error(f'Error in site settings context processor: {str(e)}')
-        app.logger.exception('Full traceback:')
-        # Return default settings as an object
-        return {'site_settings': type('DefaultSettings', (), DEFAULT_SETTINGS)()}
+from page_cache import cached_page
+
+# Timezone <option> markup is rendered once per process
+from timezones import timezone_options
+app.add_template_global(timezone_options)
 
-@app.template_filter('b64encode')
-def b64encode_filter(s):
-    if s is None:
-        return ''
-    return b64encode(s.encode()).decode()
+from password_hashing import HashingBusyError
+
+@app.errorhandler(HashingBusyError)
+def hashing_busy(e):
+    # Shed load quickly instead of queueing CPU-bound work behind a login burst
+    app.logger.warning('Password hashing pool saturated, rejecting request')
+    return render_template('errors/busy.html'), 503, {'Retry-After': '2'}
+
+@app.route('/site-icon.svg')
+def site_icon():
+    settings = get_site_settings()
+    if not settings.site_icon:
+        return redirect(url_for('static', filename='img/autumn-leaf.svg'))
+
+    response = app.response_class(settings.site_icon, mimetype='image/svg+xml')
+    response.set_etag(settings.icon_etag)
+    # The icon URL carries the ETag as a version parameter, so it can be cached for a year
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'"
+    return response.make_conditional(request)
 
 @app.route('/')
+@cached_page
 def index():
     from flask_login import current_user
     
-    app.logger.info('Processing index route request')
+    app.logger.debug('Processing index route request')
     theme = 'autumn'  # Default fallback theme
     
     try:
         if current_user.is_authenticated and hasattr(current_user, 'theme') and current_user.theme:
             theme = current_user.theme
-            app.logger.debug(f'Using authenticated user theme: {theme}')
+            app.logger.debug('Using authenticated user theme: %s', theme)
         else:
-            settings = inject_site_settings().get('site_settings')
-            if settings and hasattr(settings, 'default_theme') and settings.default_theme:
+            settings = get_site_settings()
+            if settings.default_theme:
                 theme = settings.default_theme
-                app.logger.debug(f'Using site settings theme: {theme}')
+                app.logger.debug('Using site settings theme: %s', theme)
             app.logger.debug('Using default theme for anonymous user')
     except Exception as e:
-        app.logger.error(f'Error in theme selection: {str(e)}')
+        app.logger.error('Error in theme selection: %s', e)
     
-    app.logger.info(f'Rendering landing page with theme: {theme}')
+    app.logger.debug('Rendering landing page with theme: %s', theme)
     return render_template('landing.html', theme=theme)
 
 @app.route('/privacy')
+@cached_page
 def privacy():
     return render_template('privacy.html')
 
 @app.route('/terms')
+@cached_page
 def terms():
     return render_template('terms.html')
 
@@ -181,22 +218,27 @@ def utility_processor():
     from datetime import datetime
     return {'now': datetime.utcnow()}
 
+# Every context processor is registered by now
+instrument_context_processors(app)
+
 @app.route('/about')
+@cached_page
 def about():
     return render_template('about.html')
 
 @app.route('/log-consent', methods=['POST'])
+@csrf.exempt
 def log_consent():
     try:
         data = request.get_json()
         consent = data.get('consent', False)
         timestamp = data.get('timestamp')
         
-        app.logger.info(f'Cookie consent logged - Status: {consent}, Timestamp: {timestamp}')
+        app.logger.info('Cookie consent logged - Status: %s, Timestamp: %s', consent, timestamp)
         return {'status': 'success'}, 200
         
     except Exception as e:
-        app.logger.error(f'Error logging cookie consent: {str(e)}')
+        app.logger.error('Error logging cookie consent: %s', e)
         return {'status': 'error', 'message': 'Failed to log consent'}, 500
 
 if __name__ == "__main__":
@@ -209,18 +251,11 @@ if __name__ == "__main__":
             
             # Check and initialize site settings if needed
             from models import SiteSettings
-            if not SiteSettings.query.first():
-                default_settings = SiteSettings(
-                    site_title='Market Harvest',
-                    welcome_message='Welcome to our vibrant community!',
-                    footer_text='© 2024 Market Harvest. All rights reserved.',
-                    default_theme='autumn'
-                )
-                db.session.add(default_settings)
-                db.session.commit()
+            if SiteSettings.get_settings() is None:
+                SiteSettings.ensure_settings()
                 app.logger.info("Default site settings created")
     except Exception as e:
-        app.logger.error(f"Failed to initialize application: {str(e)}")
+        app.logger.error('Failed to initialize application: %s', e)
         raise
 
     # Start a single server instance without debug mode or reloader
@@ -2,63 +2,32 @@ from flask import Blueprint, request, flash, redirect, url_for, render_template,
 from datetime import datetime
 from flask_login import login_user, logout_user, login_required
 from extensions import db
-import secrets
-import pytz
-import requests
 from models import User
+from mailer import email_enabled, enqueue_email, notify_worker, send_email_now
+from password_hashing import needs_rehash, record_rehash
+from rate_limit import rate_limited
+from timezones import is_valid_timezone
+from tokens import PURPOSE_RESET_PASSWORD, PURPOSE_VERIFY_EMAIL, clear_legacy_token, generate_token, load_token_user
+from username_index import check_usernames, record_username, validate_username
 
 auth_bp = Blueprint('auth', __name__)
 
-def send_email(to_email, subject, html_content):
-    """
-    Send email using Mailgun API if configured
-    """
-    mailgun_api_key = current_app.config.get('MAILGUN_API_KEY')
-    mailgun_domain = current_app.config.get('MAILGUN_DOMAIN')
-    sender = current_app.config.get('MAIL_DEFAULT_SENDER')
+MAX_USERNAME_BATCH = 20
 
-    if not all([mailgun_api_key, mailgun_domain, sender]):
-        current_app.logger.warning('Mailgun configuration incomplete, skipping email send')
-        return False
-
-    try:
-        response = requests.post(
-            f"https://api.mailgun.net/v3/{mailgun_domain}/messages",
-            auth=("api", mailgun_api_key),
-            data={
-                "from": sender,
-                "to": [to_email],
-                "subject": subject,
-                "html": html_content
-            }
-        )
-        
-        if response.status_code != 200:
-            current_app.logger.error(f'Mailgun API error: {response.text}')
-            return False
-            
-        return True
-        
-    except requests.RequestException as e:
-        current_app.logger.error(f'Mailgun API request error: {str(e)}')
-        return False
 @auth_bp.route('/check-username', methods=['POST'])
+@rate_limited('auth.check_username', json_response=True)
 def check_username():
+    payload = request.get_json(silent=True) or {}
+    if 'usernames' in payload:
+        usernames = payload['usernames']
+        if not isinstance(usernames, list) or not all(isinstance(name, str) for name in usernames):
+            return {'error': 'usernames must be a list of strings'}, 400
+        if len(usernames) > MAX_USERNAME_BATCH:
+            return {'error': f'At most {MAX_USERNAME_BATCH} usernames can be checked at once'}, 400
+        return {'results': check_usernames(usernames)}
+
     username = request.form.get('username', '')
-    
-    # Input validation
-    if not username or len(username) < 3 or len(username) > 20:
-        return {'available': False, 'message': 'Username must be between 3 and 20 characters'}
-        
-    if not username.isalnum() and '_' not in username:
-        return {'available': False, 'message': 'Username can only contain letters, numbers, and underscores'}
-    
-    # Check if username exists
-    user = User.query.filter_by(username=username).first()
-    if user:
-        return {'available': False, 'message': 'Username already taken'}
-        
-    return {'available': True, 'message': 'Username available'}
+    return check_usernames([username])[username]
 
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
@@ -77,40 +46,32 @@ def register():
             flash('All fields are required, including agreement to Terms of Service', 'error')
             return redirect(url_for('auth.register'))
             
-        if not timezone in pytz.common_timezones:
+        if not is_valid_timezone(timezone):
             flash('Please select a valid timezone', 'error')
             return redirect(url_for('auth.register'))
             
         # Username format validation
-        if not username.isalnum() and '_' not in username:
-            flash('Username can only contain letters, numbers, and underscores', 'error')
-            return redirect(url_for('auth.register'))
-            
-        if len(username) < 3 or len(username) > 20:
-            flash('Username must be between 3 and 20 characters', 'error')
+        valid, message = validate_username(username)
+        if not valid:
+            flash(message, 'error')
             return redirect(url_for('auth.register'))
 
         # Check existing users
         if User.query.filter_by(email=email).first():
-            current_app.logger.warning(f'Registration attempted with existing email: {email}')
+            current_app.logger.warning('Registration attempted with existing email: %s', email)
             flash('Email already registered', 'error')
             return redirect(url_for('auth.register'))
             
         if User.query.filter_by(username=username).first():
-            current_app.logger.warning(f'Registration attempted with existing username: {username}')
+            current_app.logger.warning('Registration attempted with existing username: %s', username)
             flash('Username already taken', 'error')
             return redirect(url_for('auth.register'))
 
         try:
             # Check if email verification is available
-            mailgun_configured = all([
-                current_app.config.get('MAILGUN_API_KEY'),
-                current_app.config.get('MAILGUN_DOMAIN'),
-                current_app.config.get('MAIL_DEFAULT_SENDER')
-            ])
-            
-            if not mailgun_configured:
-                current_app.logger.warning('Mailgun not configured, proceeding with registration without email verification')
+            email_configured = email_enabled()
+            if not email_configured:
+                current_app.logger.warning('Email not configured, proceeding with registration without email verification')
 
             # Start database transaction
             user = User(
@@ -122,67 +83,73 @@ def register():
                 terms_accepted=datetime.utcnow()
             )
             user.set_password(password)
-            user.verification_token = secrets.token_urlsafe(32)
             user.avatar_url = f"https://api.dicebear.com/6.x/avataaars/svg?seed={username}"
             
             db.session.add(user)
             
-            if mailgun_configured:
-                # Prepare and send verification email
+            if email_configured:
+                # The verification email is committed together with the user and sent by the outbox worker
                 subject = 'Welcome to Market Harvest - Verify your email'
+                db.session.flush()
                 html_content = render_template('emails/verify.html', 
-                                             token=user.verification_token)
-                
-                # Attempt to send email
-                if send_email(email, subject, html_content):
-                    db.session.commit()
-                    current_app.logger.info(f'New user registered successfully with email verification: {username} ({email})')
-                    flash('Registration successful! Please check your email to verify your account.', 'success')
-                else:
-                    # Email sending failed but continue with registration
-                    user.email_verified = True  # Auto-verify since email sending failed
-                    db.session.commit()
-                    current_app.logger.warning(f'New user registered without email verification due to email service issues: {username} ({email})')
-                    flash('Registration successful! Email verification is currently unavailable.', 'success')
+                                             token=generate_token(user, PURPOSE_VERIFY_EMAIL))
+                enqueue_email(email, subject, html_content)
+                db.session.commit()
+                notify_worker()
+                record_username(username, user.id)
+                current_app.logger.info('New user registered, verification email queued: %s (%s)', username, email)
+                flash('Registration successful! Please check your email to verify your account.', 'success')
             else:
                 # No email verification available
                 user.email_verified = True  # Auto-verify since email verification is not available
                 db.session.commit()
-                current_app.logger.info(f'New user registered without email verification: {username} ({email})')
+                record_username(username, user.id)
+                current_app.logger.info('New user registered without email verification: %s (%s)', username, email)
                 flash('Registration successful!', 'success')
             
             return redirect(url_for('auth.login'))
             
         except ValueError as e:
             db.session.rollback()
-            current_app.logger.error(f'Configuration error during registration: {str(e)}')
+            current_app.logger.error('Configuration error during registration: %s', e)
             flash('Email service configuration error. Please contact support.', 'error')
             return redirect(url_for('auth.register'))
             
         except Exception as e:
             db.session.rollback()
-            current_app.logger.error(f'Error during registration for {email}: {str(e)}')
-            flash('Unable to send verification email. Please try again later.', 'error')
+            current_app.logger.error('Error during registration for %s: %s', email, e)
+            flash('Unable to complete registration. Please try again later.', 'error')
             return redirect(url_for('auth.register'))
             
-    timezones = pytz.common_timezones
-    return render_template('auth/register.html', timezones=timezones)
+    return render_template('auth/register.html')
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
+@rate_limited('auth.login', email_field='email')
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
         remember = request.form.get('remember', False)
         
-        user = User.query.filter_by(email=email).first()
+        user = User.query.filter_by(email=email, deleted_at=None).first()
         if user and user.check_password(password):
             if not user.email_verified:
                 flash('Please verify your email address first.', 'warning')
                 return redirect(url_for('auth.login'))
                 
+            # Upgrade hashes made with older parameters while we have the plaintext
+            if needs_rehash(user.password_hash):
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                    record_rehash()
+                    current_app.logger.info('Password hash upgraded for user: %s', user.username)
+                except Exception as e:
+                    db.session.rollback()
+                    current_app.logger.error('Error upgrading password hash for %s: %s', user.username, e)
+
             login_user(user, remember=remember)
-            current_app.logger.info(f'User logged in: {user.username}')
+            current_app.logger.info('User logged in: %s', user.username)
             return redirect(url_for('profile.dashboard'))
             
         flash('Invalid email or password', 'error')
@@ -197,38 +164,36 @@ def logout():
 
 @auth_bp.route('/verify/<token>')
 def verify_email(token):
-    user = User.query.filter_by(verification_token=token).first()
+    user = load_token_user(token, PURPOSE_VERIFY_EMAIL)
     if user:
         user.email_verified = True
-        user.verification_token = None
+        clear_legacy_token(user, PURPOSE_VERIFY_EMAIL)
         db.session.commit()
         flash('Your email has been verified. You can now login.', 'success')
-        current_app.logger.info(f'Email verified for user: {user.username}')
+        current_app.logger.info('Email verified for user: %s', user.username)
     else:
         flash('Invalid verification token.', 'error')
     return redirect(url_for('auth.login'))
 
 @auth_bp.route('/reset-password', methods=['GET', 'POST'])
+@rate_limited('auth.reset_password', email_field='email')
 def reset_password():
     if request.method == 'POST':
         email = request.form.get('email')
-        user = User.query.filter_by(email=email).first()
+        user = User.query.filter_by(email=email, deleted_at=None).first()
         if user:
-            token = secrets.token_urlsafe(32)
-            user.reset_token = token
-            db.session.commit()
-            
             try:
                 subject = 'Reset your password'
                 html_content = render_template('emails/reset_password.html', 
                                             user=user,
-                                            token=token)
-                if send_email(email, subject, html_content):
-                    flash('Password reset instructions sent to your email.', 'success')
-                else:
-                    flash('Failed to send reset instructions. Please try again later.', 'error')
+                                            token=generate_token(user, PURPOSE_RESET_PASSWORD))
+                enqueue_email(email, subject, html_content)
+                db.session.commit()
+                notify_worker()
+                flash('Password reset instructions sent to your email.', 'success')
             except Exception as e:
-                current_app.logger.error(f'Error sending reset email: {str(e)}')
+                db.session.rollback()
+                current_app.logger.error('Error queueing reset email: %s', e)
                 flash('An error occurred. Please try again later.', 'error')
             
             return redirect(url_for('auth.login'))
@@ -238,7 +203,7 @@ def reset_password():
 
 @auth_bp.route('/reset-password/<token>', methods=['GET', 'POST'])
 def reset_password_confirm(token):
-    user = User.query.filter_by(reset_token=token).first()
+    user = load_token_user(token, PURPOSE_RESET_PASSWORD)
     if not user:
         flash('Invalid or expired reset token.', 'error')
         return redirect(url_for('auth.login'))
@@ -261,22 +226,22 @@ def reset_password_confirm(token):
             
         try:
             user.set_password(password)
-            user.reset_token = None
+            clear_legacy_token(user, PURPOSE_RESET_PASSWORD)
             db.session.commit()
             flash('Your password has been reset successfully. You can now login.', 'success')
             return redirect(url_for('auth.login'))
         except Exception as e:
             db.session.rollback()
-            current_app.logger.error(f'Error resetting password: {str(e)}')
+            current_app.logger.error('Error resetting password: %s', e)
             flash('An error occurred. Please try again later.', 'error')
             
     return render_template('auth/reset_password_confirm.html')
 
 @auth_bp.route('/test-email')
 def test_email():
-    if not current_app.config['MAILGUN_API_KEY'] or not current_app.config['MAILGUN_DOMAIN']:
-        current_app.logger.error('Mailgun configuration missing')
-        return 'Mailgun configuration missing. Please check MAILGUN_API_KEY and MAILGUN_DOMAIN environment variables.'
+    if not email_enabled():
+        current_app.logger.error('Email transport not configured')
+        return 'Email transport not configured. Please check MAILGUN_API_KEY and MAILGUN_DOMAIN environment variables.'
     
     try:
         test_recipient = request.args.get('email', 'test@example.com')
@@ -287,13 +252,14 @@ def test_email():
         subject = 'Test Email from Market Harvest'
         html_content = '<h1>Test Email</h1><p>This is a test email from the Market Harvest authentication system.</p>'
         
-        current_app.logger.info(f'Attempting to send test email to {test_recipient}')
-        send_email(test_recipient, subject, html_content)
+        current_app.logger.info('Attempting to send test email to %s', test_recipient)
+        if not send_email_now(test_recipient, subject, html_content):
+            return 'Error sending test email. Check the logs for details.'
         
         current_app.logger.info('Test email sent successfully')
         return 'Test email sent successfully! Check your inbox.'
         
     except Exception as e:
         error_msg = str(e)
-        current_app.logger.error(f'Error sending test email: {error_msg}')
+        current_app.logger.error('Error sending test email: %s', error_msg)
         return f'Error sending test email: {error_msg}'
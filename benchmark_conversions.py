@@ -0,0 +1,87 @@
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from extensions import db
+from models import User, UserBalance, TransactionHistory
+from app import app
+
+BENCH_EMAIL = 'conversion-bench@marketharvest.com'
+
+
+def setup_bench_user(starting_dabbers):
+    with app.app_context():
+        user = User.query.filter_by(email=BENCH_EMAIL).first()
+        if not user:
+            user = User(email=BENCH_EMAIL, username='conversion_bench',
+                        first_name='Bench', last_name='User', email_verified=True)
+            db.session.add(user)
+            db.session.flush()
+
+        TransactionHistory.query.filter_by(user_id=user.id).delete()
+        balance = UserBalance.query.filter_by(user_id=user.id).first()
+        if not balance:
+            balance = UserBalance(user_id=user.id)
+            db.session.add(balance)
+        balance.dabbers = starting_dabbers
+        balance.groots = 0
+        balance.petalins = 0
+        balance.florens = 0
+        db.session.commit()
+        return user.id
+
+
+def worker(user_id, conversions, amount):
+    from currency_utils import convert_currency
+    succeeded = 0
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        for _ in range(conversions):
+            success, _ = convert_currency(user, 'dabber', 'groot', amount)
+            if success:
+                succeeded += 1
+        db.session.remove()
+    return succeeded
+
+
+def run_benchmark(workers, conversions, amount):
+    # Consolidation would move the numbers being checked, so leave it to the batch job here
+    app.config['CURRENCY_CONSOLIDATION_MODE'] = 'batch'
+
+    # Fund only part of the attempts so the insufficient-balance path is exercised too
+    total_attempts = workers * conversions
+    starting_dabbers = amount * (total_attempts * 3 // 4)
+    user_id = setup_bench_user(starting_dabbers)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda _: worker(user_id, conversions, amount), range(workers)))
+    elapsed = time.monotonic() - started
+
+    succeeded = sum(results)
+    with app.app_context():
+        balance = UserBalance.query.filter_by(user_id=user_id).first()
+        ledger_rows = TransactionHistory.query.filter_by(user_id=user_id).count()
+        expected_dabbers = starting_dabbers - succeeded * amount
+        # Each conversion credits whole groots only; the remainder of amount is lost
+        expected_groots = succeeded * (amount // 1000)
+
+        print(f'{workers} workers x {conversions} conversions in {elapsed:.2f}s '
+              f'({total_attempts / elapsed:.0f} conversions/s)')
+        print(f'Succeeded: {succeeded}, rejected: {total_attempts - succeeded}, ledger rows: {ledger_rows}')
+        print(f'Dabbers: {balance.dabbers} (expected {expected_dabbers}), '
+              f'Groots: {balance.groots} (expected {expected_groots})')
+
+        ok = (balance.dabbers == expected_dabbers and balance.groots == expected_groots
+              and ledger_rows == succeeded and balance.dabbers >= 0)
+        print('No lost updates' if ok else 'LOST UPDATES DETECTED')
+        return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrent currency conversion benchmark')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--conversions', type=int, default=50)
+    parser.add_argument('--amount', type=int, default=1000)
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.workers, args.conversions, args.amount) else 1)
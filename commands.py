@@ -0,0 +1,193 @@
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func
+from extensions import db
+
+currency_cli = AppGroup('currency', help='Currency maintenance jobs.')
+
+
+@currency_cli.command('consolidate')
+@click.option('--start-id', default=0, type=int, help='First user_balance id to process (resume point).')
+@click.option('--end-id', default=None, type=int, help='Stop before this user_balance id.')
+@click.option('--chunk-size', default=5000, type=int, help='Number of ids per transaction.')
+def consolidate_command(start_id, end_id, chunk_size):
+    """Consolidate every user balance with set-based SQL, one id range per transaction."""
+    from models import UserBalance
+    from currency_utils import consolidate_balance_range
+
+    if end_id is None:
+        max_id = db.session.query(func.max(UserBalance.id)).scalar()
+        if max_id is None:
+            click.echo('No balances to consolidate.')
+            return
+        end_id = max_id + 1
+
+    started = time.monotonic()
+    total = 0
+    chunk_start = start_id
+    while chunk_start < end_id:
+        chunk_end = min(chunk_start + chunk_size, end_id)
+        updated = consolidate_balance_range(chunk_start, chunk_end)
+        total += updated
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed > 0 else 0.0
+        click.echo(f'ids [{chunk_start}, {chunk_end}): {updated} rows updated '
+                   f'({total} total, {rate:.0f} rows/s). Resume with --start-id {chunk_end}')
+        chunk_start = chunk_end
+
+    elapsed = time.monotonic() - started
+    rate = total / elapsed if elapsed > 0 else 0.0
+    click.echo(f'Consolidated {total} balances in {elapsed:.2f}s ({rate:.0f} rows/s).')
+
+
+@currency_cli.command('checkpoint')
+@click.option('--start-id', default=0, type=int, help='First user_balance id to process (resume point).')
+@click.option('--chunk-size', default=5000, type=int, help='Number of ids per transaction.')
+def checkpoint_command(start_id, chunk_size):
+    """Snapshot balances that have new ledger entries since their last checkpoint."""
+    from models import UserBalance
+    from ledger import create_checkpoint_range
+
+    max_id = db.session.query(func.max(UserBalance.id)).scalar()
+    if max_id is None:
+        click.echo('No balances to checkpoint.')
+        return
+
+    started = time.monotonic()
+    total = 0
+    for chunk_start in range(start_id, max_id + 1, chunk_size):
+        chunk_end = chunk_start + chunk_size
+        total += create_checkpoint_range(chunk_start, chunk_end)
+        click.echo(f'ids [{chunk_start}, {chunk_end}): {total} checkpoints written. '
+                   f'Resume with --start-id {chunk_end}')
+
+    click.echo(f'Wrote {total} checkpoints in {time.monotonic() - started:.2f}s.')
+
+
+ledger_cli = AppGroup('ledger', help='Transaction history partitioning and archival.')
+
+
+@ledger_cli.command('partitions')
+@click.option('--months-ahead', default=2, type=int, help='How many future months to create.')
+def partitions_command(months_ahead):
+    """Create upcoming monthly transaction_history partitions (PostgreSQL only)."""
+    from ledger_archive import ensure_partitions
+
+    created = ensure_partitions(months_ahead)
+    click.echo(f'Created partitions: {", ".join(created)}' if created else 'No partitions created.')
+
+
+@ledger_cli.command('archive')
+@click.option('--month', 'months', multiple=True, help='Month to archive as YYYY-MM (repeatable).')
+@click.option('--older-than', default=None, type=int,
+              help='Archive every closed month older than this many months.')
+@click.option('--directory', default=None, help='Archive directory (defaults to LEDGER_ARCHIVE_DIR).')
+def archive_command(months, older_than, directory):
+    """Move closed months of transaction history to compressed NDJSON files."""
+    from datetime import date, datetime
+    from flask import current_app
+    from models import LedgerArchive, TransactionHistory
+    from ledger_archive import archive_month, month_start, next_month
+
+    directory = directory or current_app.config['LEDGER_ARCHIVE_DIR']
+    targets = [datetime.strptime(month, '%Y-%m').date() for month in months]
+
+    if older_than is not None:
+        oldest = db.session.query(func.min(TransactionHistory.timestamp)).scalar()
+        cutoff = month_start(date.today())
+        for _ in range(older_than):
+            cutoff = month_start(date.fromordinal(cutoff.toordinal() - 1))
+        month = month_start(oldest) if oldest else cutoff
+        archived = {archive.month for archive in LedgerArchive.query.all()}
+        while month < cutoff:
+            if month not in archived:
+                targets.append(month)
+            month = next_month(month)
+
+    if not targets:
+        click.echo('Nothing to archive.')
+        return
+
+    for month in sorted(set(targets)):
+        try:
+            archive = archive_month(month, directory)
+            click.echo(f'{month:%Y-%m}: {archive.row_count} rows -> {archive.path}')
+        except ValueError as e:
+            click.echo(f'{month:%Y-%m}: skipped ({str(e)})')
+
+
+email_cli = AppGroup('email', help='Email outbox delivery.')
+
+
+@email_cli.command('drain')
+@click.option('--batch-size', default=None, type=int, help='Messages per batch (defaults to EMAIL_OUTBOX_BATCH_SIZE).')
+def drain_command(batch_size):
+    """Send every email in the outbox that is currently due."""
+    from mailer import deliver_pending, email_enabled
+
+    if not email_enabled():
+        click.echo('Email transport not configured.')
+        return
+
+    totals = {'sent': 0, 'retried': 0, 'failed': 0}
+    while True:
+        counts = deliver_pending(batch_size)
+        if not counts['claimed']:
+            break
+        for key in totals:
+            totals[key] += counts[key]
+        click.echo(f"Batch: {counts['sent']} sent, {counts['retried']} retrying, {counts['failed']} failed")
+
+    click.echo(f"Done: {totals['sent']} sent, {totals['retried']} retrying, {totals['failed']} failed.")
+
+
+tokens_cli = AppGroup('tokens', help='Verification and reset token maintenance.')
+
+
+@tokens_cli.command('purge-legacy')
+def purge_legacy_command():
+    """Clear random tokens stored on user rows before signed tokens were introduced."""
+    from tokens import purge_legacy_tokens
+
+    cleared = purge_legacy_tokens()
+    click.echo(f'Cleared legacy tokens from {cleared} users. Set LEGACY_DB_TOKENS=false to stop looking them up.')
+
+
+stats_cli = AppGroup('stats', help='Platform statistics maintenance.')
+
+
+@stats_cli.command('reconcile')
+@click.option('--days', default=7, show_default=True, help='Recent days of conversions to recount.')
+def reconcile_stats_command(days):
+    """Recompute the dashboard counters from the source tables and fix any drift."""
+    from platform_stats import reconcile_stats
+
+    corrections = reconcile_stats(days=days)
+    if not corrections:
+        click.echo('Platform statistics are up to date.')
+        return
+    for name, correction in corrections.items():
+        click.echo(f'{name}: {correction:+d}')
+
+
+users_cli = AppGroup('users', help='User account maintenance.')
+
+
+@users_cli.command('purge-deleted')
+@click.option('--chunk-size', default=None, type=int, help='Ledger rows deleted per transaction.')
+def purge_deleted_command(chunk_size):
+    """Remove users marked deleted, deleting their ledger in small transactions."""
+    from user_deletion import purge_deleted_users
+
+    purged = purge_deleted_users(chunk_size=chunk_size)
+    click.echo(f"Purged {purged['users']} users and {purged['transactions']} ledger entries.")
+
+
+def register_commands(app):
+    app.cli.add_command(currency_cli)
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(email_cli)
+    app.cli.add_command(tokens_cli)
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(users_cli)
@@ -43,7 +43,7 @@ def create_admin_user():
             
         except Exception as e:
             db.session.rollback()
-            app.logger.error(f'Error creating admin user: {str(e)}')
+            app.logger.error('Error creating admin user: %s', e)
             return False
 
 if __name__ == '__main__':
@@ -1,8 +1,18 @@
 from decimal import Decimal
 from typing import Tuple
+from sqlalchemy import text
 from datetime import datetime
+from flask import current_app
 from models import User, UserBalance, TransactionHistory, CurrencyType, TransactionType
 from extensions import db
+from user_cache import invalidate_user
+from platform_stats import increment_stats, record_conversions
+
+# When lower denominations are consolidated into higher ones:
+# 'write' - as part of every balance write (conversions)
+# 'batch' - only by the scheduled batch job or an explicit user request
+CONSOLIDATION_MODE_WRITE = 'write'
+CONSOLIDATION_MODE_BATCH = 'batch'
 
 # Conversion rates (base currency is Dabbers)
 CONVERSION_RATES = {
@@ -11,6 +21,17 @@ CONVERSION_RATES = {
     'petalin_to_floren': Decimal('10'),    # 10 Petalins = 1 Floren
 }
 
+# Automatic consolidation rates used by optimize_currency_holdings and the batch job
+CONSOLIDATION_RATES = {
+    'dabber_to_groot': 10,      # 10 Dabbers = 1 Groot
+    'groot_to_petalin': 5,      # 5 Groots = 1 Petalin
+    'petalin_to_floren': 2,     # 2 Petalins = 1 Floren
+}
+
+def get_consolidation_mode() -> str:
+    """Get the configured consolidation mode."""
+    return current_app.config.get('CURRENCY_CONSOLIDATION_MODE', CONSOLIDATION_MODE_WRITE)
+
 def get_conversion_rate(from_currency: str, to_currency: str) -> Decimal:
     """Calculate conversion rate between two currencies."""
     conversion_map = {
@@ -25,128 +46,271 @@ def get_conversion_rate(from_currency: str, to_currency: str) -> Decimal:
     
     return conversion_map.get((from_currency, to_currency), Decimal('0'))
 
-def validate_conversion(user: User, from_currency: str, to_currency: str, amount: int) -> Tuple[bool, str]:
-    """Validate if a currency conversion is possible."""
-    if not user.balance:
-        return False, "User has no balance record"
-        
+def _apply_conversion(user_id: int, from_currency: str, to_currency: str, amount: int) -> Tuple[bool, str, object]:
+    """Debit and credit a balance with one conditional UPDATE and record it in the ledger.
+
+    Nothing is committed. The balance check happens inside the database, so
+    concurrent conversions for the same user can never lose an update; when
+    the row count is zero the balance was insufficient (or missing).
+    Returns (success, message, updated balance row or None).
+    """
     if amount <= 0:
-        return False, "Amount must be positive"
-        
-    current_balance = getattr(user.balance, f"{from_currency}s", 0)
-    if current_balance < amount:
-        return False, f"Insufficient {from_currency} balance"
-        
-    return True, "Conversion possible"
+        return False, "Amount must be positive", None
+
+    rate = get_conversion_rate(from_currency, to_currency)
+    if rate == 0:
+        return False, "Invalid conversion path", None
+
+    converted_amount = int(Decimal(amount) / rate)
+
+    balances = UserBalance.__table__
+    from_column = balances.c[f"{from_currency}s"]
+    to_column = balances.c[f"{to_currency}s"]
+    now = datetime.utcnow()
+
+    row = db.session.execute(
+        balances.update()
+        .where(balances.c.user_id == user_id, from_column >= amount)
+        .values({
+            from_column: from_column - amount,
+            to_column: to_column + converted_amount,
+            balances.c.last_updated: now
+        })
+        .returning(balances.c.dabbers, balances.c.groots, balances.c.petalins, balances.c.florens)
+    ).first()
+
+    if row is None:
+        has_balance = db.session.query(UserBalance.id).filter_by(user_id=user_id).first() is not None
+        if not has_balance:
+            return False, "User has no balance record", None
+        return False, f"Insufficient {from_currency} balance", None
+
+    # Record transaction
+    db.session.execute(TransactionHistory.__table__.insert().values(
+        user_id=user_id,
+        currency_type=f"{from_currency}_to_{to_currency}",
+        amount=amount,
+        counter_amount=converted_amount,
+        transaction_type=TransactionType.CONVERSION.value,
+        timestamp=now,
+        description=f"Converted {amount} {from_currency}s to {converted_amount} {to_currency}s"
+    ))
+    increment_stats({f"{from_currency}s": -amount, f"{to_currency}s": converted_amount})
+    record_conversions(1)
+
+    return True, f"Successfully converted {amount} {from_currency}s to {converted_amount} {to_currency}s", row
 
 def convert_currency(user: User, from_currency: str, to_currency: str, amount: int) -> Tuple[bool, str]:
-    """Convert currency from one type to another."""
-    # Validate the conversion
-    is_valid, message = validate_conversion(user, from_currency, to_currency, amount)
-    if not is_valid:
-        return False, message
-        
+    """Convert currency from one type to another atomically."""
     try:
-        # Calculate conversion
-        rate = get_conversion_rate(from_currency, to_currency)
-        if rate == 0:
-            return False, "Invalid conversion path"
-            
-        converted_amount = int(Decimal(amount) / rate)
-        
-        # Update balances
-        from_balance = getattr(user.balance, f"{from_currency}s")
-        to_balance = getattr(user.balance, f"{to_currency}s")
-        
-        setattr(user.balance, f"{from_currency}s", from_balance - amount)
-        setattr(user.balance, f"{to_currency}s", to_balance + converted_amount)
-        user.balance.last_updated = datetime.utcnow()
-        
-        # Record transaction
-        transaction = TransactionHistory(
-            user_id=user.id,
-            currency_type=f"{from_currency}_to_{to_currency}",
-            amount=amount,
-            transaction_type=TransactionType.CONVERSION,
-            description=f"Converted {amount} {from_currency}s to {converted_amount} {to_currency}s"
-        )
-        
-        db.session.add(transaction)
+        success, message, _ = _apply_conversion(user.id, from_currency, to_currency, amount)
+        if not success:
+            db.session.rollback()
+            return False, message
+
+        if get_consolidation_mode() == CONSOLIDATION_MODE_WRITE:
+            _run_consolidation('user_id = :user_id', {'user_id': user.id})
+
         db.session.commit()
-        
-        return True, f"Successfully converted {amount} {from_currency}s to {converted_amount} {to_currency}s"
+        invalidate_user(user.id)
+        return True, message
         
     except Exception as e:
         db.session.rollback()
         return False, f"Error during conversion: {str(e)}"
 
+def convert_currency_batch(user: User, legs: list) -> Tuple[bool, str, dict]:
+    """Apply several conversion legs in a single transaction.
+
+    Each leg is a dict with from_currency, to_currency and amount. Either all
+    legs are applied or none are. Returns (success, message, balance dict).
+    """
+    if not legs:
+        return False, "No conversions requested", None
+
+    try:
+        messages = []
+        row = None
+        for index, leg in enumerate(legs, start=1):
+            success, message, row = _apply_conversion(
+                user.id, leg['from_currency'], leg['to_currency'], leg['amount'])
+            if not success:
+                db.session.rollback()
+                if len(legs) > 1:
+                    message = f"Conversion {index} failed: {message}"
+                return False, message, None
+            messages.append(message)
+
+        if get_consolidation_mode() == CONSOLIDATION_MODE_WRITE:
+            _run_consolidation('user_id = :user_id', {'user_id': user.id})
+            balances = UserBalance.__table__
+            row = db.session.execute(
+                balances.select()
+                .with_only_columns(balances.c.dabbers, balances.c.groots, balances.c.petalins, balances.c.florens)
+                .where(balances.c.user_id == user.id)
+            ).first()
+
+        db.session.commit()
+        invalidate_user(user.id)
+        return True, "; ".join(messages), dict(row._mapping)
+
+    except Exception as e:
+        db.session.rollback()
+        return False, f"Error during conversion: {str(e)}", None
+
 def optimize_currency_holdings(user: User) -> Tuple[bool, str]:
     """Automatically optimize currency holdings by converting lower denominations to higher when possible."""
     if not user.balance:
         return False, "No balance record found"
         
     try:
-        # Check and convert Dabbers to Groots (10 Dabbers = 1 Groot)
-        if user.balance.dabbers >= 10:
-            groots_to_add = user.balance.dabbers // 10
-            remaining_dabbers = user.balance.dabbers % 10
-            if groots_to_add > 0:
-                user.balance.groots += groots_to_add
-                user.balance.dabbers = remaining_dabbers
-                # Record transaction
-                transaction = TransactionHistory(
-                    user_id=user.id,
-                    currency_type='dabber_to_groot',
-                    amount=groots_to_add * 10,
-                    transaction_type=TransactionType.CONVERSION,
-                    description=f'Automatic conversion: {groots_to_add * 10} Dabbers to {groots_to_add} Groots'
-                )
-                db.session.add(transaction)
-        
-        # Check and convert Groots to Petalins (5 Groots = 1 Petalin)
-        if user.balance.groots >= 5:
-            petalins_to_add = user.balance.groots // 5
-            remaining_groots = user.balance.groots % 5
-            if petalins_to_add > 0:
-                user.balance.petalins += petalins_to_add
-                user.balance.groots = remaining_groots
-                # Record transaction
-                transaction = TransactionHistory(
-                    user_id=user.id,
-                    currency_type='groot_to_petalin',
-                    amount=petalins_to_add * 5,
-                    transaction_type=TransactionType.CONVERSION,
-                    description=f'Automatic conversion: {petalins_to_add * 5} Groots to {petalins_to_add} Petalins'
-                )
-                db.session.add(transaction)
-        
-        # Check and convert Petalins to Florens (2 Petalins = 1 Floren)
-        if user.balance.petalins >= 2:
-            florens_to_add = user.balance.petalins // 2
-            remaining_petalins = user.balance.petalins % 2
-            if florens_to_add > 0:
-                user.balance.florens += florens_to_add
-                user.balance.petalins = remaining_petalins
-                # Record transaction
-                transaction = TransactionHistory(
-                    user_id=user.id,
-                    currency_type='petalin_to_floren',
-                    amount=florens_to_add * 2,
-                    transaction_type=TransactionType.CONVERSION,
-                    description=f'Automatic conversion: {florens_to_add * 2} Petalins to {florens_to_add} Florens'
-                )
-                db.session.add(transaction)
-        
-        user.balance.last_updated = datetime.utcnow()
+        _run_consolidation('user_id = :user_id', {'user_id': user.id})
         db.session.commit()
+        invalidate_user(user.id)
         return True, "Currency holdings optimized successfully"
         
     except Exception as e:
         db.session.rollback()
         return False, f"Error optimizing currency holdings: {str(e)}"
 
+def _consolidation_sql(where: str, dialect: str) -> list:
+    """Build the set-based statements that consolidate every matching user_balance row.
+
+    Dabbers roll up into Groots, then Groots (including the new ones) into
+    Petalins, then Petalins into Florens, using CONSOLIDATION_RATES. The
+    first statement returns one summary row of what was (or will be) moved.
+    """
+    d_rate = CONSOLIDATION_RATES['dabber_to_groot']
+    g_rate = CONSOLIDATION_RATES['groot_to_petalin']
+    p_rate = CONSOLIDATION_RATES['petalin_to_floren']
+
+    groots_added = f"(dabbers / {d_rate})"
+    petalins_added = f"((groots + {groots_added}) / {g_rate})"
+    florens_added = f"((petalins + {petalins_added}) / {p_rate})"
+    eligible = f"({where}) AND (dabbers >= {d_rate} OR groots >= {g_rate} OR petalins >= {p_rate})"
+
+    ledger_select = f"""
+        SELECT user_id, 'dabber_to_groot', groots_added * {d_rate}, groots_added, 'conversion', :now,
+               'Automatic conversion: ' || (groots_added * {d_rate}) || ' Dabbers to ' || groots_added || ' Groots'
+        FROM {{source}} WHERE groots_added > 0
+        UNION ALL
+        SELECT user_id, 'groot_to_petalin', petalins_added * {g_rate}, petalins_added, 'conversion', :now,
+               'Automatic conversion: ' || (petalins_added * {g_rate}) || ' Groots to ' || petalins_added || ' Petalins'
+        FROM {{source}} WHERE petalins_added > 0
+        UNION ALL
+        SELECT user_id, 'petalin_to_floren', florens_added * {p_rate}, florens_added, 'conversion', :now,
+               'Automatic conversion: ' || (florens_added * {p_rate}) || ' Petalins to ' || florens_added || ' Florens'
+        FROM {{source}} WHERE florens_added > 0
+    """
+    ledger_insert = ("INSERT INTO transaction_history "
+                     "(user_id, currency_type, amount, counter_amount, transaction_type, timestamp, description)")
+    # Totals for the platform counters: rows changed, units moved and ledger entries written
+    summary_select = """
+        SELECT COUNT(*) AS updated,
+               COALESCE(SUM(groots_added), 0) AS groots_added,
+               COALESCE(SUM(petalins_added), 0) AS petalins_added,
+               COALESCE(SUM(florens_added), 0) AS florens_added,
+               COALESCE(SUM(CASE WHEN groots_added > 0 THEN 1 ELSE 0 END
+                            + CASE WHEN petalins_added > 0 THEN 1 ELSE 0 END
+                            + CASE WHEN florens_added > 0 THEN 1 ELSE 0 END), 0) AS conversions
+        FROM {source}
+    """
+
+    if dialect == 'postgresql':
+        # One round trip: lock, update with RETURNING and write the ledger from the returned rows
+        return [f"""
+            WITH src AS (
+                SELECT id, user_id,
+                       {groots_added} AS groots_added,
+                       {petalins_added} AS petalins_added,
+                       {florens_added} AS florens_added
+                FROM user_balance
+                WHERE {eligible}
+                FOR UPDATE
+            ),
+            upd AS (
+                UPDATE user_balance ub SET
+                    dabbers = ub.dabbers - src.groots_added * {d_rate},
+                    groots = ub.groots + src.groots_added - src.petalins_added * {g_rate},
+                    petalins = ub.petalins + src.petalins_added - src.florens_added * {p_rate},
+                    florens = ub.florens + src.florens_added,
+                    last_updated = :now
+                FROM src
+                WHERE ub.id = src.id
+                RETURNING src.user_id, src.groots_added, src.petalins_added, src.florens_added
+            ),
+            ins AS (
+                {ledger_insert}
+                {ledger_select.format(source='upd')}
+                RETURNING 1
+            )
+            {summary_select.format(source='upd')}
+        """]
+
+    # Portable fallback: summarise and write the ledger from the current values, then update the same rows.
+    # All statements run in the caller's transaction; the UPDATE right-hand sides see old values.
+    source = f"""(
+        SELECT user_id,
+               {groots_added} AS groots_added,
+               {petalins_added} AS petalins_added,
+               {florens_added} AS florens_added
+        FROM user_balance
+        WHERE {eligible}
+    ) AS src"""
+    return [
+        summary_select.format(source=source),
+        f"{ledger_insert} {ledger_select.format(source=source)}",
+        f"""
+            UPDATE user_balance SET
+                dabbers = dabbers - {groots_added} * {d_rate},
+                groots = groots + {groots_added} - {petalins_added} * {g_rate},
+                petalins = petalins + {petalins_added} - {florens_added} * {p_rate},
+                florens = florens + {florens_added},
+                last_updated = :now
+            WHERE {eligible}
+        """
+    ]
+
+def _run_consolidation(where: str, params: dict) -> int:
+    """Consolidate the user_balance rows matching where, without committing.
+
+    Returns the number of balance rows that were changed.
+    """
+    dialect = db.session.get_bind().dialect.name
+    statements = _consolidation_sql(where, dialect)
+    params = dict(params, now=datetime.utcnow())
+
+    # The first statement always yields the summary row (on PostgreSQL it also does the work)
+    summary = db.session.execute(text(statements[0]), params).one()
+    for statement in statements[1:]:
+        db.session.execute(text(statement), params)
+
+    if summary.updated:
+        increment_stats({
+            'dabbers': -summary.groots_added * CONSOLIDATION_RATES['dabber_to_groot'],
+            'groots': summary.groots_added - summary.petalins_added * CONSOLIDATION_RATES['groot_to_petalin'],
+            'petalins': summary.petalins_added - summary.florens_added * CONSOLIDATION_RATES['petalin_to_floren'],
+            'florens': summary.florens_added
+        })
+        record_conversions(summary.conversions)
+    return summary.updated
+
+def consolidate_balance_range(start_id: int, end_id: int) -> int:
+    """Consolidate all user_balance rows with start_id <= id < end_id in one transaction.
+
+    Returns the number of balance rows that were changed.
+    """
+    try:
+        updated = _run_consolidation('id >= :start_id AND id < :end_id',
+                                     {'start_id': start_id, 'end_id': end_id})
+        db.session.commit()
+        return updated
+    except Exception:
+        db.session.rollback()
+        raise
+
 def get_user_balance(user: User) -> dict:
-    """Get formatted user balance."""
+    """Get formatted user balance without modifying it."""
     if not user.balance:
         return {
             'dabbers': 0,
@@ -155,9 +319,7 @@ def get_user_balance(user: User) -> dict:
             'florens': 0
         }
     
-    # Optimize currency holdings before returning balance
-    optimize_currency_holdings(user)
-    
+    # Pure read: consolidation happens on write or in the batch job, never here
     return {
         'dabbers': user.balance.dabbers,
         'groots': user.balance.groots,
@@ -0,0 +1,238 @@
+import re
+import base64
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from flask import current_app
+from sqlalchemy import tuple_, text
+from extensions import db
+from models import TransactionHistory, BalanceCheckpoint, UserBalance
+from ledger_archive import archived_months, archived_transactions
+
+CURRENCY_COLUMNS = ('dabbers', 'groots', 'petalins', 'florens')
+
+# Older conversion entries only record the credited amount in the description
+_CREDITED_AMOUNT = re.compile(r' to (\d+) ', re.IGNORECASE)
+
+# Default and maximum page sizes for transaction history
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(timestamp: datetime, transaction_id: int) -> str:
+    """Encode the position of a ledger entry as an opaque cursor string."""
+    raw = f"{timestamp.isoformat()}|{transaction_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor produced by encode_cursor. Raises ValueError if it is malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, transaction_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(transaction_id)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {str(e)}')
+
+
+def serialize_transaction(transaction) -> dict:
+    return {
+        'id': transaction.id,
+        'timestamp': transaction.timestamp.isoformat(),
+        'transaction_type': transaction.transaction_type,
+        'currency_type': transaction.currency_type,
+        'amount': transaction.amount,
+        'description': transaction.description
+    }
+
+
+def get_transaction_page(user_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                         transaction_type: Optional[str] = None,
+                         currency_type: Optional[str] = None,
+                         include_archived: bool = False) -> Tuple[list, Optional[str]]:
+    """Get one page of a user's transactions, newest first, using keyset pagination.
+
+    The cursor marks the last entry of the previous page, so every page is an
+    index range scan on (user_id, timestamp, id) regardless of its depth.
+    With include_archived, pages continue into archived months once the hot
+    table is exhausted.
+    Returns (transactions, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    query = TransactionHistory.query.filter(TransactionHistory.user_id == user_id)
+    if transaction_type:
+        query = query.filter(TransactionHistory.transaction_type == transaction_type)
+    if currency_type:
+        query = query.filter(TransactionHistory.currency_type == currency_type)
+
+    position = None
+    if cursor:
+        position = decode_cursor(cursor)
+        query = query.filter(
+            tuple_(TransactionHistory.timestamp, TransactionHistory.id) < tuple_(*position)
+        )
+
+    # Fetch one extra row to know whether another page exists without a COUNT
+    rows = query.order_by(TransactionHistory.timestamp.desc(), TransactionHistory.id.desc()) \
+        .limit(limit + 1).all()
+
+    if include_archived and len(rows) <= limit:
+        rows += _archived_page(user_id, rows[-1] if rows else position, limit + 1 - len(rows),
+                               transaction_type, currency_type)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+    return rows, next_cursor
+
+
+def _archived_page(user_id, after, count, transaction_type, currency_type) -> list:
+    """Get up to count archived transactions older than after, newest first."""
+    if after is not None and not isinstance(after, tuple):
+        after = (after.timestamp, after.id)
+
+    matches = []
+    # Archived months are disjoint and in timestamp order, so the newest months
+    # that fill the page are the only ones that need to be read
+    for transactions in archived_months(user_id, until=after[0] if after else None):
+        matches += [
+            transaction for transaction in transactions
+            if (not transaction_type or transaction.transaction_type == transaction_type)
+            and (not currency_type or transaction.currency_type == currency_type)
+            and (after is None or (transaction.timestamp, transaction.id) < after)
+        ]
+        if len(matches) >= count:
+            break
+    matches.sort(key=lambda transaction: (transaction.timestamp, transaction.id), reverse=True)
+    return matches[:count]
+
+
+def transaction_deltas(transaction) -> dict:
+    """Get the per-currency balance change caused by a ledger entry."""
+    deltas = {}
+    currency_type = transaction.currency_type or ''
+
+    if transaction.transaction_type == 'conversion' and '_to_' in currency_type:
+        from_currency, to_currency = currency_type.split('_to_', 1)
+        credited = transaction.counter_amount
+        if credited is None:
+            match = _CREDITED_AMOUNT.search(transaction.description or '')
+            credited = int(match.group(1)) if match else 0
+        deltas[f"{from_currency}s"] = -transaction.amount
+        deltas[f"{to_currency}s"] = deltas.get(f"{to_currency}s", 0) + credited
+    elif transaction.transaction_type in ('credit', 'debit'):
+        column = currency_type if currency_type.endswith('s') else f"{currency_type}s"
+        sign = 1 if transaction.transaction_type == 'credit' else -1
+        deltas[column] = sign * transaction.amount
+
+    # Entries such as the 'all' rate-change markers carry no balance change
+    return {column: value for column, value in deltas.items() if column in CURRENCY_COLUMNS}
+
+
+def create_checkpoint_range(start_id: int, end_id: int) -> int:
+    """Checkpoint every balance with start_id <= user_balance.id < end_id that has new ledger entries.
+
+    Ledger ids are assigned before commit, so a row with a lower id can still
+    become visible after a higher one. A checkpoint therefore only covers
+    entries older than CHECKPOINT_SAFETY_LAG seconds, which are all committed:
+    ledger_id is the newest of those, and the balance is the live balance
+    minus the visible entries after it. Both come from one statement, so they
+    see the same snapshot.
+    Returns the number of checkpoints written.
+    """
+    safe_before = datetime.utcnow() - timedelta(seconds=current_app.config.get('CHECKPOINT_SAFETY_LAG', 300))
+    try:
+        rows = db.session.execute(text("""
+            SELECT src.user_id, src.ledger_id, src.dabbers, src.groots, src.petalins, src.florens,
+                   th.id, th.currency_type, th.amount, th.counter_amount, th.transaction_type, th.description
+            FROM (
+                SELECT ub.user_id, ub.dabbers, ub.groots, ub.petalins, ub.florens,
+                       COALESCE((SELECT MAX(th.id) FROM transaction_history th
+                                 WHERE th.user_id = ub.user_id AND th.timestamp < :safe_before), 0) AS ledger_id
+                FROM user_balance ub
+                WHERE ub.id >= :start_id AND ub.id < :end_id
+            ) AS src
+            LEFT JOIN transaction_history th ON th.user_id = src.user_id AND th.id > src.ledger_id
+            WHERE src.ledger_id > COALESCE((SELECT MAX(bc.ledger_id) FROM balance_checkpoint bc
+                                            WHERE bc.user_id = src.user_id), -1)
+        """), {'start_id': start_id, 'end_id': end_id, 'safe_before': safe_before}).all()
+
+        checkpoints = {}
+        for row in rows:
+            checkpoint = checkpoints.get(row.user_id)
+            if checkpoint is None:
+                checkpoint = checkpoints[row.user_id] = {
+                    'user_id': row.user_id, 'ledger_id': row.ledger_id, 'created_at': safe_before,
+                    **{column: getattr(row, column) for column in CURRENCY_COLUMNS}
+                }
+            if row.id is not None:
+                # Take the entries after ledger_id back out of the live balance
+                for column, delta in transaction_deltas(row).items():
+                    checkpoint[column] -= delta
+
+        if checkpoints:
+            db.session.execute(BalanceCheckpoint.__table__.insert(), list(checkpoints.values()))
+        db.session.commit()
+        return len(checkpoints)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def balance_as_of(user_id: int, as_of: datetime) -> Optional[dict]:
+    """Reconstruct a user's balance at a point in time.
+
+    Starts from the nearest checkpoint taken at or before as_of and replays
+    only the ledger entries after it. If no such checkpoint exists, the
+    earliest later checkpoint (or the live balance) is rolled back instead.
+    Returns None if the user has no balance at all.
+    """
+    checkpoint = BalanceCheckpoint.query.filter(
+        BalanceCheckpoint.user_id == user_id,
+        BalanceCheckpoint.created_at <= as_of
+    ).order_by(BalanceCheckpoint.created_at.desc(), BalanceCheckpoint.id.desc()).first()
+
+    if checkpoint is not None:
+        # Roll forward from the checkpoint
+        balance = {column: getattr(checkpoint, column) for column in CURRENCY_COLUMNS}
+        entries = TransactionHistory.query.filter(
+            TransactionHistory.user_id == user_id,
+            TransactionHistory.id > checkpoint.ledger_id,
+            TransactionHistory.timestamp <= as_of
+        ).order_by(TransactionHistory.id).all()
+        entries += archived_transactions(user_id, until=as_of, after_id=checkpoint.ledger_id)
+        sign = 1
+        source = {'checkpoint_id': checkpoint.id, 'checkpoint_at': checkpoint.created_at.isoformat()}
+    else:
+        # Roll back from the earliest later checkpoint, or from the live balance
+        checkpoint = BalanceCheckpoint.query.filter(
+            BalanceCheckpoint.user_id == user_id
+        ).order_by(BalanceCheckpoint.created_at, BalanceCheckpoint.id).first()
+
+        query = TransactionHistory.query.filter(
+            TransactionHistory.user_id == user_id,
+            TransactionHistory.timestamp > as_of
+        )
+        up_to_id = checkpoint.ledger_id if checkpoint is not None else None
+        archived = [entry for entry in archived_transactions(user_id, since=as_of, up_to_id=up_to_id)
+                    if entry.timestamp > as_of]
+        if checkpoint is not None:
+            balance = {column: getattr(checkpoint, column) for column in CURRENCY_COLUMNS}
+            query = query.filter(TransactionHistory.id <= checkpoint.ledger_id)
+            source = {'checkpoint_id': checkpoint.id, 'checkpoint_at': checkpoint.created_at.isoformat()}
+        else:
+            current = UserBalance.query.filter_by(user_id=user_id).first()
+            if current is None:
+                return None
+            balance = {column: getattr(current, column) for column in CURRENCY_COLUMNS}
+            source = {'checkpoint_id': None, 'checkpoint_at': None}
+        entries = query.order_by(TransactionHistory.id.desc()).all() + archived
+        sign = -1
+
+    for entry in entries:
+        for column, delta in transaction_deltas(entry).items():
+            balance[column] += sign * delta
+
+    return dict(balance, as_of=as_of.isoformat(), replayed_entries=len(entries), **source)
@@ -0,0 +1,246 @@
+import os
+import gzip
+import json
+import struct
+from itertools import groupby
+from datetime import date, datetime
+from typing import NamedTuple, Optional
+from flask import current_app
+from sqlalchemy import text, inspect
+from extensions import db
+from models import LedgerArchive
+
+ARCHIVE_COLUMNS = ('id', 'user_id', 'currency_type', 'amount', 'counter_amount',
+                   'transaction_type', 'timestamp', 'description')
+
+# Sidecar index entry: user_id, byte offset and byte length of the user's gzip member
+INDEX_ENTRY = struct.Struct('<qqq')
+
+
+class ArchivedTransaction(NamedTuple):
+    """A transaction_history row read back from an archive file."""
+    id: int
+    user_id: int
+    currency_type: str
+    amount: int
+    counter_amount: Optional[int]
+    transaction_type: str
+    timestamp: datetime
+    description: Optional[str]
+
+
+def month_start(day) -> date:
+    return date(day.year, day.month, 1)
+
+
+def next_month(day: date) -> date:
+    return date(day.year + (day.month // 12), day.month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"transaction_history_y{month.year}m{month.month:02d}"
+
+
+def _is_postgres() -> bool:
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def _table_exists(name: str) -> bool:
+    return inspect(db.session.connection()).has_table(name)
+
+
+def ensure_partitions(months_ahead: int = 2) -> list:
+    """Create monthly PostgreSQL partitions from the current month up to months_ahead.
+
+    Returns the names of the partitions that were created. Does nothing on
+    databases without native partitioning.
+    """
+    if not _is_postgres():
+        return []
+
+    created = []
+    month = month_start(date.today())
+    for _ in range(months_ahead + 1):
+        name = partition_name(month)
+        if not _table_exists(name):
+            db.session.execute(text(f"""
+                CREATE TABLE {name} PARTITION OF transaction_history
+                FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')
+            """))
+            created.append(name)
+        month = next_month(month)
+    db.session.commit()
+    return created
+
+
+def _detach_month(month: date) -> str:
+    """Move a month out of the hot table into its own table and return that table's name."""
+    name = partition_name(month)
+    if _table_exists(name) and _is_postgres():
+        attached = db.session.execute(text(
+            "SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE c.relname = :name"
+        ), {'name': name}).first()
+        if attached:
+            db.session.execute(text(f"ALTER TABLE transaction_history DETACH PARTITION {name}"))
+        db.session.commit()
+        return name
+
+    if not _table_exists(name):
+        # Table-per-month equivalent for databases without native partitions
+        bounds = {'start': datetime.combine(month, datetime.min.time()),
+                  'end': datetime.combine(next_month(month), datetime.min.time())}
+        db.session.execute(text(f"""
+            CREATE TABLE {name} AS SELECT * FROM transaction_history
+            WHERE timestamp >= :start AND timestamp < :end
+        """), bounds)
+        db.session.execute(text(
+            "DELETE FROM transaction_history WHERE timestamp >= :start AND timestamp < :end"
+        ), bounds)
+        db.session.commit()
+    return name
+
+
+def index_path(path: str) -> str:
+    return f"{path}.idx"
+
+
+def _archive_record(row) -> str:
+    record = dict(row._mapping)
+    timestamp = record['timestamp']
+    record['timestamp'] = timestamp.isoformat() if isinstance(timestamp, datetime) else str(timestamp)
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def archive_month(month: date, directory: str) -> LedgerArchive:
+    """Archive one closed month of transaction history to a gzipped NDJSON file.
+
+    Rows are written sorted by (user_id, id), each user's rows as a separate
+    gzip member, and a sidecar index sorted by user_id records where each
+    member starts. Reading one user's month then decompresses only their rows.
+    The month is first detached from the hot table, then streamed to disk and
+    only dropped once the files and the ledger_archive record are written.
+    Re-running after a failure picks up the detached table again.
+    """
+    month = month_start(month)
+    if next_month(month) > month_start(date.today()):
+        raise ValueError(f'{month:%Y-%m} is not closed yet and cannot be archived')
+    if LedgerArchive.query.filter_by(month=month).first():
+        raise ValueError(f'{month:%Y-%m} has already been archived')
+
+    table = _detach_month(month)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"transaction_history_{month:%Y_%m}.ndjson.gz")
+    partial_path = f"{path}.partial"
+    partial_index_path = f"{index_path(path)}.partial"
+
+    row_count = 0
+    min_id = max_id = None
+    result = db.session.connection().execution_options(stream_results=True, yield_per=1000).execute(
+        text(f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM {table} ORDER BY user_id, id")
+    )
+    with open(partial_path, 'wb') as archive_file, open(partial_index_path, 'wb') as index_file:
+        for user_id, rows in groupby(result, key=lambda row: row.user_id):
+            offset = archive_file.tell()
+            # Concatenated gzip members still read back as one ordinary gzip file
+            with gzip.GzipFile(fileobj=archive_file, mode='wb') as member:
+                for row in rows:
+                    member.write(_archive_record(row).encode('utf-8'))
+                    row_count += 1
+                    min_id = row.id if min_id is None else min(min_id, row.id)
+                    max_id = row.id if max_id is None else max(max_id, row.id)
+            index_file.write(INDEX_ENTRY.pack(user_id, offset, archive_file.tell() - offset))
+    os.replace(partial_index_path, index_path(path))
+    os.replace(partial_path, path)
+
+    archive = LedgerArchive(month=month, path=path, row_count=row_count, min_id=min_id, max_id=max_id)
+    db.session.add(archive)
+    db.session.execute(text(f"DROP TABLE {table}"))
+    db.session.commit()
+
+    current_app.logger.info('Archived %s transactions for %s to %s', row_count, month.strftime('%Y-%m'), path)
+    return archive
+
+
+def _find_member(index_file, user_id: int):
+    """Binary search the sidecar index for a user's (offset, length), or None."""
+    index_file.seek(0, os.SEEK_END)
+    low, high = 0, index_file.tell() // INDEX_ENTRY.size
+    while low < high:
+        middle = (low + high) // 2
+        index_file.seek(middle * INDEX_ENTRY.size)
+        entry_user_id, offset, length = INDEX_ENTRY.unpack(index_file.read(INDEX_ENTRY.size))
+        if entry_user_id == user_id:
+            return offset, length
+        if entry_user_id < user_id:
+            low = middle + 1
+        else:
+            high = middle
+    return None
+
+
+def _user_lines(archive: LedgerArchive, user_id: int):
+    """Yield the NDJSON lines of a user's gzip member in an archive."""
+    if not os.path.exists(index_path(archive.path)):
+        raise FileNotFoundError(f'{archive.path} has no sidecar index at {index_path(archive.path)}')
+
+    with open(index_path(archive.path), 'rb') as index_file:
+        member = _find_member(index_file, user_id)
+    if member is None:
+        return
+    offset, length = member
+    with open(archive.path, 'rb') as archive_file:
+        archive_file.seek(offset)
+        yield from gzip.decompress(archive_file.read(length)).decode('utf-8').splitlines()
+
+
+def _read_archive(archive: LedgerArchive, user_id: int):
+    for line in _user_lines(archive, user_id):
+        record = json.loads(line)
+        record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+        yield ArchivedTransaction(**{column: record.get(column) for column in ARCHIVE_COLUMNS})
+
+
+def _archives(since=None, until=None, after_id=None, up_to_id=None):
+    query = LedgerArchive.query
+    if since is not None:
+        query = query.filter(LedgerArchive.month >= month_start(since))
+    if until is not None:
+        query = query.filter(LedgerArchive.month <= month_start(until))
+    # min_id/max_id skip whole months outside an id range, e.g. before a checkpoint
+    if after_id is not None:
+        query = query.filter(LedgerArchive.max_id > after_id)
+    if up_to_id is not None:
+        query = query.filter(LedgerArchive.min_id <= up_to_id)
+    return query
+
+
+def archived_transactions(user_id: int, since: Optional[datetime] = None,
+                          until: Optional[datetime] = None, after_id: Optional[int] = None,
+                          up_to_id: Optional[int] = None) -> list:
+    """Read a user's archived transactions between since and until (inclusive), oldest first.
+
+    after_id and up_to_id further limit the result to after_id < id <= up_to_id.
+    """
+    transactions = []
+    for archive in _archives(since, until, after_id, up_to_id).order_by(LedgerArchive.month).all():
+        for transaction in _read_archive(archive, user_id):
+            if since is not None and transaction.timestamp < since:
+                continue
+            if until is not None and transaction.timestamp > until:
+                continue
+            if after_id is not None and transaction.id <= after_id:
+                continue
+            if up_to_id is not None and transaction.id > up_to_id:
+                continue
+            transactions.append(transaction)
+    return transactions
+
+
+def archived_months(user_id: int, until: Optional[datetime] = None):
+    """Yield a user's archived transactions one month at a time, newest month first.
+
+    Callers paging backwards stop iterating once they have enough rows, so
+    older months are never opened.
+    """
+    for archive in _archives(until=until).order_by(LedgerArchive.month.desc()):
+        yield list(_read_archive(archive, user_id))
@@ -0,0 +1,145 @@
+import os
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask.logging import default_handler
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ModuleLevelFilter(logging.Filter):
+    """Apply a per-module minimum level to records from the shared app logger."""
+
+    def __init__(self, default_level, module_levels):
+        super().__init__()
+        self.default_level = default_level
+        self.module_levels = module_levels
+
+    def filter(self, record):
+        return record.levelno >= self.module_levels.get(record.module, self.default_level)
+
+
+class DebugSampler(logging.Filter):
+    """Keep only a fraction of DEBUG records; higher levels always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never block the calling thread: when the queue is full the record is dropped and counted."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merge the arguments here, while ORM objects are still safe to read, but
+        # keep the traceback apart from the message so the listener's formatter places it
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_level(value) -> int:
+    level = logging.getLevelName(str(value).strip().upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level: {value}")
+    return level
+
+
+def parse_module_levels(value) -> dict:
+    """Parse 'admin=DEBUG,mailer=WARNING' into {module: level}."""
+    levels = {}
+    for item in (value or '').split(','):
+        if item.strip():
+            module, _, level = item.partition('=')
+            levels[module.strip()] = _parse_level(level)
+    return levels
+
+
+def stop_logging(listener):
+    """Flush whatever is still queued and stop the listener thread (safe to call twice)."""
+    if listener._thread is not None:
+        listener.stop()
+
+
+def configure_logging(app):
+    """Route app.logger through a queue so file and console I/O happen on a listener thread.
+
+    The request thread only runs the level checks, filters and %-formatting
+    of the message; lazy arguments are never formatted for records that are
+    filtered out.
+    """
+    level = _parse_level(app.config.get('LOG_LEVEL', 'INFO'))
+    module_levels = parse_module_levels(app.config.get('LOG_MODULE_LEVELS'))
+
+    formatter = JsonFormatter() if app.config.get('LOG_FORMAT') == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+    log_file = app.config.get('LOG_FILE')
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        handlers.append(RotatingFileHandler(log_file, maxBytes=app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+                                            backupCount=app.config.get('LOG_BACKUP_COUNT', 5),
+                                            encoding='utf-8', delay=True))
+    if app.config.get('LOG_CONSOLE', True):
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000))
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(ModuleLevelFilter(level, module_levels))
+    sample_rate = app.config.get('LOG_DEBUG_SAMPLE_RATE', 1.0)
+    if sample_rate < 1.0:
+        queue_handler.addFilter(DebugSampler(sample_rate))
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging, listener)
+
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(queue_handler)
+    # The logger lets through the most verbose configured level; the filter applies the rest
+    app.logger.setLevel(min([level, *module_levels.values()]))
+    app.extensions['log_listener'] = listener
+    app.extensions['log_queue_handler'] = queue_handler
+    return listener
@@ -0,0 +1,295 @@
+import os
+import random
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from extensions import db
+from models import EmailOutbox
+
+STATUS_PENDING = 'pending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+class EmailDeliveryError(Exception):
+    """Raised by a transport when a message could not be delivered.
+
+    Permanent errors (e.g. a rejected recipient) are not retried.
+    """
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class MailgunTransport:
+    """Sends through the Mailgun HTTP API over one keep-alive session."""
+
+    def __init__(self, base_url, api_key, domain, sender, timeout):
+        self.url = f"{base_url.rstrip('/')}/{domain}/messages"
+        self.sender = sender
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = ('api', api_key)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def send(self, to_email, subject, html):
+        try:
+            response = self.session.post(self.url, data={
+                'from': self.sender,
+                'to': [to_email],
+                'subject': subject,
+                'html': html
+            }, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise EmailDeliveryError(f'Mailgun API request error: {str(e)}')
+
+        if response.status_code != 200:
+            # Client errors other than throttling will fail the same way on retry
+            permanent = 400 <= response.status_code < 500 and response.status_code != 429
+            raise EmailDeliveryError(f'Mailgun API error {response.status_code}: {response.text[:200]}',
+                                     permanent=permanent)
+
+
+class LogTransport:
+    """Writes messages to the application log instead of sending them."""
+
+    def send(self, to_email, subject, html):
+        current_app.logger.info('Email to %s: %s', to_email, subject)
+
+
+_transport_lock = Lock()
+_transport = None
+_transport_key = None
+
+
+def _transport_name():
+    name = current_app.config.get('EMAIL_TRANSPORT')
+    if name:
+        return name
+    if all([current_app.config.get('MAILGUN_API_KEY'),
+            current_app.config.get('MAILGUN_DOMAIN'),
+            current_app.config.get('MAIL_DEFAULT_SENDER')]):
+        return 'mailgun'
+    return None
+
+
+def email_enabled() -> bool:
+    """Whether outgoing email is configured at all."""
+    return _transport_name() is not None
+
+
+def get_transport():
+    """Get this process's transport, rebuilding it after a fork or configuration change."""
+    global _transport, _transport_key
+    name = _transport_name()
+    key = (os.getpid(), name, current_app.config.get('MAILGUN_BASE_URL'))
+    with _transport_lock:
+        if _transport is None or _transport_key != key:
+            if name == 'mailgun':
+                _transport = MailgunTransport(
+                    current_app.config.get('MAILGUN_BASE_URL', 'https://api.mailgun.net/v3'),
+                    current_app.config['MAILGUN_API_KEY'],
+                    current_app.config['MAILGUN_DOMAIN'],
+                    current_app.config['MAIL_DEFAULT_SENDER'],
+                    current_app.config.get('EMAIL_TIMEOUT', (3.05, 10))
+                )
+            elif name == 'log':
+                _transport = LogTransport()
+            else:
+                raise ValueError(f'Unknown email transport: {name}')
+            _transport_key = key
+        return _transport
+
+
+def send_email_now(to_email, subject, html) -> bool:
+    """Send one email synchronously. Request handlers should use enqueue_email instead."""
+    if not email_enabled():
+        current_app.logger.warning('Email transport not configured, skipping email send')
+        return False
+    try:
+        get_transport().send(to_email, subject, html)
+        return True
+    except EmailDeliveryError as e:
+        current_app.logger.error(str(e))
+        return False
+
+
+def enqueue_email(to_email, subject, html) -> EmailOutbox:
+    """Add an email to the outbox in the current transaction.
+
+    The message is only visible to the worker once the caller commits, so it
+    is sent if and only if the surrounding change is saved.
+    """
+    message = EmailOutbox(to_email=to_email, subject=subject, html=html)
+    db.session.add(message)
+    return message
+
+
+def enqueue_emails(messages, batch_id=None) -> int:
+    """Add many (to_email, subject, html) messages to the outbox with one multi-row insert.
+
+    Like enqueue_email nothing is committed. batch_id lets callers follow
+    the delivery progress of the whole group with get_batch_progress.
+    """
+    rows = [
+        {'to_email': to_email, 'subject': subject, 'html': html, 'batch_id': batch_id}
+        for to_email, subject, html in messages
+    ]
+    if rows:
+        db.session.execute(EmailOutbox.__table__.insert(), rows)
+    return len(rows)
+
+
+def get_batch_progress(batch_id) -> dict:
+    """Count the emails of a batch by delivery status."""
+    progress = {STATUS_PENDING: 0, STATUS_SENT: 0, STATUS_FAILED: 0}
+    rows = db.session.query(EmailOutbox.status, db.func.count(EmailOutbox.id)).filter(
+        EmailOutbox.batch_id == batch_id
+    ).group_by(EmailOutbox.status)
+    progress.update({status: count for status, count in rows})
+    progress['total'] = sum(progress.values())
+    return progress
+
+
+def _claim_batch(batch_size):
+    """Lease a batch of due messages so no other worker picks them up meanwhile.
+
+    PostgreSQL skips rows another worker has locked. Elsewhere each lease is a
+    conditional UPDATE on the state that was read, and a message only counts
+    as claimed if that UPDATE changed it, so two senders never claim the same row.
+    """
+    now = datetime.utcnow()
+    query = EmailOutbox.query.filter(
+        EmailOutbox.status == STATUS_PENDING,
+        EmailOutbox.next_attempt_at <= now
+    ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id).limit(batch_size)
+    lease_until = now + timedelta(seconds=current_app.config.get('EMAIL_OUTBOX_LEASE', 300))
+    claimed = []
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        for message in query.with_for_update(skip_locked=True).all():
+            message.attempts += 1
+            message.next_attempt_at = lease_until
+            claimed.append((message.id, message.to_email, message.subject, message.html, message.attempts))
+        db.session.commit()
+        return claimed
+
+    table = EmailOutbox.__table__
+    for message in query.all():
+        leased = db.session.execute(table.update().where(
+            table.c.id == message.id,
+            table.c.status == STATUS_PENDING,
+            table.c.attempts == message.attempts,
+            table.c.next_attempt_at <= now
+        ).values(attempts=message.attempts + 1, next_attempt_at=lease_until)).rowcount
+        if leased:
+            claimed.append((message.id, message.to_email, message.subject, message.html, message.attempts + 1))
+    db.session.commit()
+    return claimed
+
+
+def _retry_delay(attempts):
+    base = current_app.config.get('EMAIL_RETRY_BASE', 30)
+    delay = min(base * 2 ** (attempts - 1), current_app.config.get('EMAIL_RETRY_MAX', 3600))
+    return delay + random.uniform(0, delay / 10)
+
+
+def deliver_pending(batch_size=None) -> dict:
+    """Send one batch of due outbox messages and record the outcome of each."""
+    batch_size = batch_size or current_app.config.get('EMAIL_OUTBOX_BATCH_SIZE', 50)
+    counts = {'claimed': 0, 'sent': 0, 'retried': 0, 'failed': 0}
+    claimed = _claim_batch(batch_size)
+    if not claimed:
+        return counts
+
+    counts['claimed'] = len(claimed)
+    transport = get_transport()
+    max_attempts = current_app.config.get('EMAIL_MAX_ATTEMPTS', 8)
+    table = EmailOutbox.__table__
+
+    for message_id, to_email, subject, html, attempts in claimed:
+        try:
+            transport.send(to_email, subject, html)
+            values = {'status': STATUS_SENT, 'sent_at': datetime.utcnow(), 'last_error': None}
+            counts['sent'] += 1
+        except Exception as e:
+            # Anything unexpected is retried like a temporary failure so one bad row can't stop the batch
+            permanent = isinstance(e, EmailDeliveryError) and e.permanent
+            if permanent or attempts >= max_attempts:
+                values = {'status': STATUS_FAILED, 'last_error': str(e)}
+                counts['failed'] += 1
+                current_app.logger.error('Email %s to %s failed permanently: %s', message_id, to_email, e)
+            else:
+                values = {'last_error': str(e),
+                          'next_attempt_at': datetime.utcnow() + timedelta(seconds=_retry_delay(attempts))}
+                counts['retried'] += 1
+                current_app.logger.warning('Email %s to %s failed, will retry: %s', message_id, to_email, e,
+                                           exc_info=not isinstance(e, EmailDeliveryError))
+        # Record each outcome as soon as it is known, so a crash later in the
+        # batch never leaves a sent message pending to be sent again
+        db.session.execute(table.update().where(table.c.id == message_id).values(**values))
+        db.session.commit()
+    return counts
+
+
+_wake = Event()
+_worker = None
+_worker_lock = Lock()
+
+
+def notify_worker():
+    """Wake the background worker so freshly committed messages go out right away."""
+    _wake.set()
+
+
+def start_worker(app):
+    """Start the background delivery thread for this process, unless it is already running."""
+    global _worker
+    with _worker_lock:
+        if _worker is not None and _worker.is_alive():
+            return _worker
+        _worker = Thread(target=_run_worker, args=(app,), name='email-outbox', daemon=True)
+        _worker.start()
+    app.logger.info('Email outbox worker started')
+    return _worker
+
+
+def init_worker(app):
+    """Start the worker on the first request each process serves.
+
+    Pre-forking servers may import the app before forking (gunicorn --preload)
+    and threads do not survive a fork, so the worker is not started at import
+    time. CLI commands never start it.
+    """
+    if not app.config.get('EMAIL_OUTBOX_WORKER', True):
+        return
+
+    @app.before_request
+    def ensure_email_worker():
+        if _worker is None or not _worker.is_alive():
+            start_worker(app)
+
+
+def _run_worker(app):
+    interval = app.config.get('EMAIL_OUTBOX_POLL_INTERVAL', 5)
+    while True:
+        counts = None
+        with app.app_context():
+            try:
+                if email_enabled():
+                    counts = deliver_pending()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error('Email outbox worker error: %s', e)
+            finally:
+                db.session.remove()
+        # Keep going without sleeping while full batches are coming back
+        if not counts or counts['claimed'] < app.config.get('EMAIL_OUTBOX_BATCH_SIZE', 50):
+            _wake.wait(interval)
+            _wake.clear()
+
@@ -10,24 +10,24 @@ def make_user_admin(username):
             user = User.query.filter_by(username=username).first()
             
             if not user:
-                app.logger.error(f'User {username} not found')
+                app.logger.error('User %s not found', username)
                 return False, f'User {username} not found'
                 
             if user.is_admin:
-                app.logger.info(f'User {username} is already an admin')
+                app.logger.info('User %s is already an admin', username)
                 return True, f'User {username} is already an admin'
             
             # Update admin status
             user.is_admin = True
             db.session.commit()
             
-            app.logger.info(f'Successfully made {username} an admin')
+            app.logger.info('Successfully made %s an admin', username)
             return True, f'Successfully made {username} an admin'
             
         except Exception as e:
             db.session.rollback()
             error_msg = str(e)
-            app.logger.error(f'Error making {username} admin: {error_msg}')
+            app.logger.error('Error making %s admin: %s', username, error_msg)
             return False, f'Error making {username} admin: {error_msg}'
 
 if __name__ == '__main__':
@@ -0,0 +1,339 @@
+import time
+import threading
+from collections import deque
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Fixed histogram bucket upper bounds; observations above the last one land in +Inf
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+REQUEST_SECONDS = 'harvest_request_duration_seconds'
+REQUEST_QUERIES = 'harvest_request_sql_queries'
+REQUEST_SQL_SECONDS = 'harvest_request_sql_duration_seconds'
+RESPONSE_BYTES = 'harvest_response_size_bytes'
+CONTEXT_PROCESSOR_SECONDS = 'harvest_context_processor_duration_seconds'
+
+HISTOGRAMS = {
+    REQUEST_SECONDS: ('endpoint', SECONDS_BUCKETS, 'Wall time from the first before_request hook to the response.'),
+    REQUEST_QUERIES: ('endpoint', QUERY_BUCKETS, 'SQL statements executed per request.'),
+    REQUEST_SQL_SECONDS: ('endpoint', SECONDS_BUCKETS, 'Time spent executing SQL per request.'),
+    RESPONSE_BYTES: ('endpoint', BYTES_BUCKETS, 'Response body size.'),
+    CONTEXT_PROCESSOR_SECONDS: ('processor', SECONDS_BUCKETS, 'Time spent in each template context processor.'),
+}
+
+
+class Histogram:
+    """Fixed-bucket histogram, written only by the thread that owns it."""
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.sum += other.sum
+
+
+class _Shard:
+    """The histograms and response counters written by one thread at a time."""
+
+    def __init__(self):
+        self.histograms = {}  # (metric, label) -> Histogram
+        self.responses = {}  # (endpoint, status) -> count
+
+    def observe(self, metric, label, value):
+        histogram = self.histograms.get((metric, label))
+        if histogram is None:
+            histogram = self.histograms[(metric, label)] = Histogram(HISTOGRAMS[metric][1])
+        histogram.observe(value)
+
+    def merge(self, other):
+        for key, histogram in dict(other.histograms).items():
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(histogram.bounds)
+            self.histograms[key].merge(histogram)
+        for key, count in dict(other.responses).items():
+            self.responses[key] = self.responses.get(key, 0) + count
+
+
+# Each thread records into a shard no other live thread writes to, without
+# locking. When a thread ends, its thread-local lease is released and the
+# shard goes back to a free list for the next new thread, so a server that
+# starts a thread per request keeps reusing as many shards as it ever ran
+# threads at once. The lock only guards the list of all shards, which grows
+# when more threads than ever before are recording at the same time.
+_local = threading.local()
+_registry_lock = Lock()
+_shards = []
+_free = deque()
+
+
+class _Lease:
+    """Holds a thread's shard; dropped with the thread's locals when the thread ends."""
+    __slots__ = ('shard',)
+
+    def __init__(self, shard):
+        self.shard = shard
+
+    def __del__(self):
+        _free.append(self.shard)
+
+
+def _shard() -> _Shard:
+    lease = getattr(_local, 'lease', None)
+    if lease is None:
+        try:
+            shard = _free.pop()
+        except IndexError:
+            shard = _Shard()
+            with _registry_lock:
+                _shards.append(shard)
+        lease = _local.lease = _Lease(shard)
+    return lease.shard
+
+
+def _collect() -> _Shard:
+    """Sum every shard into a snapshot.
+
+    Shards are read while their threads keep writing, so a snapshot can be
+    off by the requests in flight, which is fine for monitoring.
+    """
+    with _registry_lock:
+        shards = list(_shards)
+    total = _Shard()
+    for shard in shards:
+        total.merge(shard)
+    return total
+
+
+class _RequestStats:
+    __slots__ = ('started', 'queries', 'sql_seconds', 'query_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.query_started = None
+
+
+def _start_request():
+    _local.request = _RequestStats()
+
+
+def _finish_request(response):
+    stats = getattr(_local, 'request', None)
+    if stats is None:
+        return response
+    _local.request = None
+    endpoint = request.endpoint or 'unmatched'
+    shard = _shard()
+    shard.observe(REQUEST_SECONDS, endpoint, time.perf_counter() - stats.started)
+    shard.observe(REQUEST_QUERIES, endpoint, stats.queries)
+    shard.observe(REQUEST_SQL_SECONDS, endpoint, stats.sql_seconds)
+    # Streamed and file responses have no length until they are sent
+    if response.content_length is not None:
+        shard.observe(RESPONSE_BYTES, endpoint, response.content_length)
+    key = (endpoint, response.status_code)
+    shard.responses[key] = shard.responses.get(key, 0) + 1
+    return response
+
+
+def _reset_request(exc=None):
+    _local.request = None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    stats = getattr(_local, 'request', None)
+    if stats is not None:
+        stats.query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    stats = getattr(_local, 'request', None)
+    if stats is not None and stats.query_started is not None:
+        stats.queries += 1
+        stats.sql_seconds += time.perf_counter() - stats.query_started
+        stats.query_started = None
+
+
+def _timed_processor(function):
+    name = f"{function.__module__}.{function.__name__}"
+
+    @wraps(function)
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _shard().observe(CONTEXT_PROCESSOR_SECONDS, name, time.perf_counter() - started)
+    return timed
+
+
+def init_metrics(app):
+    """Time every request and the SQL it runs; register before the blueprints.
+
+    The first before_request hook and the last after_request hook are the
+    ones registered first, so the recorded wall time covers the others.
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_reset_request)
+
+
+def instrument_context_processors(app):
+    """Wrap every context processor registered so far with a timer."""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    for processors in app.template_context_processors.values():
+        processors[:] = [_timed_processor(function) for function in processors]
+
+
+def _quantile(bounds, counts, q):
+    """Estimate a quantile by interpolating within its bucket, like histogram_quantile."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(counts):
+        if count and seen + count >= rank:
+            if index == len(bounds):
+                return bounds[-1]
+            lower = bounds[index - 1] if index else 0
+            return lower + (bounds[index] - lower) * (rank - seen) / count
+        seen += count
+    return bounds[-1]
+
+
+def get_summary(limit: int = 20) -> dict:
+    """Per-endpoint request metrics, slowest total time first, for the admin dashboard."""
+    snapshot = _collect()
+    endpoints = {}
+    for (metric, label), histogram in snapshot.histograms.items():
+        if metric != CONTEXT_PROCESSOR_SECONDS:
+            endpoints.setdefault(label, {})[metric] = histogram
+
+    rows = []
+    for endpoint, histograms in endpoints.items():
+        duration = histograms[REQUEST_SECONDS]
+        requests = sum(duration.counts)
+        size = histograms.get(RESPONSE_BYTES)
+        rows.append({
+            'endpoint': endpoint,
+            'requests': requests,
+            'total_seconds': round(duration.sum, 3),
+            'mean_ms': round(duration.sum / requests * 1000, 2),
+            'p50_ms': round(_quantile(duration.bounds, duration.counts, 0.5) * 1000, 2),
+            'p95_ms': round(_quantile(duration.bounds, duration.counts, 0.95) * 1000, 2),
+            'mean_queries': round(histograms[REQUEST_QUERIES].sum / requests, 2),
+            'mean_sql_ms': round(histograms[REQUEST_SQL_SECONDS].sum / requests * 1000, 2),
+            'mean_bytes': round(size.sum / sum(size.counts)) if size and sum(size.counts) else None,
+        })
+    rows.sort(key=lambda row: row['total_seconds'], reverse=True)
+
+    processors = [
+        {'processor': label, 'calls': sum(histogram.counts),
+         'mean_ms': round(histogram.sum / sum(histogram.counts) * 1000, 3)}
+        for (metric, label), histogram in snapshot.histograms.items()
+        if metric == CONTEXT_PROCESSOR_SECONDS and sum(histogram.counts)
+    ]
+    return {'endpoints': rows[:limit], 'context_processors': processors}
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound) -> str:
+    return repr(float(bound)) if isinstance(bound, float) else str(bound)
+
+
+def _external_metrics() -> list:
+    """(name, type, help, [(labels, value)]) from the modules that keep their own counters."""
+    from password_hashing import get_metrics
+    from rate_limit import get_rejection_counts
+
+    hashing = get_metrics()
+    operations = ('hash', 'verify')
+    families = [
+        ('harvest_password_hash_operations_total', 'counter', 'Password hash and verify operations.',
+         [({'operation': operation}, hashing[operation]['count']) for operation in operations]),
+        ('harvest_password_hash_seconds_total', 'counter', 'Time spent hashing and verifying passwords.',
+         [({'operation': operation}, hashing[operation]['seconds']) for operation in operations]),
+        ('harvest_password_hash_max_seconds', 'gauge', 'Slowest single hash or verify in this worker.',
+         [({'operation': operation}, hashing[operation]['max_seconds']) for operation in operations]),
+        ('harvest_password_hash_rejected_total', 'counter', 'Requests shed because the hashing pool was full.',
+         [({}, hashing['rejected'])]),
+        ('harvest_password_hash_timed_out_total', 'counter', 'Requests shed because a hash took too long.',
+         [({}, hashing['timed_out'])]),
+        ('harvest_password_rehashed_total', 'counter', 'Passwords rehashed with the current method on login.',
+         [({}, hashing['rehashed'])]),
+    ]
+
+    rejections = []
+    for key, count in sorted(get_rejection_counts().items()):
+        endpoint, _, dimension = key.rpartition(':')
+        rejections.append(({'endpoint': endpoint, 'dimension': dimension}, count))
+    families.append(('harvest_rate_limit_rejections_total', 'counter', 'Requests rejected by the rate limiter.',
+                     rejections))
+
+    queue_handler = current_app.extensions.get('log_queue_handler')
+    if queue_handler is not None:
+        families.append(('harvest_log_records_dropped_total', 'counter', 'Log records dropped on a full queue.',
+                         [({}, queue_handler.dropped)]))
+    return families
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def render_prometheus() -> str:
+    """Render this worker's metrics in the Prometheus text exposition format."""
+    snapshot = _collect()
+    lines = []
+    for metric, (label_name, bounds, help_text) in HISTOGRAMS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for (name, label), histogram in sorted(snapshot.histograms.items(), key=lambda item: item[0]):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_labels({label_name: label, "le": _format_bound(bound)})} {cumulative}')
+            cumulative += histogram.counts[-1]
+            lines.append(f'{metric}_bucket{_labels({label_name: label, "le": "+Inf"})} {cumulative}')
+            lines.append(f'{metric}_sum{_labels({label_name: label})} {histogram.sum}')
+            lines.append(f'{metric}_count{_labels({label_name: label})} {cumulative}')
+
+    lines.append('# HELP harvest_responses_total Responses by endpoint and status code.')
+    lines.append('# TYPE harvest_responses_total counter')
+    for (endpoint, status), count in sorted(snapshot.responses.items()):
+        lines.append(f'harvest_responses_total{_labels({"endpoint": endpoint, "status": status})} {count}')
+
+    for name, kind, help_text, samples in _external_metrics():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
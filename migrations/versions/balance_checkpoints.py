@@ -0,0 +1,40 @@
+"""add balance checkpoints and ledger counter amounts
+
+Revision ID: balance_checkpoints
+Revises: transaction_history_indexes
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'balance_checkpoints'
+down_revision = 'transaction_history_indexes'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('transaction_history', sa.Column('counter_amount', sa.Integer(), nullable=True))
+    op.create_index('ix_transaction_history_user_id_id', 'transaction_history', ['user_id', 'id'])
+
+    op.create_table('balance_checkpoint',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('ledger_id', sa.Integer(), nullable=False),
+        sa.Column('dabbers', sa.Integer(), nullable=False),
+        sa.Column('groots', sa.Integer(), nullable=False),
+        sa.Column('petalins', sa.Integer(), nullable=False),
+        sa.Column('florens', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'ledger_id', name='uq_balance_checkpoint_user_ledger')
+    )
+    op.create_index('ix_balance_checkpoint_user_created', 'balance_checkpoint', ['user_id', 'created_at'])
+
+def downgrade():
+    op.drop_index('ix_balance_checkpoint_user_created', table_name='balance_checkpoint')
+    op.drop_table('balance_checkpoint')
+    op.drop_index('ix_transaction_history_user_id_id', table_name='transaction_history')
+    op.drop_column('transaction_history', 'counter_amount')
@@ -0,0 +1,25 @@
+"""add batch id to email outbox
+
+Revision ID: email_outbox_batch
+Revises: platform_stats
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'email_outbox_batch'
+down_revision = 'platform_stats'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('batch_id', sa.String(length=32), nullable=True))
+        batch_op.create_index('ix_email_outbox_batch_id', ['batch_id'])
+
+def downgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_email_outbox_batch_id')
+        batch_op.drop_column('batch_id')
@@ -0,0 +1,102 @@
+"""partition transaction history by month
+
+Revision ID: partition_transaction_history
+Revises: balance_checkpoints
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import date
+
+# revision identifiers, used by Alembic
+revision = 'partition_transaction_history'
+down_revision = 'balance_checkpoints'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_transaction_history_user_timestamp': 'user_id, timestamp DESC, id DESC',
+    'ix_transaction_history_user_type_timestamp': 'user_id, transaction_type, timestamp DESC, id DESC',
+    'ix_transaction_history_user_currency_timestamp': 'user_id, currency_type, timestamp DESC, id DESC',
+    'ix_transaction_history_user_id_id': 'user_id, id',
+}
+
+def _next_month(day):
+    return date(day.year + (day.month // 12), day.month % 12 + 1, 1)
+
+def upgrade():
+    op.create_table('ledger_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('path', sa.String(length=255), nullable=False),
+        sa.Column('row_count', sa.Integer(), nullable=False),
+        sa.Column('min_id', sa.Integer(), nullable=True),
+        sa.Column('max_id', sa.Integer(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('month')
+    )
+
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        # SQLite keeps a single hot table; closed months are split into
+        # per-month tables by the archival command instead
+        return
+
+    # Rebuild transaction_history as a table partitioned by month on timestamp
+    op.execute("ALTER SEQUENCE transaction_history_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE transaction_history RENAME TO transaction_history_legacy")
+    op.execute("ALTER TABLE transaction_history_legacy RENAME CONSTRAINT transaction_history_pkey TO transaction_history_legacy_pkey")
+    op.execute("""
+        CREATE TABLE transaction_history (
+            LIKE transaction_history_legacy INCLUDING DEFAULTS,
+            PRIMARY KEY (id, timestamp),
+            FOREIGN KEY (user_id) REFERENCES "user" (id)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+
+    first_month = bind.execute(sa.text(
+        "SELECT date_trunc('month', MIN(timestamp))::date FROM transaction_history_legacy"
+    )).scalar()
+    today = date.today()
+    month = first_month or date(today.year, today.month, 1)
+    # Create every month with data plus two months ahead
+    last_month = _next_month(_next_month(date(today.year, today.month, 1)))
+    while month <= last_month:
+        following = _next_month(month)
+        op.execute(f"""
+            CREATE TABLE transaction_history_y{month.year}m{month.month:02d}
+            PARTITION OF transaction_history
+            FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')
+        """)
+        month = following
+    op.execute("CREATE TABLE transaction_history_default PARTITION OF transaction_history DEFAULT")
+
+    op.execute("INSERT INTO transaction_history SELECT * FROM transaction_history_legacy")
+    op.execute("DROP TABLE transaction_history_legacy")
+    op.execute("ALTER SEQUENCE transaction_history_id_seq OWNED BY transaction_history.id")
+
+    for name, columns in INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON transaction_history ({columns})")
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("ALTER SEQUENCE transaction_history_id_seq OWNED BY NONE")
+        op.execute("ALTER TABLE transaction_history RENAME TO transaction_history_partitioned")
+        op.execute("ALTER TABLE transaction_history_partitioned RENAME CONSTRAINT transaction_history_pkey TO transaction_history_partitioned_pkey")
+        op.execute("""
+            CREATE TABLE transaction_history (
+                LIKE transaction_history_partitioned INCLUDING DEFAULTS,
+                PRIMARY KEY (id),
+                FOREIGN KEY (user_id) REFERENCES "user" (id)
+            )
+        """)
+        op.execute("INSERT INTO transaction_history SELECT * FROM transaction_history_partitioned")
+        op.execute("DROP TABLE transaction_history_partitioned CASCADE")
+        op.execute("ALTER SEQUENCE transaction_history_id_seq OWNED BY transaction_history.id")
+        for name, columns in INDEXES.items():
+            op.execute(f"CREATE INDEX {name} ON transaction_history ({columns})")
+
+    op.drop_table('ledger_archive')
@@ -0,0 +1,46 @@
+"""add incrementally maintained platform statistics
+
+Revision ID: platform_stats
+Revises: user_search_indexes
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'platform_stats'
+down_revision = 'user_search_indexes'
+branch_labels = None
+depends_on = None
+
+CURRENCY_COLUMNS = ('dabbers', 'groots', 'petalins', 'florens')
+
+def upgrade():
+    op.create_table('platform_stats',
+        sa.Column('name', sa.String(length=32), nullable=False),
+        sa.Column('shard', sa.SmallInteger(), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('name', 'shard')
+    )
+    op.create_table('daily_conversion_stats',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('shard', sa.SmallInteger(), nullable=False),
+        sa.Column('conversions', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('day', 'shard')
+    )
+
+    # Seed shard 0 from the current tables; `flask stats reconcile` backfills daily conversions
+    op.execute("""
+        INSERT INTO platform_stats (name, shard, value)
+        SELECT 'users_total', 0, COUNT(*) FROM "user"
+        UNION ALL
+        SELECT 'users_unverified', 0, COUNT(*) FROM "user" WHERE email_verified IS NOT TRUE
+    """)
+    for column in CURRENCY_COLUMNS:
+        op.execute(f"INSERT INTO platform_stats (name, shard, value) "
+                   f"SELECT '{column}', 0, COALESCE(SUM({column}), 0) FROM user_balance")
+
+def downgrade():
+    op.drop_table('daily_conversion_stats')
+    op.drop_table('platform_stats')
@@ -0,0 +1,37 @@
+"""enforce a single site settings row
+
+Revision ID: site_settings_singleton
+Revises: update_currency_rates
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'site_settings_singleton'
+down_revision = 'update_currency_rates'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Collapse duplicates once, keeping the latest record (highest ID)
+    op.execute("""
+        DELETE FROM site_settings
+        WHERE id <> (SELECT MAX(id) FROM site_settings)
+    """)
+    op.execute("UPDATE site_settings SET id = 1")
+
+    # Create the default row if the table is empty
+    op.execute("""
+        INSERT INTO site_settings (id, site_title, default_theme, created_at, updated_at)
+        SELECT 1, 'Market Harvest', 'autumn', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        WHERE NOT EXISTS (SELECT 1 FROM site_settings)
+    """)
+
+    with op.batch_alter_table('site_settings') as batch_op:
+        batch_op.create_check_constraint('site_settings_singleton', sa.text('id = 1'))
+
+def downgrade():
+    with op.batch_alter_table('site_settings') as batch_op:
+        batch_op.drop_constraint('site_settings_singleton', type_='check')
@@ -0,0 +1,32 @@
+"""index transaction history for keyset pagination
+
+Revision ID: transaction_history_indexes
+Revises: site_settings_singleton
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'transaction_history_indexes'
+down_revision = 'site_settings_singleton'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Conversion ledger entries such as 'petalin_to_floren' do not fit in 10 characters
+    with op.batch_alter_table('transaction_history') as batch_op:
+        batch_op.alter_column('currency_type', type_=sa.String(32), existing_type=sa.String(10), existing_nullable=False)
+
+    op.create_index('ix_transaction_history_user_timestamp', 'transaction_history',
+                    ['user_id', sa.text('timestamp DESC'), sa.text('id DESC')])
+    op.create_index('ix_transaction_history_user_type_timestamp', 'transaction_history',
+                    ['user_id', 'transaction_type', sa.text('timestamp DESC'), sa.text('id DESC')])
+    op.create_index('ix_transaction_history_user_currency_timestamp', 'transaction_history',
+                    ['user_id', 'currency_type', sa.text('timestamp DESC'), sa.text('id DESC')])
+
+def downgrade():
+    op.drop_index('ix_transaction_history_user_currency_timestamp', table_name='transaction_history')
+    op.drop_index('ix_transaction_history_user_type_timestamp', table_name='transaction_history')
+    op.drop_index('ix_transaction_history_user_timestamp', table_name='transaction_history')
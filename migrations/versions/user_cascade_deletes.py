@@ -0,0 +1,62 @@
+"""cascade user deletes to dependent rows and add user.deleted_at
+
+Revision ID: user_cascade_deletes
+Revises: email_outbox_batch
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'user_cascade_deletes'
+down_revision = 'email_outbox_batch'
+branch_labels = None
+depends_on = None
+
+DEPENDENT_TABLES = ('user_balance', 'transaction_history', 'balance_checkpoint')
+# Names the reflected, unnamed SQLite foreign keys so batch mode can drop them
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+def _replace_user_fk(table, ondelete):
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        name = f'{table}_user_id_fkey'
+        partitioned = bind.execute(sa.text(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = CAST(:table AS regclass)"
+        ), {'table': table}).scalar()
+        op.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}')
+        clause = f' ON DELETE {ondelete}' if ondelete else ''
+        if partitioned:
+            # Partitioned tables do not support NOT VALID foreign keys
+            op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} '
+                       f'FOREIGN KEY (user_id) REFERENCES "user" (id){clause}')
+        else:
+            op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} '
+                       f'FOREIGN KEY (user_id) REFERENCES "user" (id){clause} NOT VALID')
+            # autocommit_block commits the ADD first, releasing its lock; VALIDATE
+            # then scans the existing rows holding only a SHARE UPDATE EXCLUSIVE lock
+            with op.get_context().autocommit_block():
+                op.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {name}')
+        return
+
+    name = f'fk_{table}_user_id_user'
+    with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint(name, type_='foreignkey')
+        batch_op.create_foreign_key(name, 'user', ['user_id'], ['id'], ondelete=ondelete)
+
+def upgrade():
+    for table in DEPENDENT_TABLES:
+        _replace_user_fk(table, 'CASCADE')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_user_deleted_at', ['deleted_at'])
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_deleted_at')
+        batch_op.drop_column('deleted_at')
+
+    for table in DEPENDENT_TABLES:
+        _replace_user_fk(table, None)
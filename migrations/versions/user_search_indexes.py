@@ -0,0 +1,37 @@
+"""add trigram and prefix indexes for user search
+
+Revision ID: user_search_indexes
+Revises: user_version
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic
+revision = 'user_search_indexes'
+down_revision = 'user_version'
+branch_labels = None
+depends_on = None
+
+TRIGRAM_COLUMNS = ('username', 'email', 'first_name', 'last_name')
+PREFIX_COLUMNS = ('username', 'email')
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        # Other databases use the in-process n-gram index in user_search.py
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column in TRIGRAM_COLUMNS:
+        op.execute(f'CREATE INDEX ix_user_{column}_trgm ON "user" USING gin ({column} gin_trgm_ops)')
+    for column in PREFIX_COLUMNS:
+        op.execute(f'CREATE INDEX ix_user_lower_{column}_prefix ON "user" (lower({column}) text_pattern_ops)')
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for column in PREFIX_COLUMNS:
+        op.execute(f"DROP INDEX IF EXISTS ix_user_lower_{column}_prefix")
+    for column in TRIGRAM_COLUMNS:
+        op.execute(f"DROP INDEX IF EXISTS ix_user_{column}_trgm")
@@ -0,0 +1,26 @@
+"""add user.updated_at
+
+Revision ID: user_updated_at
+Revises: user_cascade_deletes
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = 'user_updated_at'
+down_revision = 'user_cascade_deletes'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Existing rows stay NULL; only changes from now on need to be picked up by the worker indexes
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_user_updated_at', ['updated_at'])
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_updated_at')
+        batch_op.drop_column('updated_at')
@@ -1,5 +1,5 @@
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from password_hashing import hash_password, verify_password
 from datetime import datetime
 from extensions import db
 from enum import Enum
@@ -34,20 +34,37 @@ class User(UserMixin, db.Model):
     terms_accepted = db.Column(db.DateTime, nullable=True)
     birth_date = db.Column(db.Date, nullable=True)
     age_verified = db.Column(db.Boolean, default=False)
+    # Bumped on every ORM update so cached request identities can be revalidated
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Set when an account with a large ledger is deleted; user_deletion purges it in chunks
+    deleted_at = db.Column(db.DateTime, nullable=True, index=True)
+    # Set on every ORM insert and update; workers poll it to pick up renames made elsewhere
+    updated_at = db.Column(db.DateTime, nullable=True, index=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
     
-    # Add relationship to UserBalance
-    balance = db.relationship('UserBalance', backref='user', uselist=False)
-    transactions = db.relationship('TransactionHistory', backref='user', lazy='dynamic')
+    # Add relationship to UserBalance. Dependent rows are removed by ON DELETE CASCADE;
+    # passive_deletes keeps the ORM from loading them just to delete them
+    balance = db.relationship('UserBalance', backref='user', uselist=False,
+                              cascade='all, delete-orphan', passive_deletes=True)
+    transactions = db.relationship('TransactionHistory', backref='user', lazy='dynamic',
+                                   cascade='all, delete-orphan', passive_deletes=True)
+
+@db.event.listens_for(User, 'before_update')
+def bump_user_version(mapper, connection, target):
+    # Increment in the database: a cached request user carries the version it was
+    # cached with, which may already be stale. The attribute is expired by the
+    # flush and reloads the new value on next access
+    if db.session.is_modified(target, include_collections=False):
+        target.version = User.version + 1
 
 class UserBalance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, unique=True)
     dabbers = db.Column(db.Integer, nullable=False, default=500)
     groots = db.Column(db.Integer, nullable=False, default=0)
     petalins = db.Column(db.Integer, nullable=False, default=0)
@@ -56,15 +73,91 @@ class UserBalance(db.Model):
 
 class TransactionHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    currency_type = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    currency_type = db.Column(db.String(32), nullable=False)
     amount = db.Column(db.Integer, nullable=False)
+    # Amount credited in the target currency for conversions
+    counter_amount = db.Column(db.Integer, nullable=True)
     transaction_type = db.Column(db.String(10), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     description = db.Column(db.Text, nullable=True)
 
-class SiteSettings(db.Model):
+    # Per-user history is always read newest first, optionally filtered by type or currency
+    __table_args__ = (
+        db.Index('ix_transaction_history_user_id_id', 'user_id', 'id'),
+        db.Index('ix_transaction_history_user_timestamp', 'user_id', timestamp.desc(), id.desc()),
+        db.Index('ix_transaction_history_user_type_timestamp', 'user_id', 'transaction_type', timestamp.desc(), id.desc()),
+        db.Index('ix_transaction_history_user_currency_timestamp', 'user_id', 'currency_type', timestamp.desc(), id.desc()),
+    )
+
+class BalanceCheckpoint(db.Model):
+    """Snapshot of a user's balance covering every ledger entry up to ledger_id."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    # Highest transaction_history.id included in this snapshot (0 if none)
+    ledger_id = db.Column(db.Integer, nullable=False)
+    dabbers = db.Column(db.Integer, nullable=False)
+    groots = db.Column(db.Integer, nullable=False)
+    petalins = db.Column(db.Integer, nullable=False)
+    florens = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_balance_checkpoint_user_created', 'user_id', 'created_at'),
+        db.UniqueConstraint('user_id', 'ledger_id', name='uq_balance_checkpoint_user_ledger'),
+    )
+
+class LedgerArchive(db.Model):
+    """A closed month of transaction history moved out of the hot table into a file."""
     id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Date, nullable=False, unique=True)  # First day of the archived month
+    path = db.Column(db.String(255), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    min_id = db.Column(db.Integer, nullable=True)
+    max_id = db.Column(db.Integer, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class EmailOutbox(db.Model):
+    """An email waiting to be delivered by the outbox worker."""
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending/sent/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    batch_id = db.Column(db.String(32), nullable=True)  # Groups the emails of one bulk admin action
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+        db.Index('ix_email_outbox_batch_id', 'batch_id'),
+    )
+
+class PlatformStat(db.Model):
+    """One shard of a platform-wide counter; the counter's value is the sum of its shards."""
+    __tablename__ = 'platform_stats'
+    name = db.Column(db.String(32), primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class DailyConversionStat(db.Model):
+    """One shard of the number of conversion ledger entries written on a day."""
+    __tablename__ = 'daily_conversion_stats'
+    day = db.Column(db.Date, primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    conversions = db.Column(db.BigInteger, nullable=False, default=0)
+
+class SiteSettings(db.Model):
+    # The table holds exactly one row; the check constraint enforces it in the schema
+    SINGLETON_ID = 1
+    __table_args__ = (
+        db.CheckConstraint('id = 1', name='site_settings_singleton'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, default=SINGLETON_ID, autoincrement=False)
     site_title = db.Column(db.String(128), nullable=False, default='Market Harvest')
     site_icon = db.Column(db.Text, nullable=True)  # Stores SVG content
     default_theme = db.Column(db.String(20), nullable=False, default='autumn')
@@ -75,27 +168,39 @@ class SiteSettings(db.Model):
 
     @classmethod
     def get_settings(cls):
-        """Get the current site settings or create default ones if they don't exist."""
-        # Get all settings ordered by id descending
-        all_settings = cls.query.order_by(cls.id.desc()).all()
-        
-        if len(all_settings) > 1:
-            # Keep the latest record (highest ID)
-            latest_settings = all_settings[0]
-            
-            # Delete all other records
-            for old_settings in all_settings[1:]:
-                db.session.delete(old_settings)
-            
-            db.session.commit()
-            return latest_settings
-        
-        # If no settings exist, create default ones
-        if not all_settings:
-            settings = cls()
-            db.session.add(settings)
-            db.session.commit()
-            return settings
-            
-        # Return the only existing record
-        return all_settings[0]
+        """Get the current site settings, or None if they have not been created yet.
+
+        This is a primary key lookup and never writes to the database.
+        """
+        return db.session.get(cls, cls.SINGLETON_ID)
+
+    @classmethod
+    def ensure_settings(cls):
+        """Create the settings row with default values if it doesn't exist.
+
+        Meant for startup and admin writes, not for the request read path.
+        """
+        from settings_cache import DEFAULT_SETTINGS
+        values = {
+            'id': cls.SINGLETON_ID,
+            'site_title': DEFAULT_SETTINGS['site_title'],
+            'welcome_message': DEFAULT_SETTINGS['welcome_message'],
+            'footer_text': DEFAULT_SETTINGS['footer_text'],
+            'default_theme': DEFAULT_SETTINGS['default_theme']
+        }
+
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+
+        if insert is not None:
+            db.session.execute(insert(cls).values(**values).on_conflict_do_nothing(index_elements=['id']))
+        elif cls.get_settings() is None:
+            db.session.add(cls(**values))
+
+        db.session.commit()
+        return cls.get_settings()
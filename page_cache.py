@@ -0,0 +1,92 @@
+import gzip
+import time
+import hashlib
+from functools import wraps
+from threading import Lock
+from typing import NamedTuple
+from flask import current_app, request, session, g
+from settings_cache import get_site_settings
+
+
+class CachedPage(NamedTuple):
+    """A rendered anonymous page with its precompressed body."""
+    body: bytes
+    gzip_body: bytes
+    etag: str
+    mimetype: str
+    expires_at: float
+
+
+_lock = Lock()
+_pages = {}
+
+
+def _is_cacheable_request() -> bool:
+    """Anonymous GETs without pending flashes or a remember-me cookie."""
+    if request.method != 'GET' or not current_app.config.get('PAGE_CACHE_ENABLED', True):
+        return False
+    if '_user_id' in session or '_flashes' in session:
+        return False
+    return current_app.config.get('REMEMBER_COOKIE_NAME', 'remember_token') not in request.cookies
+
+
+def _build_response(page: CachedPage):
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = current_app.response_class(page.gzip_body if use_gzip else page.body, mimetype=page.mimetype)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    # Each encoding is a different representation, so each gets its own strong ETag
+    response.set_etag(f"{page.etag}-gz" if use_gzip else page.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('PAGE_CACHE_MAX_AGE', 60)
+    response.vary.update(('Accept-Encoding', 'Cookie'))
+    response.headers['X-Page-Cache'] = 'HIT' if g.get('page_cache_hit') else 'MISS'
+    return response.make_conditional(request)
+
+
+def cached_page(f):
+    """Serve an anonymous page from a per-worker cache keyed on path, theme and settings version.
+
+    Pages are rendered without a CSRF token (g.page_cache_render) so the
+    same bytes can be served to every anonymous visitor.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not _is_cacheable_request():
+            return f(*args, **kwargs)
+
+        settings = get_site_settings()
+        key = (request.path, settings.default_theme, settings.version)
+        now = time.monotonic()
+        with _lock:
+            page = _pages.get(key)
+        if page is not None and page.expires_at > now:
+            g.page_cache_hit = True
+            return _build_response(page)
+
+        g.page_cache_render = True
+        response = current_app.make_response(f(*args, **kwargs))
+        if response.status_code != 200 or 'Set-Cookie' in response.headers or response.direct_passthrough:
+            return response
+
+        body = response.get_data()
+        page = CachedPage(
+            body=body,
+            gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+            etag=hashlib.sha256(body).hexdigest()[:32],
+            mimetype=response.mimetype,
+            expires_at=now + current_app.config.get('PAGE_CACHE_TTL', 300)
+        )
+        with _lock:
+            # Entries for older settings versions can never be hit again
+            for stale_key in [k for k in _pages if k[2] != settings.version]:
+                del _pages[stale_key]
+            _pages[key] = page
+        return _build_response(page)
+    return decorated_function
+
+
+def clear_page_cache():
+    """Drop every cached page in this worker."""
+    with _lock:
+        _pages.clear()
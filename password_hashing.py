@@ -0,0 +1,140 @@
+import os
+import time
+from threading import Lock, BoundedSemaphore
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# werkzeug's default; override with PASSWORD_HASH_METHOD, e.g. 'pbkdf2:sha256:600000'
+DEFAULT_HASH_METHOD = 'scrypt:32768:8:1'
+
+
+class HashingBusyError(Exception):
+    """Raised when the hashing pool already has its maximum number of pending jobs."""
+
+
+_lock = Lock()
+_pool = None
+_pool_pid = None
+_slots = None
+_method_prefixes = {}
+_metrics = {
+    'hash': {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0},
+    'verify': {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0},
+    'rejected': 0,
+    'timed_out': 0,
+    'rehashed': 0
+}
+
+
+def _config(key, default):
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def _get_pool():
+    """Get the process pool for this process, creating it after startup or fork."""
+    global _pool, _pool_pid, _slots
+    workers = _config('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+    if workers <= 0:
+        return None, None
+
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_pid = os.getpid()
+            _slots = BoundedSemaphore(_config('PASSWORD_HASH_MAX_PENDING', workers * 4))
+        return _pool, _slots
+
+
+def _record(operation, seconds):
+    with _lock:
+        stats = _metrics[operation]
+        stats['count'] += 1
+        stats['seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+
+def _run(operation, calls):
+    """Run (function, args) calls on the pool concurrently and return their results in order."""
+    started = time.monotonic()
+    pool, slots = _get_pool()
+
+    if pool is None:
+        results = [function(*args) for function, args in calls]
+    else:
+        acquired = 0
+        futures = []
+        try:
+            for _ in calls:
+                if not slots.acquire(blocking=False):
+                    with _lock:
+                        _metrics['rejected'] += 1
+                    raise HashingBusyError('Password hashing capacity exhausted')
+                acquired += 1
+            timeout = _config('PASSWORD_HASH_TIMEOUT', 10)
+            for function, args in calls:
+                future = pool.submit(function, *args)
+                # A slot stays taken until its job has actually left the pool, even after a timeout
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+            results = [future.result(timeout=timeout) for future in futures]
+        except TimeoutError:
+            for future in futures:
+                future.cancel()
+            with _lock:
+                _metrics['timed_out'] += 1
+            raise HashingBusyError('Password hashing timed out')
+        finally:
+            # Slots acquired for jobs that were never submitted
+            for _ in range(acquired - len(futures)):
+                slots.release()
+
+    _record(operation, time.monotonic() - started)
+    return results
+
+
+def hash_password(password: str) -> str:
+    """Hash a password with the configured method on the worker pool."""
+    method = _config('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD)
+    return _run('hash', [(generate_password_hash, (password, method))])[0]
+
+
+def verify_password(pwhash: str, password: str) -> bool:
+    """Check a password against a stored hash on the worker pool."""
+    if not pwhash:
+        return False
+    return _run('verify', [(check_password_hash, (pwhash, password))])[0]
+
+
+def _method_prefix(method: str) -> str:
+    """Get the method part of hashes produced by method, e.g. 'scrypt:32768:8:1'."""
+    if method not in _method_prefixes:
+        _method_prefixes[method] = generate_password_hash('', method=method).split('$', 1)[0]
+    return _method_prefixes[method]
+
+
+def needs_rehash(pwhash: str) -> bool:
+    """Whether a stored hash was produced with different parameters than the configured ones."""
+    if not pwhash:
+        return False
+    method = _config('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD)
+    return pwhash.split('$', 1)[0] != _method_prefix(method)
+
+
+def record_rehash():
+    with _lock:
+        _metrics['rehashed'] += 1
+
+
+def get_metrics() -> dict:
+    """Get a copy of the hashing latency and rejection counters."""
+    with _lock:
+        return {
+            'hash': dict(_metrics['hash']),
+            'verify': dict(_metrics['verify']),
+            'rejected': _metrics['rejected'],
+            'timed_out': _metrics['timed_out'],
+            'rehashed': _metrics['rehashed']
+        }
@@ -0,0 +1,224 @@
+import random
+from datetime import date, datetime, time, timedelta
+from flask import current_app
+from sqlalchemy import case, func, inspect
+from extensions import db
+from models import User, UserBalance, TransactionHistory, TransactionType, PlatformStat, DailyConversionStat
+
+USERS_TOTAL = 'users_total'
+USERS_UNVERIFIED = 'users_unverified'
+CURRENCY_COLUMNS = ('dabbers', 'groots', 'petalins', 'florens')
+STAT_NAMES = (USERS_TOTAL, USERS_UNVERIFIED) + CURRENCY_COLUMNS
+
+
+def _to_date(value) -> date:
+    # SQLite's date() returns ISO strings
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _add(connection, table, key_column: str, value_column: str, deltas: dict):
+    """Add each delta to one random shard of its counter row, creating the row if needed.
+
+    Spreading increments over STATS_SHARDS rows keeps concurrent writers
+    from queueing on a single hot row lock.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    shard = random.randrange(max(1, current_app.config.get('STATS_SHARDS', 8)))
+    value = table.c[value_column]
+
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    if insert is not None:
+        statement = insert(table).values([
+            {key_column: key, 'shard': shard, value_column: delta} for key, delta in deltas.items()
+        ])
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[key_column, 'shard'],
+            set_={value_column: value + statement.excluded[value_column]}
+        ))
+        return
+
+    for key, delta in deltas.items():
+        updated = connection.execute(
+            table.update().where(table.c[key_column] == key, table.c.shard == shard).values({value: value + delta})
+        ).rowcount
+        if not updated:
+            connection.execute(table.insert().values({key_column: key, 'shard': shard, value_column: delta}))
+
+
+def increment_stats(deltas: dict, connection=None):
+    """Add deltas to platform counters in the caller's transaction; nothing is committed."""
+    _add(connection or db.session.connection(), PlatformStat.__table__, 'name', 'value', deltas)
+
+
+def record_conversions(count: int, day: date = None, connection=None):
+    """Count conversion ledger entries towards a day (today, UTC, by default); nothing is committed."""
+    day = day or datetime.utcnow().date()
+    _add(connection or db.session.connection(), DailyConversionStat.__table__, 'day', 'conversions', {day: count})
+
+
+def get_platform_stats() -> dict:
+    """Get every platform counter with one small aggregate over the shard rows."""
+    stats = dict.fromkeys(STAT_NAMES, 0)
+    rows = db.session.query(PlatformStat.name, func.sum(PlatformStat.value)).group_by(PlatformStat.name)
+    stats.update({name: int(total or 0) for name, total in rows})
+    return stats
+
+
+def get_daily_conversions(days: int = 30) -> list:
+    """Get (day, conversions) pairs for the most recent UTC days, oldest first, with empty days as 0."""
+    today = datetime.utcnow().date()
+    since = today - timedelta(days=days - 1)
+    rows = db.session.query(DailyConversionStat.day, func.sum(DailyConversionStat.conversions)).filter(
+        DailyConversionStat.day >= since
+    ).group_by(DailyConversionStat.day)
+    counts = {_to_date(day): int(total or 0) for day, total in rows}
+    return [(since + timedelta(days=offset), counts.get(since + timedelta(days=offset), 0)) for offset in range(days)]
+
+
+def _exact_stats() -> dict:
+    users = db.session.query(
+        func.count(User.id),
+        func.coalesce(func.sum(case((User.email_verified == True, 0), else_=1)), 0)  # noqa: E712
+    ).filter(User.deleted_at.is_(None)).one()
+    # Accounts waiting for the purge job have already been taken off the counters
+    balances = db.session.query(
+        *[func.coalesce(func.sum(getattr(UserBalance, column)), 0) for column in CURRENCY_COLUMNS]
+    ).join(User, User.id == UserBalance.user_id).filter(User.deleted_at.is_(None)).one()
+    stats = {USERS_TOTAL: users[0], USERS_UNVERIFIED: users[1]}
+    stats.update(zip(CURRENCY_COLUMNS, balances))
+    return {name: int(value) for name, value in stats.items()}
+
+
+def _count_conversions_by_day(*criteria) -> dict:
+    day = func.date(TransactionHistory.timestamp)
+    rows = db.session.query(day, func.count(TransactionHistory.id)).filter(
+        TransactionHistory.transaction_type == TransactionType.CONVERSION.value, *criteria
+    ).group_by(day)
+    return {_to_date(value): count for value, count in rows}
+
+
+def _exact_daily_conversions(since: date) -> dict:
+    return _count_conversions_by_day(TransactionHistory.timestamp >= datetime.combine(since, time.min))
+
+
+def forget_conversions(user_ids):
+    """Take the conversions of users whose ledger is about to be deleted off the daily counts."""
+    for day, count in _count_conversions_by_day(TransactionHistory.user_id.in_(user_ids)).items():
+        record_conversions(-count, day)
+
+
+def reconcile_stats(days: int = 7) -> dict:
+    """Recompute the counters from the source tables and correct any drift.
+
+    Corrections are written as ordinary increments, so writers are never
+    blocked while the full aggregates run. Only the most recent days of
+    conversions are checked; older ledger months may have been archived.
+    Returns {counter: correction} for the counters that were off.
+    """
+    corrections = {}
+    current = get_platform_stats()
+    for name, value in _exact_stats().items():
+        if value != current[name]:
+            corrections[name] = value - current[name]
+    increment_stats(corrections)
+
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    counted = {day: count for day, count in get_daily_conversions(days) if count}
+    exact = _exact_daily_conversions(since)
+    for day in sorted(set(counted) | set(exact)):
+        correction = exact.get(day, 0) - counted.get(day, 0)
+        if correction:
+            record_conversions(correction, day)
+            corrections[day.isoformat()] = correction
+
+    db.session.commit()
+    return corrections
+
+
+def _balance_deltas(target, sign: int) -> dict:
+    loaded = inspect(target).dict
+    return {column: sign * (loaded.get(column) or 0) for column in CURRENCY_COLUMNS}
+
+
+# ORM writes keep the counters current inside the same flush. Core statements
+# (conversions, consolidation) call increment_stats themselves.
+
+@db.event.listens_for(User, 'after_insert')
+def _user_created(mapper, connection, target):
+    # Only read loaded attributes; lazy loads are not allowed during a flush
+    verified = inspect(target).dict.get('email_verified')
+    increment_stats({USERS_TOTAL: 1, USERS_UNVERIFIED: 0 if verified else 1}, connection)
+
+
+@db.event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    history = inspect(target).attrs.email_verified.history
+    if history.added and history.deleted and bool(history.added[0]) != bool(history.deleted[0]):
+        increment_stats({USERS_UNVERIFIED: -1 if history.added[0] else 1}, connection)
+
+
+@db.event.listens_for(User, 'before_delete')
+def _user_deleting(mapper, connection, target):
+    # passive_deletes leaves unloaded dependents to ON DELETE CASCADE, which
+    # fires no events, so take them off the counters while they still exist
+    user_id = target.id
+    if 'balance' not in inspect(target).dict:
+        balances = UserBalance.__table__
+        row = connection.execute(
+            balances.select().with_only_columns(*[balances.c[column] for column in CURRENCY_COLUMNS])
+            .where(balances.c.user_id == user_id)
+        ).first()
+        if row is not None:
+            increment_stats({column: -value for column, value in row._mapping.items()}, connection)
+    ledger = TransactionHistory.__table__
+    day = func.date(ledger.c.timestamp)
+    rows = connection.execute(
+        ledger.select().with_only_columns(day, func.count()).where(
+            ledger.c.user_id == user_id, ledger.c.transaction_type == TransactionType.CONVERSION.value
+        ).group_by(day)
+    )
+    for value, count in rows:
+        record_conversions(-count, _to_date(value), connection)
+
+
+@db.event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    deltas = {USERS_TOTAL: -1}
+    loaded = inspect(target).dict
+    if 'email_verified' in loaded and not loaded['email_verified']:
+        deltas[USERS_UNVERIFIED] = -1
+    increment_stats(deltas, connection)
+
+
+@db.event.listens_for(UserBalance, 'after_insert')
+def _balance_created(mapper, connection, target):
+    increment_stats(_balance_deltas(target, 1), connection)
+
+
+@db.event.listens_for(UserBalance, 'after_update')
+def _balance_updated(mapper, connection, target):
+    deltas = {}
+    state = inspect(target)
+    for column in CURRENCY_COLUMNS:
+        history = state.attrs[column].history
+        if history.added and history.deleted:
+            deltas[column] = (history.added[0] or 0) - (history.deleted[0] or 0)
+    increment_stats(deltas, connection)
+
+
+@db.event.listens_for(UserBalance, 'after_delete')
+def _balance_deleted(mapper, connection, target):
+    increment_stats(_balance_deltas(target, -1), connection)
@@ -3,13 +3,12 @@ from flask_login import login_required, current_user
 from extensions import db
 from models import User
 from datetime import datetime
-import pytz
-from pytz import timezone as pytz_timezone
-from werkzeug.security import check_password_hash
+from timezones import get_zone, is_valid_timezone
 
 profile_bp = Blueprint('profile', __name__)
-from currency_utils import convert_currency, get_user_balance
-from flask import jsonify
+from currency_utils import optimize_currency_holdings
+from ledger import get_transaction_page, DEFAULT_PAGE_SIZE
+from username_index import forget_username, record_username
 
 @profile_bp.route('/dashboard')
 @login_required
@@ -25,7 +24,45 @@ def dashboard():
     
     return render_template('profile/dashboard.html', 
                          user=current_user, 
-                         timezone=pytz_timezone)
+                         timezone=get_zone)
+
+@profile_bp.route('/consolidate', methods=['POST'])
+@login_required
+def consolidate_balance():
+    # On-demand consolidation; balance reads never consolidate implicitly
+    success, message = optimize_currency_holdings(current_user)
+    if success:
+        current_app.logger.info('Currency holdings consolidated on demand for user %s', current_user.username)
+        flash('Your currency holdings have been consolidated.', 'success')
+    else:
+        current_app.logger.warning('On-demand consolidation failed for user %s: %s', current_user.username, message)
+        flash(message, 'error')
+    return redirect(url_for('profile.dashboard'))
+
+@profile_bp.route('/transactions')
+@login_required
+def transactions():
+    cursor = request.args.get('cursor')
+    transaction_type = request.args.get('type') or None
+    currency_type = request.args.get('currency') or None
+    include_archived = request.args.get('archived') == '1'
+
+    try:
+        items, next_cursor = get_transaction_page(current_user.id, cursor=cursor,
+                                                  limit=DEFAULT_PAGE_SIZE,
+                                                  transaction_type=transaction_type,
+                                                  currency_type=currency_type,
+                                                  include_archived=include_archived)
+    except ValueError:
+        flash('Invalid page link, showing the most recent transactions.', 'warning')
+        return redirect(url_for('profile.transactions', type=transaction_type, currency=currency_type))
+
+    return render_template('profile/transactions.html',
+                         transactions=items,
+                         next_cursor=next_cursor,
+                         transaction_type=transaction_type,
+                         currency_type=currency_type,
+                         include_archived=include_archived)
 
 @profile_bp.route('/edit', methods=['GET', 'POST'])
 @login_required
@@ -41,10 +78,11 @@ def edit_profile():
             flash('All fields are required', 'error')
             return redirect(url_for('profile.edit_profile'))
             
-        if timezone not in pytz.common_timezones:
+        if not is_valid_timezone(timezone):
             flash('Please select a valid timezone', 'error')
             return redirect(url_for('profile.edit_profile'))
         
+        previous_username = current_user.username
         if username != current_user.username:
             if User.query.filter_by(username=username).first():
                 flash('Username already taken', 'error')
@@ -60,10 +98,13 @@ def edit_profile():
         theme = request.form.get('theme', 'autumn')
         if theme in ['light', 'dark', 'autumn', 'winter', 'spring', 'summer']:
             current_user.theme = theme
-            current_app.logger.info(f'Theme updated for user {current_user.username} to: {theme}')
+            current_app.logger.info('Theme updated for user %s to: %s', current_user.username, theme)
         
         try:
             db.session.commit()
+            if current_user.username != previous_username:
+                forget_username(previous_username)
+                record_username(current_user.username)
             flash('Profile updated successfully', 'success')
             return redirect(url_for('profile.dashboard'))
         except Exception as e:
@@ -71,7 +112,7 @@ def edit_profile():
             flash('An error occurred while updating your profile', 'error')
             return redirect(url_for('profile.edit_profile'))
     
-    return render_template('profile/edit.html', user=current_user, timezones=pytz.common_timezones)
+    return render_template('profile/edit.html', user=current_user)
 
 @profile_bp.route('/profile/preview')
 def preview_dashboard():
@@ -100,9 +141,8 @@ def security_settings():
             flash('All fields are required', 'error')
             return redirect(url_for('profile.security_settings'))
         
-        # Verify current password
         if not current_user.check_password(current_password):
-            current_app.logger.warning(f'Failed password change attempt for user {current_user.username}: incorrect current password')
+            current_app.logger.warning('Failed password change attempt for user %s: incorrect current password', current_user.username)
             flash('Current password is incorrect', 'error')
             return redirect(url_for('profile.security_settings'))
         
@@ -128,7 +168,7 @@ def security_settings():
             return redirect(url_for('profile.security_settings'))
         
         # Prevent reusing the current password
-        if current_user.check_password(new_password):
+        if new_password == current_password:
             flash('New password must be different from your current password', 'error')
             return redirect(url_for('profile.security_settings'))
         
@@ -136,12 +176,12 @@ def security_settings():
             # Update password
             current_user.set_password(new_password)
             db.session.commit()
-            current_app.logger.info(f'Password successfully changed for user {current_user.username}')
+            current_app.logger.info('Password successfully changed for user %s', current_user.username)
             flash('Password updated successfully', 'success')
             return redirect(url_for('profile.dashboard'))
         except Exception as e:
             db.session.rollback()
-            current_app.logger.error(f'Error changing password for user {current_user.username}: {str(e)}')
+            current_app.logger.error('Error changing password for user %s: %s', current_user.username, e)
             flash('An error occurred while updating your password', 'error')
             return redirect(url_for('profile.security_settings'))
     
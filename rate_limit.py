@@ -0,0 +1,169 @@
+import time
+from functools import wraps
+from threading import Lock
+from flask import current_app, request, jsonify, render_template
+
+# Default limits per endpoint: dimension -> (max requests, window seconds)
+DEFAULT_RATE_LIMITS = {
+    'auth.login': {'ip': (20, 60), 'email': (5, 300)},
+    'auth.reset_password': {'ip': (10, 300), 'email': (3, 900)},
+    'auth.check_username': {'ip': (60, 60)},
+}
+
+
+class MemoryBackend:
+    """Sliding-window counters kept in this worker's memory.
+
+    Each key keeps the count of the current and previous fixed window; the
+    previous count is weighted by how much of it still overlaps the sliding
+    window, which approximates a true sliding log in O(1) memory per key.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._windows = {}  # key -> (window start, current count, previous count, window seconds)
+        # hit() is given wall-clock time, so prune times use the same clock
+        self._last_prune = time.time()
+
+    def hit(self, key, limit, window, now):
+        current_window = int(now // window)
+        with self._lock:
+            start, current, previous, _ = self._windows.get(key, (current_window, 0, 0, window))
+            if start != current_window:
+                previous = current if start == current_window - 1 else 0
+                current = 0
+                start = current_window
+
+            weight = 1 - (now % window) / window
+            estimated = previous * weight + current
+            allowed = estimated < limit
+            if allowed:
+                current += 1
+            self._windows[key] = (start, current, previous, window)
+
+            if now - self._last_prune > 60:
+                self._prune(now)
+            return allowed
+
+    def _prune(self, now):
+        # An entry whose current window is older than the previous one no longer counts for anything
+        self._last_prune = now
+        stale = [key for key, (start, current, previous, window) in self._windows.items()
+                 if start < int(now // window) - 1]
+        for key in stale:
+            del self._windows[key]
+
+
+# Check and increment in one server-side step so concurrent workers can't all
+# pass the check before any of them counts its hit
+_HIT_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * tonumber(ARGV[1]) + current >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+class RedisBackend:
+    """Sliding-window counters shared by every worker through Redis."""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._hit = self._client.register_script(_HIT_SCRIPT)
+
+    def hit(self, key, limit, window, now):
+        current_window = int(now // window)
+        current_key = f"ratelimit:{key}:{current_window}"
+        previous_key = f"ratelimit:{key}:{current_window - 1}"
+        weight = 1 - (now % window) / window
+        return bool(self._hit(keys=[current_key, previous_key], args=[repr(weight), limit, int(window * 2)]))
+
+
+_backend = None
+_backend_lock = Lock()
+_rejections = {}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                url = current_app.config.get('RATE_LIMIT_STORAGE_URL')
+                if url and url.startswith('redis://'):
+                    try:
+                        _backend = RedisBackend(url)
+                    except ImportError:
+                        current_app.logger.warning('redis package not installed, using in-memory rate limits')
+                if _backend is None:
+                    _backend = MemoryBackend()
+    return _backend
+
+
+def _client_ip():
+    if current_app.config.get('RATE_LIMIT_TRUST_PROXY') and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or 'unknown'
+
+
+def _record_rejection(endpoint, dimension):
+    with _backend_lock:
+        _rejections[(endpoint, dimension)] = _rejections.get((endpoint, dimension), 0) + 1
+
+
+def get_rejection_counts() -> dict:
+    """Get the number of rejected requests per 'endpoint:dimension'."""
+    with _backend_lock:
+        return {f"{endpoint}:{dimension}": count for (endpoint, dimension), count in _rejections.items()}
+
+
+def check_rate_limit(endpoint, email=None):
+    """Count a request against its limits.
+
+    Returns (dimension, window seconds) of the first limit that rejected the
+    request, or None if it is allowed.
+    """
+    if not current_app.config.get('RATE_LIMIT_ENABLED', True):
+        return None
+
+    limits = current_app.config.get('RATE_LIMITS', DEFAULT_RATE_LIMITS).get(endpoint, {})
+    backend = get_backend()
+    now = time.time()
+
+    keys = {'ip': _client_ip()}
+    if email:
+        keys['email'] = email.strip().lower()
+
+    for dimension, (limit, window) in limits.items():
+        if dimension not in keys:
+            continue
+        if not backend.hit(f"{endpoint}:{dimension}:{keys[dimension]}", limit, window, now):
+            _record_rejection(endpoint, dimension)
+            return dimension, window
+    return None
+
+
+def rate_limited(endpoint, email_field=None, json_response=False):
+    """Reject POST requests over the configured limits before the view runs any query or hash."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method == 'POST':
+                email = request.form.get(email_field) if email_field else None
+                rejected = check_rate_limit(endpoint, email)
+                if rejected:
+                    dimension, window = rejected
+                    current_app.logger.warning('Rate limit exceeded on %s by %s from %s', endpoint, dimension, _client_ip())
+                    message = 'Too many attempts. Please wait a moment and try again.'
+                    headers = {'Retry-After': str(window)}
+                    if json_response:
+                        return jsonify({'available': False, 'message': message}), 429, headers
+                    return render_template('errors/rate_limited.html', message=message), 429, headers
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
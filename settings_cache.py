@@ -0,0 +1,117 @@
+import time
+import hashlib
+from threading import Lock
+from typing import NamedTuple, Optional
+from datetime import datetime
+from flask import current_app, g, has_request_context
+
+# Default settings used when no row exists or the database is unavailable
+DEFAULT_SETTINGS = {
+    'site_title': 'Market Harvest',
+    'welcome_message': 'Welcome to our vibrant community!',
+    'footer_text': '© 2024 Market Harvest. All rights reserved.',
+    'default_theme': 'autumn',
+    'site_icon': None
+}
+
+# Seconds a worker trusts its cached snapshot before re-checking updated_at
+DEFAULT_CACHE_TTL = 30
+
+
+class SettingsSnapshot(NamedTuple):
+    """Immutable view of the site settings shared by every request in a worker."""
+    site_title: str
+    welcome_message: Optional[str]
+    footer_text: Optional[str]
+    default_theme: str
+    site_icon: Optional[str]
+    updated_at: Optional[datetime]
+    version: int
+    icon_etag: Optional[str]
+
+
+_lock = Lock()
+_snapshot: Optional[SettingsSnapshot] = None
+_checked_at = 0.0
+_version = 0
+
+
+def _icon_etag(site_icon: Optional[str], updated_at: Optional[datetime]) -> Optional[str]:
+    if not site_icon:
+        return None
+    stamp = updated_at.isoformat() if updated_at else ''
+    return hashlib.sha1(stamp.encode()).hexdigest()[:16]
+
+
+def _build_snapshot(settings) -> SettingsSnapshot:
+    if settings is None:
+        return SettingsSnapshot(updated_at=None, version=_version, icon_etag=None, **DEFAULT_SETTINGS)
+
+    return SettingsSnapshot(
+        site_title=settings.site_title or DEFAULT_SETTINGS['site_title'],
+        welcome_message=settings.welcome_message or DEFAULT_SETTINGS['welcome_message'],
+        footer_text=settings.footer_text or DEFAULT_SETTINGS['footer_text'],
+        default_theme=settings.default_theme or DEFAULT_SETTINGS['default_theme'],
+        site_icon=settings.site_icon,
+        updated_at=settings.updated_at,
+        version=_version,
+        icon_etag=_icon_etag(settings.site_icon, settings.updated_at)
+    )
+
+
+def _load_snapshot() -> SettingsSnapshot:
+    """Return the worker snapshot, reloading it when stale or invalidated."""
+    global _snapshot, _checked_at, _version
+    from models import SiteSettings
+
+    ttl = current_app.config.get('SITE_SETTINGS_CACHE_TTL', DEFAULT_CACHE_TTL)
+    now = time.monotonic()
+    snapshot = _snapshot
+    if snapshot is not None and now - _checked_at < ttl:
+        return snapshot
+
+    with _lock:
+        if _snapshot is not None and now - _checked_at < ttl:
+            return _snapshot
+
+        if _snapshot is not None:
+            # Cheap revalidation: only reload the full row when another worker saved it
+            updated_at = SiteSettings.query.with_entities(SiteSettings.updated_at) \
+                .filter_by(id=SiteSettings.SINGLETON_ID).scalar()
+            if updated_at == _snapshot.updated_at:
+                _checked_at = now
+                return _snapshot
+            _version += 1
+
+        settings = SiteSettings.get_settings()
+        _snapshot = _build_snapshot(settings)
+        _checked_at = now
+        current_app.logger.debug('Site settings snapshot loaded (version %s)', _snapshot.version)
+        return _snapshot
+
+
+def get_site_settings() -> SettingsSnapshot:
+    """Get the site settings snapshot, computed at most once per request."""
+    if has_request_context() and 'site_settings' in g:
+        return g.site_settings
+
+    try:
+        snapshot = _load_snapshot()
+    except Exception as e:
+        current_app.logger.error('Error loading site settings: %s', e)
+        snapshot = _snapshot or _build_snapshot(None)
+
+    if has_request_context():
+        g.site_settings = snapshot
+    return snapshot
+
+
+def invalidate_site_settings():
+    """Drop the cached snapshot so the next request reloads it from the database."""
+    global _snapshot, _checked_at, _version
+    with _lock:
+        _snapshot = None
+        _checked_at = 0.0
+        _version += 1
+    if has_request_context():
+        g.pop('site_settings', None)
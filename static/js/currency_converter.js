@@ -39,8 +39,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 
                 if (response.ok) {
                     showResult(data.message, 'success');
-                    // Refresh the page to update balances
-                    setTimeout(() => window.location.reload(), 1500);
+                    updateBalances(data.balance);
                 } else {
                     showResult(data.error || 'Conversion failed', 'error');
                 }
@@ -51,6 +50,18 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    function updateBalances(balance) {
+        if (!balance) {
+            return;
+        }
+        // Patch the displayed balances in place instead of reloading the dashboard
+        Object.keys(balance).forEach(function(currency) {
+            document.querySelectorAll(`[data-balance="${currency}"]`).forEach(function(el) {
+                el.textContent = balance[currency];
+            });
+        });
+    }
+    
     function showResult(message, type) {
         resultDiv.innerHTML = `<div class="alert alert-${type === 'success' ? 'success' : 'danger'}">${message}</div>`;
         setTimeout(() => {
@@ -88,6 +88,9 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             if (usernameValidation) {
                 usernameValidation.textContent = data.message;
+                if (data.suggestions && data.suggestions.length) {
+                    usernameValidation.textContent += ' - try ' + data.suggestions.join(', ');
+                }
                 if (data.available) {
                     usernameValidation.classList.remove('text-danger', 'text-muted');
                     usernameValidation.classList.add('text-success');
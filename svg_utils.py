@@ -0,0 +1,58 @@
+import re
+import xml.etree.ElementTree as ET
+
+SVG_NAMESPACE = 'http://www.w3.org/2000/svg'
+XLINK_NAMESPACE = 'http://www.w3.org/1999/xlink'
+
+ET.register_namespace('', SVG_NAMESPACE)
+ET.register_namespace('xlink', XLINK_NAMESPACE)
+
+# Elements that can execute script or embed foreign documents
+FORBIDDEN_ELEMENTS = {'script', 'foreignObject', 'iframe', 'object', 'embed', 'handler'}
+
+_UNSAFE_URL = re.compile(r'^\s*(javascript|vbscript|data:text/html)', re.IGNORECASE)
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _clean(element: ET.Element):
+    for child in list(element):
+        if _local_name(child.tag) in FORBIDDEN_ELEMENTS:
+            element.remove(child)
+            continue
+        _clean(child)
+
+    for name, value in list(element.attrib.items()):
+        local = _local_name(name)
+        if local.lower().startswith('on') or (local == 'href' and _UNSAFE_URL.match(value)):
+            del element.attrib[name]
+
+    # Drop indentation between tags, keep real text content
+    if element.text and not element.text.strip():
+        element.text = None
+    if element.tail and not element.tail.strip():
+        element.tail = None
+
+
+def sanitize_svg(svg_text: str) -> str:
+    """Sanitize and minify admin supplied SVG markup.
+
+    Removes scripting elements, event handler attributes, javascript: links,
+    comments and insignificant whitespace. Raises ValueError if the markup is
+    not a well-formed SVG document.
+    """
+    if re.search(r'<!(DOCTYPE|ENTITY)', svg_text, re.IGNORECASE):
+        raise ValueError('SVG icons may not contain DOCTYPE or ENTITY declarations')
+
+    try:
+        root = ET.fromstring(svg_text.strip())
+    except ET.ParseError as e:
+        raise ValueError(f'Invalid SVG markup: {str(e)}')
+
+    if _local_name(root.tag) != 'svg':
+        raise ValueError('Site icon must be an <svg> element')
+
+    _clean(root)
+    return ET.tostring(root, encoding='unicode', short_empty_elements=True)
@@ -0,0 +1,64 @@
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from markupsafe import Markup, escape
+import pytz
+
+# Built once per process; pytz.common_timezones is a lazily evaluated list
+TIMEZONE_NAMES = tuple(pytz.common_timezones)
+VALID_TIMEZONES = frozenset(TIMEZONE_NAMES)
+DEFAULT_TIMEZONE = 'UTC'
+
+
+def is_valid_timezone(name) -> bool:
+    return name in VALID_TIMEZONES
+
+
+@lru_cache(maxsize=None)
+def get_zone(name) -> ZoneInfo:
+    """Get a cached zoneinfo object for a timezone name."""
+    return ZoneInfo(name)
+
+
+def _offset_label(name, now) -> str:
+    offset = now.astimezone(get_zone(name)).utcoffset()
+    minutes = int(offset.total_seconds() // 60)
+    sign = '+' if minutes >= 0 else '-'
+    hours, minutes = divmod(abs(minutes), 60)
+    return f"UTC{sign}{hours:02d}:{minutes:02d}"
+
+
+def _build_groups():
+    """Group zones by region with their UTC offset at process start."""
+    now = datetime.now(get_zone('UTC'))
+    groups = {}
+    for name in TIMEZONE_NAMES:
+        region = name.split('/', 1)[0] if '/' in name else 'Other'
+        groups.setdefault(region, []).append((name, _offset_label(name, now)))
+    # Keep UTC, GMT and friends at the end of the list
+    if 'Other' in groups:
+        groups['Other'] = groups.pop('Other')
+    return groups
+
+
+TIMEZONE_GROUPS = _build_groups()
+
+
+@lru_cache(maxsize=1)
+def _options_markup() -> str:
+    parts = []
+    for region, zones in TIMEZONE_GROUPS.items():
+        parts.append(f'<optgroup label="{escape(region)}">')
+        for name, offset in zones:
+            parts.append(f'<option value="{escape(name)}">{escape(name)} ({offset})</option>')
+        parts.append('</optgroup>')
+    return ''.join(parts)
+
+
+def timezone_options(selected=DEFAULT_TIMEZONE) -> Markup:
+    """Get the pre-rendered <option> list for a timezone select with one zone selected."""
+    markup = _options_markup()
+    if selected in VALID_TIMEZONES:
+        value = f'<option value="{escape(selected)}">'
+        markup = markup.replace(value, f'<option value="{escape(selected)}" selected>', 1)
+    return Markup(markup)
@@ -0,0 +1,87 @@
+import hmac
+import hashlib
+from typing import Optional
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from extensions import db
+from models import User
+
+PURPOSE_VERIFY_EMAIL = 'verify-email'
+PURPOSE_RESET_PASSWORD = 'reset-password'
+
+# Legacy random tokens stored on the user row, accepted until purged
+LEGACY_TOKEN_COLUMNS = {
+    PURPOSE_VERIFY_EMAIL: 'verification_token',
+    PURPOSE_RESET_PASSWORD: 'reset_token',
+}
+
+MAX_AGE_CONFIG = {
+    PURPOSE_VERIFY_EMAIL: ('VERIFY_TOKEN_MAX_AGE', 3 * 24 * 3600),
+    PURPOSE_RESET_PASSWORD: ('RESET_TOKEN_MAX_AGE', 3600),
+}
+
+
+def _serializer(purpose):
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=f'harvest-market-{purpose}')
+
+
+def _fingerprint(user, purpose) -> str:
+    """Hash of the state a token consumes, so each token works only once.
+
+    Verifying flips email_verified and resetting replaces password_hash, so
+    either change invalidates every token issued before it.
+    """
+    if purpose == PURPOSE_VERIFY_EMAIL:
+        state = f"{user.email}|{bool(user.email_verified)}"
+    else:
+        state = user.password_hash or ''
+    return hashlib.sha256(state.encode('utf-8')).hexdigest()[:16]
+
+
+def generate_token(user, purpose) -> str:
+    """Create a signed, time-limited token for user. The user must have an id."""
+    return _serializer(purpose).dumps({'uid': user.id, 'fp': _fingerprint(user, purpose)})
+
+
+def _load_legacy_user(token, purpose) -> Optional[User]:
+    if not current_app.config.get('LEGACY_DB_TOKENS', True):
+        return None
+    column = getattr(User, LEGACY_TOKEN_COLUMNS[purpose])
+    user = User.query.filter(column == token, User.deleted_at.is_(None)).first()
+    if user:
+        current_app.logger.info('Legacy %s token used for user: %s', purpose, user.username)
+    return user
+
+
+def load_token_user(token, purpose) -> Optional[User]:
+    """Get the user a token was issued to, or None if it is invalid, expired or already used."""
+    config_key, default_max_age = MAX_AGE_CONFIG[purpose]
+    try:
+        payload = _serializer(purpose).loads(token, max_age=current_app.config.get(config_key, default_max_age))
+    except SignatureExpired:
+        return None
+    except BadSignature:
+        return _load_legacy_user(token, purpose)
+
+    user = db.session.get(User, payload.get('uid'))
+    if user is None or user.deleted_at is not None or not hmac.compare_digest(str(payload.get('fp', '')), _fingerprint(user, purpose)):
+        return None
+    return user
+
+
+def clear_legacy_token(user, purpose):
+    """Drop a consumed legacy token, without touching users that never had one."""
+    column = LEGACY_TOKEN_COLUMNS[purpose]
+    if getattr(user, column) is not None:
+        setattr(user, column, None)
+
+
+def purge_legacy_tokens() -> int:
+    """Clear every stored legacy token. Returns the number of users updated."""
+    result = db.session.execute(
+        User.__table__.update()
+        .where(User.verification_token.isnot(None) | User.reset_token.isnot(None))
+        .values(verification_token=None, reset_token=None)
+    )
+    db.session.commit()
+    return result.rowcount
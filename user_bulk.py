@@ -0,0 +1,117 @@
+import uuid
+from typing import NamedTuple, Optional
+from flask import current_app, render_template
+from sqlalchemy import func
+from sqlalchemy.orm import load_only
+from extensions import db
+from models import User
+from mailer import enqueue_emails, notify_worker
+from platform_stats import USERS_UNVERIFIED, increment_stats
+from tokens import PURPOSE_RESET_PASSWORD, generate_token
+from user_cache import invalidate_user
+from user_deletion import delete_users, start_purge
+from user_search import unindex_users
+from username_index import forget_username
+
+ACTION_VERIFY = 'verify'
+ACTION_GRANT_ADMIN = 'grant_admin'
+ACTION_REVOKE_ADMIN = 'revoke_admin'
+ACTION_FORCE_RESET = 'force_reset'
+ACTION_DELETE = 'delete'
+
+BULK_ACTIONS = {
+    ACTION_VERIFY: 'Verify email',
+    ACTION_GRANT_ADMIN: 'Grant admin',
+    ACTION_REVOKE_ADMIN: 'Revoke admin',
+    ACTION_FORCE_RESET: 'Force password reset',
+    ACTION_DELETE: 'Delete',
+}
+# An admin cannot apply these to their own account, same as the single-user views
+SELF_EXCLUDED_ACTIONS = (ACTION_REVOKE_ADMIN, ACTION_FORCE_RESET, ACTION_DELETE)
+MAX_BULK_USERS = 500
+
+
+class BulkResult(NamedTuple):
+    """Outcome of a bulk action; batch_id identifies the queued emails, if any."""
+    action: str
+    requested: int
+    affected: int
+    batch_id: Optional[str]
+
+
+def _set_flag(user_ids, column, value) -> list:
+    """Set a boolean column on every user where it differs and return the changed ids."""
+    users = User.__table__
+    return db.session.execute(
+        users.update()
+        .where(users.c.id.in_(user_ids), users.c.deleted_at.is_(None),
+               func.coalesce(users.c[column], False) != value)
+        # Core updates skip bump_user_version, so bump it here for the identity cache
+        .values({users.c[column]: value, users.c.version: users.c.version + 1})
+        .returning(users.c.id)
+    ).scalars().all()
+
+
+def _queue_resets(user_ids, batch_id) -> int:
+    """Queue one reset email per user with a single multi-row outbox insert."""
+    users = User.query.options(
+        load_only(User.id, User.username, User.email, User.first_name, User.password_hash)
+    ).filter(User.id.in_(user_ids), User.deleted_at.is_(None)).all()
+    subject = 'Password Reset Required'
+    return enqueue_emails([
+        (user.email, subject, render_template('emails/admin_reset_password.html', user=user,
+                                              token=generate_token(user, PURPOSE_RESET_PASSWORD)))
+        for user in users
+    ], batch_id=batch_id)
+
+
+def apply_bulk_action(action: str, user_ids, acting_user) -> BulkResult:
+    """Apply one admin action to many users in a single transaction.
+
+    Every action is a handful of set-based statements regardless of how many
+    users are selected. Core writes skip the mapper events, so the platform
+    counters and this worker's caches and indexes are updated here.
+    """
+    if action not in BULK_ACTIONS:
+        raise ValueError(f"Unknown bulk action: {action}")
+    user_ids = sorted(set(user_ids))
+    requested = len(user_ids)
+    if action in SELF_EXCLUDED_ACTIONS:
+        user_ids = [user_id for user_id in user_ids if user_id != acting_user.id]
+
+    changed, batch_id = [], None
+    deleted = None
+    try:
+        if not user_ids:
+            affected = 0
+        elif action == ACTION_VERIFY:
+            changed = _set_flag(user_ids, 'email_verified', True)
+            increment_stats({USERS_UNVERIFIED: -len(changed)})
+            affected = len(changed)
+        elif action in (ACTION_GRANT_ADMIN, ACTION_REVOKE_ADMIN):
+            changed = _set_flag(user_ids, 'is_admin', action == ACTION_GRANT_ADMIN)
+            affected = len(changed)
+        elif action == ACTION_FORCE_RESET:
+            batch_id = uuid.uuid4().hex
+            affected = _queue_resets(user_ids, batch_id)
+        else:
+            deleted = delete_users(user_ids)
+            changed = [row.id for row in deleted.removed + deleted.scheduled]
+            affected = len(changed)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for user_id in changed:
+        invalidate_user(user_id)
+    if deleted:
+        # Scheduled users keep their username until the purge removes the row
+        for row in deleted.removed:
+            forget_username(row.username)
+        unindex_users(changed)
+        if deleted.scheduled and current_app.config.get('USER_PURGE_IN_PROCESS', True):
+            start_purge(current_app._get_current_object())
+    if batch_id and affected:
+        notify_worker()
+    return BulkResult(action=action, requested=requested, affected=affected, batch_id=batch_id if affected else None)
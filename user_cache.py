@@ -0,0 +1,114 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from flask import current_app
+from sqlalchemy.orm import joinedload, load_only
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+from extensions import db
+from models import User, UserBalance
+
+# Columns templates and views read from current_user; anything else
+# (password_hash, tokens, ...) is lazy-loaded on first access
+USER_COLUMNS = ('id', 'username', 'email', 'first_name', 'last_name', 'timezone', 'theme',
+                'seasonal_theme', 'avatar_url', 'is_admin', 'email_verified', 'created_at', 'version')
+BALANCE_COLUMNS = ('id', 'user_id', 'dabbers', 'groots', 'petalins', 'florens', 'last_updated')
+
+_lock = Lock()
+# user_id -> (expires_at, user values, balance values or None)
+_entries = OrderedDict()
+
+
+def _load(user_id):
+    """Load a user and their balance in one joined query and snapshot the loaded columns."""
+    user = db.session.query(User).options(
+        load_only(*[getattr(User, column) for column in USER_COLUMNS]),
+        joinedload(User.balance).load_only(*[getattr(UserBalance, column) for column in BALANCE_COLUMNS])
+    ).filter(User.id == user_id, User.deleted_at.is_(None)).first()
+    if user is None:
+        return None, None
+
+    user_values = {column: getattr(user, column) for column in USER_COLUMNS}
+    balance_values = None
+    if user.balance is not None:
+        balance_values = {column: getattr(user.balance, column) for column in BALANCE_COLUMNS}
+    return user, (user_values, balance_values)
+
+
+def _attach(user_values, balance_values):
+    """Rebuild a cached snapshot as a clean, persistent User in the current session."""
+    user = User(**user_values)
+    balance = UserBalance(**balance_values) if balance_values is not None else None
+    set_committed_value(user, 'balance', balance)
+    make_transient_to_detached(user)
+    if balance is not None:
+        make_transient_to_detached(balance)
+    return db.session.merge(user, load=False)
+
+
+def _is_current(user_id, user_values, balance_values) -> bool:
+    """Check the cached versions against the database with a single narrow query."""
+    row = db.session.query(User.version, UserBalance.last_updated).outerjoin(
+        UserBalance, UserBalance.user_id == User.id
+    ).filter(User.id == user_id).first()
+    if row is None:
+        return False
+    cached_balance_marker = balance_values['last_updated'] if balance_values else None
+    return row.version == user_values['version'] and row.last_updated == cached_balance_marker
+
+
+def load_request_user(user_id):
+    """Get the user for the current request, serving from the per-worker cache when fresh.
+
+    Within USER_CACHE_TTL no query runs at all; after that the entry is
+    revalidated by version before being reused. Local writes invalidate
+    entries immediately, writes in other workers are picked up on revalidation.
+    """
+    ttl = current_app.config.get('USER_CACHE_TTL', 5)
+    if ttl <= 0:
+        return _load(user_id)[0]
+
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(user_id)
+
+    if entry is not None:
+        expires_at, user_values, balance_values = entry
+        if now < expires_at:
+            return _attach(user_values, balance_values)
+        if _is_current(user_id, user_values, balance_values):
+            with _lock:
+                _entries[user_id] = (now + ttl, user_values, balance_values)
+                _entries.move_to_end(user_id)
+            return _attach(user_values, balance_values)
+
+    user, snapshot = _load(user_id)
+    if user is None:
+        invalidate_user(user_id)
+        return None
+
+    with _lock:
+        _entries[user_id] = (now + ttl, *snapshot)
+        _entries.move_to_end(user_id)
+        while len(_entries) > current_app.config.get('USER_CACHE_SIZE', 10000):
+            _entries.popitem(last=False)
+    return user
+
+
+def invalidate_user(user_id):
+    """Drop a user's cached identity in this worker."""
+    with _lock:
+        _entries.pop(user_id, None)
+
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+
+
+@db.event.listens_for(UserBalance, 'after_insert')
+@db.event.listens_for(UserBalance, 'after_update')
+@db.event.listens_for(UserBalance, 'after_delete')
+def _balance_changed(mapper, connection, target):
+    invalidate_user(target.user_id)
@@ -0,0 +1,138 @@
+from collections import Counter
+from datetime import datetime
+from threading import Lock, Thread
+from typing import NamedTuple
+from flask import current_app
+from sqlalchemy import func, select
+from extensions import db
+from models import User, UserBalance, TransactionHistory, TransactionType
+from platform_stats import (CURRENCY_COLUMNS, USERS_TOTAL, USERS_UNVERIFIED, forget_conversions,
+                            increment_stats, record_conversions)
+from username_index import forget_username
+
+DEFAULT_INLINE_LEDGER_ROWS = 10000
+DEFAULT_PURGE_CHUNK_SIZE = 5000
+
+
+class DeletedUsers(NamedTuple):
+    """(id, username, email_verified) rows removed right away and rows left for the purge job."""
+    removed: list
+    scheduled: list
+
+
+def _large_ledger_ids(user_ids, limit) -> set:
+    """Ids of users with more than limit ledger entries, probing at most limit + 1 index entries each."""
+    ledger = TransactionHistory.__table__
+    beyond_limit = select(ledger.c.id).where(ledger.c.user_id == User.id).order_by(ledger.c.id).offset(limit).limit(1)
+    return set(db.session.scalars(select(User.id).where(User.id.in_(user_ids), beyond_limit.exists())))
+
+
+def delete_users(user_ids) -> DeletedUsers:
+    """Delete users without loading their dependent rows; nothing is committed.
+
+    The database cascades the delete to balances, checkpoints and the
+    ledger. Users with more than USER_DELETE_INLINE_LEDGER_ROWS ledger
+    entries are only marked deleted_at, which hides them everywhere, and
+    purge_deleted_users removes them later in chunks.
+    """
+    rows = db.session.query(User.id, User.username, User.email_verified).filter(
+        User.id.in_(user_ids), User.deleted_at.is_(None)
+    ).all()
+    if not rows:
+        return DeletedUsers(removed=[], scheduled=[])
+    ids = [row.id for row in rows]
+    large = _large_ledger_ids(ids, current_app.config.get('USER_DELETE_INLINE_LEDGER_ROWS', DEFAULT_INLINE_LEDGER_ROWS))
+    removed = [row for row in rows if row.id not in large]
+    scheduled = [row for row in rows if row.id in large]
+
+    # Accounts leave the counters now; their daily conversions leave as their ledger rows do
+    totals = db.session.query(
+        *[func.coalesce(func.sum(getattr(UserBalance, column)), 0) for column in CURRENCY_COLUMNS]
+    ).filter(UserBalance.user_id.in_(ids)).one()
+    deltas = {USERS_TOTAL: -len(rows), USERS_UNVERIFIED: -sum(1 for row in rows if not row.email_verified)}
+    deltas.update({column: -total for column, total in zip(CURRENCY_COLUMNS, totals)})
+    increment_stats(deltas)
+
+    users = User.__table__
+    if scheduled:
+        db.session.execute(users.update().where(users.c.id.in_(large)).values({
+            users.c.deleted_at: datetime.utcnow(),
+            # Core updates skip bump_user_version; cached identities must revalidate
+            users.c.version: users.c.version + 1
+        }))
+    if removed:
+        removed_ids = [row.id for row in removed]
+        forget_conversions(removed_ids)
+        db.session.execute(users.delete().where(users.c.id.in_(removed_ids)))
+    return DeletedUsers(removed=removed, scheduled=scheduled)
+
+
+def _purge_ledger_chunk(user_id, chunk_size) -> int:
+    """Delete the oldest chunk_size ledger entries of a user; nothing is committed."""
+    ledger = TransactionHistory.__table__
+    chunk = select(ledger.c.id).where(ledger.c.user_id == user_id).order_by(ledger.c.id).limit(chunk_size)
+    # RETURNING only reports rows this run actually deleted, even if two purges overlap
+    deleted = db.session.execute(
+        ledger.delete().where(ledger.c.user_id == user_id, ledger.c.id.in_(chunk))
+        .returning(ledger.c.timestamp, ledger.c.transaction_type)
+    ).all()
+    conversions = Counter(row.timestamp.date() for row in deleted
+                          if row.transaction_type == TransactionType.CONVERSION.value)
+    for day, count in conversions.items():
+        record_conversions(-count, day)
+    return len(deleted)
+
+
+def purge_deleted_users(chunk_size: int = None) -> dict:
+    """Remove every user marked deleted, committing after each ledger chunk.
+
+    Each transaction touches at most chunk_size ledger rows, so locks are
+    short and the job can be stopped and resumed at any point.
+    Returns {'users': purged users, 'transactions': deleted ledger rows}.
+    """
+    chunk_size = chunk_size or current_app.config.get('USER_PURGE_CHUNK_SIZE', DEFAULT_PURGE_CHUNK_SIZE)
+    purged = {'users': 0, 'transactions': 0}
+    while True:
+        user = db.session.query(User.id, User.username).filter(
+            User.deleted_at.isnot(None)
+        ).order_by(User.deleted_at, User.id).first()
+        if user is None:
+            return purged
+
+        while True:
+            deleted = _purge_ledger_chunk(user.id, chunk_size)
+            db.session.commit()
+            purged['transactions'] += deleted
+            if deleted < chunk_size:
+                break
+
+        # What is left (balance, checkpoints) is small; the cascade takes it with the user
+        db.session.execute(User.__table__.delete().where(User.__table__.c.id == user.id))
+        db.session.commit()
+        forget_username(user.username)
+        purged['users'] += 1
+        current_app.logger.info('Purged deleted user %s', user.username)
+
+
+_purge_lock = Lock()
+
+
+def start_purge(app) -> bool:
+    """Run purge_deleted_users in a background thread unless one is already running in this process."""
+    if not _purge_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        with app.app_context():
+            try:
+                purged = purge_deleted_users()
+                app.logger.info('User purge finished: %s users, %s transactions', purged['users'], purged['transactions'])
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error('User purge error: %s', e)
+            finally:
+                db.session.remove()
+                _purge_lock.release()
+
+    Thread(target=run, name='user-purge', daemon=True).start()
+    return True
@@ -0,0 +1,68 @@
+from typing import NamedTuple, Optional, Tuple
+from flask import current_app
+from sqlalchemy import text
+from extensions import db
+from models import User
+
+DEFAULT_USERS_PER_PAGE = 25
+MAX_USERS_PER_PAGE = 100
+
+
+class UserPage(NamedTuple):
+    """One keyset page of users with the cursors of its neighbours (None at either end)."""
+    items: list
+    next_cursor: Optional[int]
+    prev_cursor: Optional[int]
+
+
+def get_user_page(after: Optional[int] = None, before: Optional[int] = None, per_page: int = DEFAULT_USERS_PER_PAGE,
+                  newest_first: bool = False, options=()) -> UserPage:
+    """Get one page of users ordered by id using keyset pagination.
+
+    after/before are the ids at the edge of the neighbouring page, so every
+    page is a primary key range scan no matter how deep it is.
+    """
+    per_page = max(1, min(per_page, MAX_USERS_PER_PAGE))
+    query = User.query.options(*options).filter(User.deleted_at.is_(None))
+    backwards = before is not None
+
+    if backwards:
+        query = query.filter(User.id > before if newest_first else User.id < before)
+        ascending = newest_first
+    else:
+        if after is not None:
+            query = query.filter(User.id < after if newest_first else User.id > after)
+        ascending = not newest_first
+
+    # Fetch one extra row to know whether there is a further page without a COUNT
+    users = query.order_by(User.id.asc() if ascending else User.id.desc()).limit(per_page + 1).all()
+    has_more = len(users) > per_page
+    users = users[:per_page]
+    if backwards:
+        users.reverse()
+
+    if not users:
+        return UserPage(items=[], next_cursor=None, prev_cursor=None)
+    if backwards:
+        next_cursor = users[-1].id
+        prev_cursor = users[0].id if has_more else None
+    else:
+        next_cursor = users[-1].id if has_more else None
+        prev_cursor = users[0].id if after is not None else None
+    return UserPage(items=users, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def count_users() -> Tuple[int, bool]:
+    """Get the number of users and whether it is an estimate.
+
+    In 'approximate' mode PostgreSQL's planner statistics are used once the
+    table is large enough that an exact COUNT(*) would be a noticeable scan.
+    """
+    if current_app.config.get('ADMIN_USER_COUNT_MODE', 'approximate') == 'approximate' \
+            and db.session.get_bind().dialect.name == 'postgresql':
+        estimate = db.session.execute(text(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = '\"user\"'::regclass"
+        )).scalar()
+        if estimate is not None and estimate >= current_app.config.get('ADMIN_EXACT_COUNT_THRESHOLD', 100000):
+            return int(estimate), True
+    return User.query.filter(User.deleted_at.is_(None)).count(), False
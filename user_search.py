@@ -0,0 +1,275 @@
+import time
+import heapq
+from bisect import bisect_left
+from threading import Lock
+from typing import NamedTuple
+from flask import current_app
+from sqlalchemy import inspect, text
+from extensions import db
+from models import User
+
+SEARCH_FIELDS = ('username', 'email', 'first_name', 'last_name')
+PREFIX_FIELDS = ('username', 'email')
+
+# Match quality, best first; ties are broken by how much of the field the term covers
+SCORE_EXACT = 100
+SCORE_PREFIX = 50
+SCORE_NAME_PREFIX = 30
+SCORE_SUBSTRING = 10
+
+
+class SearchPage(NamedTuple):
+    """One page of ranked search results, shaped like a Flask-SQLAlchemy pagination."""
+    items: list
+    page: int
+    pages: int
+    total: int
+    capped: bool = False  # More than total users matched; only the best total are ranked
+
+
+def _escape_like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _trigrams(value: str) -> set:
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def score_match(term: str, values: dict) -> float:
+    """Score how well a lowercased term matches a user's lowercased fields (0 = no match)."""
+    best = 0.0
+    for field, value in values.items():
+        if not value or term not in value:
+            continue
+        coverage = len(term) / len(value)
+        if value == term and field in PREFIX_FIELDS:
+            score = SCORE_EXACT
+        elif value.startswith(term):
+            score = SCORE_PREFIX if field in PREFIX_FIELDS else SCORE_NAME_PREFIX
+        else:
+            score = SCORE_SUBSTRING
+        best = max(best, score + coverage)
+    return best
+
+
+class NgramIndex:
+    """In-process trigram index over user search fields, for databases without pg_trgm.
+
+    Substring searches intersect the posting sets of the term's trigrams and
+    then verify the candidates against the stored fields; terms shorter than
+    a trigram fall back to prefix lookups on sorted username/email lists.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.postings = {}
+        self.prefixes = {field: [] for field in PREFIX_FIELDS}
+        self.max_user_id = 0
+        self.loaded_at = time.monotonic()
+        self.refreshed_at = self.loaded_at
+
+    def add(self, user_id, values, keep_sorted=True):
+        if user_id in self.documents:
+            self.remove(user_id)
+        values = {field: (values.get(field) or '').lower() for field in SEARCH_FIELDS}
+        self.documents[user_id] = values
+        for value in values.values():
+            for trigram in _trigrams(value):
+                self.postings.setdefault(trigram, set()).add(user_id)
+        for field in PREFIX_FIELDS:
+            entries = self.prefixes[field]
+            if keep_sorted:
+                entries.insert(bisect_left(entries, (values[field], user_id)), (values[field], user_id))
+            else:
+                entries.append((values[field], user_id))
+        self.max_user_id = max(self.max_user_id, user_id)
+
+    def remove(self, user_id):
+        values = self.documents.pop(user_id, None)
+        if values is None:
+            return
+        for value in values.values():
+            for trigram in _trigrams(value):
+                postings = self.postings.get(trigram)
+                if postings is not None:
+                    postings.discard(user_id)
+        for field in PREFIX_FIELDS:
+            entries = self.prefixes[field]
+            position = bisect_left(entries, (values[field], user_id))
+            if position < len(entries) and entries[position] == (values[field], user_id):
+                del entries[position]
+
+    def _prefix_candidates(self, term):
+        candidates = set()
+        for entries in self.prefixes.values():
+            position = bisect_left(entries, (term, 0))
+            while position < len(entries) and entries[position][0].startswith(term):
+                candidates.add(entries[position][1])
+                position += 1
+        return candidates
+
+    def search(self, term, limit):
+        """Get up to limit (user_id, score) pairs, best first."""
+        if len(term) < 3:
+            candidates = self._prefix_candidates(term)
+        else:
+            postings = [self.postings.get(trigram, set()) for trigram in _trigrams(term)]
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:]) if postings else set()
+
+        scored = []
+        for user_id in candidates:
+            score = score_match(term, self.documents[user_id])
+            if score:
+                scored.append((user_id, score))
+        return heapq.nsmallest(limit, scored, key=lambda match: (-match[1], match[0]))
+
+
+_lock = Lock()
+_index = None
+
+
+def _load_index():
+    index = NgramIndex()
+    rows = db.session.query(User.id, *[getattr(User, field) for field in SEARCH_FIELDS]).filter(
+        User.deleted_at.is_(None)).execution_options(yield_per=5000)
+    for row in rows:
+        index.add(row.id, row._asdict(), keep_sorted=False)
+    for entries in index.prefixes.values():
+        entries.sort()
+    return index
+
+
+def _get_index() -> NgramIndex:
+    """Get this worker's search index, picking up new users and periodically rebuilding.
+
+    The queries run outside _lock: an autoflush inside them fires _index_user,
+    which takes the lock itself.
+    """
+    global _index
+    now = time.monotonic()
+    with _lock:
+        index = _index
+    if index is None or now - index.loaded_at > current_app.config.get('USER_SEARCH_REBUILD_INTERVAL', 600):
+        with db.session.no_autoflush:
+            index = _load_index()
+        with _lock:
+            _index = index
+    elif now - index.refreshed_at > current_app.config.get('USER_SEARCH_REFRESH_INTERVAL', 5):
+        # Users created by other workers; edits there are picked up by the next rebuild
+        with db.session.no_autoflush:
+            rows = db.session.query(User.id, *[getattr(User, field) for field in SEARCH_FIELDS]).filter(
+                User.id > index.max_user_id, User.deleted_at.is_(None)).all()
+        with _lock:
+            for row in rows:
+                index.add(row.id, row._asdict())
+            index.refreshed_at = now
+    return index
+
+
+def _search_postgres(term, limit):
+    """Rank matches with pg_trgm; the WHERE clause is served by the trigram and prefix indexes."""
+    if len(term) < 3:
+        # Too short for trigrams: prefix lookups on the text_pattern_ops indexes
+        where = "lower(username) LIKE :prefix OR lower(email) LIKE :prefix"
+    else:
+        where = ("username ILIKE :pattern OR email ILIKE :pattern "
+                 "OR first_name ILIKE :pattern OR last_name ILIKE :pattern")
+    rows = db.session.execute(text(f"""
+        SELECT id,
+               CASE
+                   WHEN lower(username) = :term OR lower(email) = :term THEN {SCORE_EXACT}
+                   WHEN lower(username) LIKE :prefix OR lower(email) LIKE :prefix THEN {SCORE_PREFIX}
+                   WHEN lower(first_name) LIKE :prefix OR lower(last_name) LIKE :prefix THEN {SCORE_NAME_PREFIX}
+                   ELSE {SCORE_SUBSTRING}
+               END + greatest(similarity(username, :term), similarity(email, :term),
+                              similarity(first_name, :term), similarity(last_name, :term)) AS score
+        FROM "user"
+        WHERE deleted_at IS NULL AND ({where})
+        ORDER BY score DESC, id
+        LIMIT :limit
+    """), {
+        'term': term,
+        'prefix': f"{_escape_like(term)}%",
+        'pattern': f"%{_escape_like(term)}%",
+        'limit': limit
+    })
+    return [(row.id, row.score) for row in rows]
+
+
+def search_user_ids(term: str, limit: int = None) -> list:
+    """Get the ids of users matching term in any search field, best match first."""
+    term = (term or '').strip().lower()
+    if not term:
+        return []
+    limit = limit or current_app.config.get('USER_SEARCH_LIMIT', 200)
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        matches = _search_postgres(term, limit)
+    else:
+        matches = _get_index().search(term, limit)
+    return [user_id for user_id, _ in matches]
+
+
+def search_users(term: str, page: int = 1, per_page: int = 10, options=()) -> SearchPage:
+    """Get one page of ranked search results as User objects.
+
+    Only the best USER_SEARCH_LIMIT matches are ranked; capped tells the
+    caller that more users matched.
+    """
+    limit = current_app.config.get('USER_SEARCH_LIMIT', 200)
+    user_ids = search_user_ids(term, limit + 1)
+    capped = len(user_ids) > limit
+    user_ids = user_ids[:limit]
+    pages = max(1, -(-len(user_ids) // per_page))
+    page = min(max(page, 1), pages)
+    page_ids = user_ids[(page - 1) * per_page:page * per_page]
+
+    users = User.query.options(*options).filter(User.id.in_(page_ids), User.deleted_at.is_(None)).all() if page_ids else []
+    rank = {user_id: position for position, user_id in enumerate(page_ids)}
+    users.sort(key=lambda user: rank[user.id])
+    return SearchPage(items=users, page=page, pages=pages, total=len(user_ids), capped=capped)
+
+
+def unindex_users(user_ids):
+    """Drop users deleted with Core statements, which skip the mapper events below."""
+    with _lock:
+        if _index is not None:
+            for user_id in user_ids:
+                _index.remove(user_id)
+
+
+def _index_loaded(target, loaded):
+    previous = _index.documents.get(target.id, {})
+    _index.add(target.id, {field: loaded.get(field, previous.get(field)) for field in SEARCH_FIELDS})
+
+
+@db.event.listens_for(User, 'after_insert')
+def _index_user(mapper, connection, target):
+    # Only read loaded attributes; lazy loads are not allowed during a flush
+    loaded = inspect(target).dict
+    with _lock:
+        if _index is not None and loaded.get('deleted_at') is None:
+            _index_loaded(target, loaded)
+
+
+@db.event.listens_for(User, 'after_update')
+def _reindex_user(mapper, connection, target):
+    loaded = inspect(target).dict
+    with _lock:
+        if _index is None:
+            return
+        if loaded.get('deleted_at') is not None:
+            # Soft-deleted users drop out of search like hard-deleted ones
+            _index.remove(target.id)
+        elif 'deleted_at' in loaded or target.id in _index.documents:
+            # An unloaded deleted_at was not changed, so only users already
+            # indexed (i.e. not soft-deleted) are refreshed
+            _index_loaded(target, loaded)
+
+
+@db.event.listens_for(User, 'after_delete')
+def _unindex_user(mapper, connection, target):
+    with _lock:
+        if _index is not None:
+            _index.remove(target.id)
@@ -0,0 +1,235 @@
+import math
+import time
+import hashlib
+from bisect import bisect_left, insort
+from threading import Condition, Lock
+from typing import Tuple
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_
+from extensions import db
+from models import User
+
+USERNAME_MIN_LENGTH = 3
+USERNAME_MAX_LENGTH = 20
+
+
+def validate_username(username: str) -> Tuple[bool, str]:
+    """Check a candidate username's format. Returns (valid, message)."""
+    if not username or len(username) < USERNAME_MIN_LENGTH or len(username) > USERNAME_MAX_LENGTH:
+        return False, 'Username must be between 3 and 20 characters'
+    if not username.isalnum() and '_' not in username:
+        return False, 'Username can only contain letters, numbers, and underscores'
+    return True, ''
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class UsernameIndex:
+    """Taken usernames held by this worker: a Bloom filter in front of a sorted list.
+
+    The index can lag behind other workers, so it only answers "free" on its
+    own; anything it thinks is taken is confirmed against the database.
+    Registration still relies on the database check and unique constraint.
+    """
+
+    def __init__(self, usernames, max_user_id, changed_since):
+        self.names = sorted(usernames)
+        self.max_user_id = max_user_id
+        # Rows with updated_at at or after this are re-read by the next refresh
+        self.changed_since = changed_since
+        self.loaded_at = time.monotonic()
+        self.refreshed_at = self.loaded_at
+        self._build_filter()
+
+    def _build_filter(self):
+        self.bloom = BloomFilter(max(len(self.names) * 2, 1024))
+        for name in self.names:
+            self.bloom.add(name)
+
+    def __contains__(self, username):
+        if username not in self.bloom:
+            return False
+        position = bisect_left(self.names, username)
+        return position < len(self.names) and self.names[position] == username
+
+    def add(self, username):
+        position = bisect_left(self.names, username)
+        if position < len(self.names) and self.names[position] == username:
+            return
+        insort(self.names, username)
+        if len(self.names) > self.bloom.capacity:
+            self._build_filter()
+        else:
+            self.bloom.add(username)
+
+    def remove(self, username):
+        # The Bloom filter keeps the stale bit; the sorted list settles it
+        position = bisect_left(self.names, username)
+        if position < len(self.names) and self.names[position] == username:
+            del self.names[position]
+
+
+_lock = Lock()
+_updated = Condition(_lock)
+_updating = False
+_index = None
+
+
+# updated_at is set at flush time and the row becomes visible at commit, so
+# each refresh looks back this far to catch transactions that committed late
+CHANGE_OVERLAP = timedelta(seconds=60)
+
+
+def _load_index():
+    changed_since = datetime.utcnow() - CHANGE_OVERLAP
+    rows = db.session.query(User.id, User.username).execution_options(yield_per=5000)
+    usernames = []
+    max_user_id = 0
+    for user_id, username in rows:
+        usernames.append(username)
+        max_user_id = max(max_user_id, user_id)
+    return UsernameIndex(usernames, max_user_id, changed_since)
+
+
+def get_username_index() -> UsernameIndex:
+    """Get this worker's index, picking up new and renamed users and periodically rebuilding.
+
+    One thread at a time runs the rebuild or refresh query, outside _lock;
+    the others keep answering from the current index meanwhile, or wait for
+    the first one to be built.
+    """
+    global _index, _updating
+    now = time.monotonic()
+    with _lock:
+        while True:
+            index = _index
+            rebuild = index is None or now - index.loaded_at > current_app.config.get(
+                'USERNAME_INDEX_REBUILD_INTERVAL', 300)
+            refresh = not rebuild and now - index.refreshed_at > current_app.config.get(
+                'USERNAME_INDEX_REFRESH_INTERVAL', 5)
+            if not (rebuild or refresh):
+                return index
+            if not _updating:
+                _updating = True
+                break
+            if index is not None:
+                return index
+            _updated.wait()
+
+    try:
+        if rebuild:
+            index = _load_index()
+            with _lock:
+                _index = index
+        else:
+            # Registrations and renames in other workers; names they freed are
+            # still listed here, but "taken" answers are confirmed against the database
+            changed_since = datetime.utcnow() - CHANGE_OVERLAP
+            rows = db.session.query(User.id, User.username).filter(
+                or_(User.id > index.max_user_id, User.updated_at >= index.changed_since)
+            ).all()
+            with _lock:
+                for user_id, username in rows:
+                    index.add(username)
+                    index.max_user_id = max(index.max_user_id, user_id)
+                index.changed_since = changed_since
+                index.refreshed_at = now
+    finally:
+        with _lock:
+            _updating = False
+            _updated.notify_all()
+    return index
+
+
+def record_username(username, user_id=None):
+    """Add a committed username to this worker's index."""
+    with _lock:
+        if _index is not None:
+            _index.add(username)
+            if user_id is not None:
+                _index.max_user_id = max(_index.max_user_id, user_id)
+
+
+def forget_username(username):
+    """Remove a username that was renamed or deleted from this worker's index."""
+    with _lock:
+        if _index is not None:
+            _index.remove(username)
+
+
+def _candidates(username, limit):
+    """Yield variations of a taken username that are still valid usernames."""
+    base = username[:USERNAME_MAX_LENGTH - 2]
+    for number in range(1, limit + 1):
+        candidate = f"{base}{number}"
+        if len(candidate) > USERNAME_MAX_LENGTH:
+            candidate = f"{username[:USERNAME_MAX_LENGTH - len(str(number))]}{number}"
+        yield candidate
+    for suffix in ('_', '_x', '_official'):
+        candidate = f"{username}{suffix}"
+        if len(candidate) <= USERNAME_MAX_LENGTH:
+            yield candidate
+
+
+def check_usernames(usernames, suggestion_count=3) -> dict:
+    """Check several usernames at once and suggest free alternatives for taken ones.
+
+    Names the index has never seen are answered from memory; everything else
+    is confirmed with a single IN query.
+    """
+    index = get_username_index()
+    results = {}
+    to_confirm = set()
+    suggestions = {}
+
+    for username in usernames:
+        valid, message = validate_username(username)
+        if not valid:
+            results[username] = {'available': False, 'message': message}
+            continue
+        if username in index:
+            to_confirm.add(username)
+            # Over-generate so a few stale entries still leave enough suggestions
+            suggestions[username] = [candidate for candidate in _candidates(username, suggestion_count * 3)
+                                     if candidate not in index]
+            to_confirm.update(suggestions[username])
+        else:
+            results[username] = {'available': True, 'message': 'Username available'}
+
+    if to_confirm:
+        taken = {name for (name,) in db.session.query(User.username).filter(User.username.in_(to_confirm))}
+        for username, candidates in suggestions.items():
+            if username not in taken:
+                # Freed by a rename or delete in another worker
+                forget_username(username)
+                results[username] = {'available': True, 'message': 'Username available'}
+                continue
+            results[username] = {
+                'available': False,
+                'message': 'Username already taken',
+                'suggestions': [candidate for candidate in candidates if candidate not in taken][:suggestion_count]
+            }
+
+    return results
@@ -42,7 +42,7 @@ def verify_and_fix_admin():
             
         except Exception as e:
             db.session.rollback()
-            app.logger.error(f'Error updating admin user: {str(e)}')
+            app.logger.error('Error updating admin user: %s', e)
             return False
 
 if __name__ == '__main__':